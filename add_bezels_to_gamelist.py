@@ -2,19 +2,28 @@
 
 import os
 import re
-from xml.dom import minidom
+import time
 from xml.etree import ElementTree as ET
 import logging
-
-from fuzzywuzzy import process
+from concurrent.futures import ThreadPoolExecutor
 
 import operations
-from shared import configs, common_utils, info_messages, error_messages
+from shared import configs, common_utils, info_messages, error_messages, tracing, bezel_index
 
 logger = logging.getLogger(__name__)
 
+TREE_CACHE_FILE_NAME = '.tree_cache.json'
+
+# Bump this whenever the format of the cached tree listings changes
+TREE_CACHE_VERSION = 1
+
+MATCH_CACHE_FILE_NAME = '.match_cache.json'
+
+# Bump this whenever a change to matching means earlier matches should be worked out again
+MATCH_CACHE_VERSION = 1
 
-def validate_args(input_path, platform, min_match_score):
+
+def validate_args(input_path, platform, min_match_score, jobs):
     logger.info('Validating arguments for create_gamelist')
     valid = True
     if not platform or platform not in configs.PLATFORMS.keys():
@@ -26,6 +35,8 @@ def validate_args(input_path, platform, min_match_score):
         min_match_score = common_utils.score_to_int(min_match_score)
         if not min_match_score:
             valid = False
+    if not common_utils.validate_jobs(jobs):
+        valid = False
     return valid
 
 
@@ -48,13 +59,14 @@ def clean_compare_name(name):
 
 
 def get_game_compare_name(game_data, compare_filename):
+    basename_no_ext = common_utils.get_basename_no_ext(game_data.rom_path)
     if compare_filename:
-        compare_name = clean_compare_name(game_data['basename_no_ext'])
-    elif not game_data['name']:
-        logger.info(info_messages.reverting_to_filename_compare(game_data['basename_no_ext']))
-        compare_name = clean_compare_name(game_data['basename_no_ext'])
+        compare_name = clean_compare_name(basename_no_ext)
+    elif not game_data.name:
+        logger.info(info_messages.reverting_to_filename_compare(basename_no_ext))
+        compare_name = clean_compare_name(basename_no_ext)
     else:
-        compare_name = clean_compare_name(game_data['name'])
+        compare_name = clean_compare_name(game_data.name)
     return compare_name
 
 
@@ -76,11 +88,69 @@ def get_default_data(platform_data):
     return {'url': default_url, 'local_path': default_local_path}
 
 
-def get_available_bezels(repo):
-    data = common_utils.download_data(configs.BASE_BEZEL_TREE_URL.format(repo))
-    tree = data.json()['tree']
+def get_tree_cache_path(repo):
+    return os.path.join(configs.BEZEL_ROOT_DIR, repo, TREE_CACHE_FILE_NAME)
+
+
+def read_tree_cache(repo):
+    tree_cache = common_utils.read_json(get_tree_cache_path(repo))
+    if not tree_cache or tree_cache.get('version') != TREE_CACHE_VERSION:
+        return None
+    return tree_cache
+
+
+def get_tree_cache(etag, sha, tree):
+    # Only the items which are bezels are kept, which is a small part of the full listing
+    return {
+        'version': TREE_CACHE_VERSION,
+        'checked': time.time(),
+        'etag': etag,
+        'sha': sha,
+        'tree': [{'type': item['type'], 'path': item['path']} for item in tree
+                 if item['type'] == 'blob' and os.path.splitext(item['path'])[-1] == '.png']
+    }
+
+
+def fetch_tree(repo, tree_cache):
+    # GitHub answers a matching If-None-Match with 304 Not Modified, which doesn't count against the rate limit
+    headers = {'If-None-Match': tree_cache['etag']} if tree_cache and tree_cache.get('etag') else None
+    data = common_utils.download_data(configs.BASE_BEZEL_TREE_URL.format(repo), headers=headers)
+    if data is None:
+        return None
+    if data.status_code == 304:
+        logger.info(info_messages.bezel_tree_not_modified(repo))
+        return dict(tree_cache, checked=time.time())
+    try:
+        listing = data.json()
+        return get_tree_cache(data.headers.get('ETag'), listing.get('sha'), listing['tree'])
+    except (ValueError, KeyError, TypeError) as e:
+        logger.error(error_messages.invalid_bezel_tree(repo, e))
+        return None
+
+
+@tracing.traced()
+def get_bezel_tree(repo):
+    tree_cache = read_tree_cache(repo)
+    if tree_cache and time.time() - tree_cache.get('checked', 0) < configs.BEZEL_TREE_TTL:
+        logger.info(info_messages.using_cached_bezel_tree(repo))
+        return tree_cache
+    fetched_tree = fetch_tree(repo, tree_cache)
+    if not fetched_tree:
+        if tree_cache:
+            # Out of date, but much better than no bezels when offline or rate limited
+            logger.warning(info_messages.using_stale_bezel_tree(repo))
+        return tree_cache
+    common_utils.write_json(get_tree_cache_path(repo), fetched_tree)
+    return fetched_tree
+
+
+@tracing.traced()
+def get_available_bezels(repo, bezel_tree):
+    if not bezel_tree:
+        logger.error(error_messages.no_bezel_tree(repo))
+        return {}
     bezels = {}
-    for item in tree:
+    for item in bezel_tree['tree']:
         if item['type'] == 'blob':
             if os.path.splitext(item['path'])[-1] == '.png':
                 key, value = get_bezel_data(repo, item)
@@ -88,84 +158,233 @@ def get_available_bezels(repo):
     return bezels
 
 
-def check_bezel_local_copy(match_name, bezels):
-    if not os.path.isfile(bezels[match_name]['local_path']):
-        return common_utils.download_file(bezels[match_name]['url'], bezels[match_name]['local_path'])
-    logger.info(info_messages.bezel_local_copy_found(bezels[match_name]['game_name']))
-    return True
+@tracing.traced()
+def get_bezel_index(bezels):
+    # Built once, so each game is only scored against the few bezel names likely to match it
+    return bezel_index.BezelIndex(bezels.keys())
+
+
+def get_match_cache_path(repo):
+    return os.path.join(configs.BEZEL_ROOT_DIR, repo, MATCH_CACHE_FILE_NAME)
+
+
+def read_match_cache(repo, sha):
+    # Matches made against any other snapshot of the repo are dropped, as its bezels may have been added or renamed
+    match_cache = common_utils.read_json(get_match_cache_path(repo))
+    if not match_cache or match_cache.get('version') != MATCH_CACHE_VERSION or match_cache.get('sha') != sha:
+        return {}
+    return match_cache['matches']
+
+
+def get_match_key(compare_name, compare_filename):
+    return '{0}:{1}'.format(int(compare_filename), compare_name)
+
+
+# Finds the best bezel name for each compare name, remembering matches between runs until the repo changes. The index
+# of bezel names is only built once a name turns up which hasn't been matched before
+class BezelMatches:
+
+    def __init__(self, repo, sha, bezels):
+        self.repo = repo
+        self.sha = sha
+        self.bezels = bezels
+        self.bezel_name_index = None
+        self.matches = read_match_cache(repo, sha) if sha else {}
+        self.changed = False
+        if self.matches:
+            logger.info(info_messages.using_bezel_match_cache(repo, len(self.matches)))
+
+    def __len__(self):
+        return len(self.bezels)
+
+    def get_index(self):
+        if self.bezel_name_index is None:
+            self.bezel_name_index = get_bezel_index(self.bezels)
+        return self.bezel_name_index
+
+    def get(self, compare_name, compare_filename):
+        key = get_match_key(compare_name, compare_filename)
+        if key not in self.matches:
+            self.matches[key] = self.get_index().extract_one(compare_name)
+            self.changed = True
+        return self.matches[key]
+
+    @tracing.traced()
+    def match_all(self, compare_names, compare_filename, jobs):
+        # Names which haven't been matched before are split between worker processes, so that get() then finds every
+        # name already matched
+        new_names = sorted({compare_name for compare_name in compare_names
+                            if get_match_key(compare_name, compare_filename) not in self.matches})
+        if not new_names:
+            return
+        logger.info(info_messages.matching_bezels_in_parallel(len(new_names), jobs))
+        for compare_name, match in zip(new_names, bezel_index.extract_all(self.get_index(), new_names, jobs)):
+            self.matches[get_match_key(compare_name, compare_filename)] = match
+        self.changed = True
+
+    def save(self):
+        # Without the tree's SHA there is no telling when the matches go out of date, so they aren't kept
+        if not self.sha or not self.changed:
+            return True
+        return common_utils.write_json(get_match_cache_path(self.repo),
+                                       {'version': MATCH_CACHE_VERSION, 'sha': self.sha, 'matches': self.matches})
 
 
-def apply_default_bezel_to_game_entry(bezel_match_element, bezel_path_element, default_bezel):
-    if not os.path.isfile(default_bezel['local_path']):
-        common_utils.download_file(default_bezel['url'], default_bezel['local_path'])
-    bezel_path_element.text = default_bezel['local_path']
-    bezel_match_element.text = 'default'
+def download_bezel(session, url, local_path):
+    if os.path.isfile(local_path):
+        logger.info(info_messages.bezel_local_copy_found(local_path))
+        # Once the bezel is there its lock is never needed again, so one left by an earlier run is cleared up
+        common_utils.remove_lock_file(local_path)
+        return True
+    return common_utils.download_file_atomic(session, url, local_path)
 
 
-def apply_matched_bezel_to_game_entry(bezel_match_element, bezel_path_element, score, best_match, bezels):
-    check_bezel_local_copy(best_match, bezels)
-    bezel_path_element.text = bezels[best_match]['local_path']
-    bezel_match_element.text = str(score)
+# Fetches bezels on a pool of threads sharing one HTTP session, and only once each however many games use them
+class BezelDownloader:
 
+    def __init__(self, threads=configs.BEZEL_DOWNLOAD_THREADS):
+        self.session = common_utils.get_download_session(threads)
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.downloads = {}
 
-def is_unsupported_region(game_data):
-    for substring in configs.BEZEL_SCRAPE_UNSUPPORTED_REGIONS:
-        if substring in os.path.basename(game_data['rom_path']):
-            return True
-        if substring in game_data['name']:
-            return True
-    return False
+    def fetch(self, url, local_path):
+        if local_path not in self.downloads:
+            self.downloads[local_path] = self.executor.submit(download_bezel, self.session, url, local_path)
+        return self.downloads[local_path]
 
+    def wait(self, local_path):
+        download = self.downloads.get(local_path)
+        return download.result() if download else os.path.isfile(local_path)
 
-def get_game_data(game_entry, compare_filename):
-    game_data = common_utils.parse_game_entry(game_entry)
-    game_data['basename_no_ext'] = common_utils.get_basename_no_ext(game_data['rom_path'])
-    game_data['compare_name'] = get_game_compare_name(game_data, compare_filename)
-    game_data['is_unsupported_region'] = is_unsupported_region(game_data)
-    return game_data
+    def close(self):
+        self.executor.shutdown()
+        self.session.close()
 
 
-def add_bezel_to_game_entry(game_entry, bezel_compare_names, bezels, default_bezel, min_match_score, compare_filename, filter_unsupported_regions):
-    bezel_match_element = ET.SubElement(game_entry, 'bezel_match')
-    bezel_path_element = ET.SubElement(game_entry, 'bezel_path')
-    game_data = get_game_data(game_entry, compare_filename)
-    if filter_unsupported_regions and game_data['is_unsupported_region']:
-        apply_default_bezel_to_game_entry(bezel_match_element, bezel_path_element, default_bezel)
-    else:
-        best_match, score = process.extractOne(game_data['compare_name'], bezel_compare_names)
-        if score >= min_match_score:
-            apply_matched_bezel_to_game_entry(bezel_match_element, bezel_path_element, score, best_match, bezels)
-        else:
-            apply_default_bezel_to_game_entry(bezel_match_element, bezel_path_element, default_bezel)
+def apply_default_bezel(game_data, default_bezel):
+    game_data.bezel_path = default_bezel['local_path']
+    game_data.bezel_match = 'default'
+    return default_bezel['url']
+
+
+def apply_matched_bezel(game_data, score, best_match, bezels):
+    game_data.bezel_path = bezels[best_match]['local_path']
+    game_data.bezel_match = str(score)
+    return bezels[best_match]['url']
 
 
-def format_gamelist(gamelist_tree):
-    lines = minidom.parseString(ET.tostring(gamelist_tree.getroot())).toprettyxml(indent=' ').split('\n')
-    return '\n'.join([line for line in lines if line.strip()])
+def is_unsupported_region(game_data):
+    for substring in configs.BEZEL_SCRAPE_UNSUPPORTED_REGIONS:
+        if substring in os.path.basename(game_data.rom_path):
+            return True
+        if substring in game_data.name:
+            return True
+    return False
 
 
-def main(input_path, platform, min_match_score=None, compare_filename=False, filter_unsupported_regions=True):
+def add_bezel(game_data, bezel_matches, bezels, default_bezel, min_match_score, compare_filename,
+              filter_unsupported_regions):
+    # Returns the url of the bezel the game was given, to be downloaded if there is no local copy
+    if not bezel_matches or (filter_unsupported_regions and is_unsupported_region(game_data)):
+        return apply_default_bezel(game_data, default_bezel)
+    best_match, score = bezel_matches.get(get_game_compare_name(game_data, compare_filename), compare_filename)
+    if best_match is not None and score >= min_match_score:
+        return apply_matched_bezel(game_data, score, best_match, bezels)
+    return apply_default_bezel(game_data, default_bezel)
+
+
+# Gamelist stage which fills in the bezel_path and bezel_match of each game, for later stages to use. Games are
+# matched as they are prefetched and their bezels downloaded in the background, so by the time a game is visited
+# its bezel is usually already on disk
+class BezelMatcher:
+
+    def __init__(self, platform_data, min_match_score, compare_filename, filter_unsupported_regions):
+        init_local_dirs()
+        repo = platform_data['bezel_repo']
+        bezel_tree = get_bezel_tree(repo)
+        self.bezels = get_available_bezels(repo, bezel_tree)
+        self.bezel_matches = BezelMatches(repo, bezel_tree.get('sha') if bezel_tree else None, self.bezels)
+        self.default_bezel = get_default_data(platform_data)
+        self.min_match_score = min_match_score
+        if not compare_filename and platform_data.get('use_filename', False):
+            logger.warning(info_messages.FORCE_COMPARE_FILENAME)
+            compare_filename = True
+        self.compare_filename = compare_filename
+        self.filter_unsupported_regions = filter_unsupported_regions
+        self.downloader = BezelDownloader()
+
+    def match_all(self, games, jobs):
+        if not self.bezel_matches:
+            return
+        compare_names = [get_game_compare_name(game_data, self.compare_filename) for game_data in games
+                         if not (self.filter_unsupported_regions and is_unsupported_region(game_data))]
+        self.bezel_matches.match_all(compare_names, self.compare_filename, jobs)
+
+    def prefetch(self, game_data):
+        with tracing.span('add_bezel', 'game', rom=game_data.rom_path):
+            url = add_bezel(game_data, self.bezel_matches, self.bezels, self.default_bezel,
+                            self.min_match_score, self.compare_filename, self.filter_unsupported_regions)
+        self.downloader.fetch(url, game_data.bezel_path)
+
+    def visit(self, game_data):
+        self.downloader.wait(game_data.bezel_path)
+
+    def finish(self):
+        self.downloader.close()
+        self.bezel_matches.save()
+
+
+def get_game_data(game_entry):
+    # Any bezel from an earlier run is replaced rather than added to
+    for tag in game_entry.findall('bezel_match') + game_entry.findall('bezel_path'):
+        game_entry.remove(tag)
+    return common_utils.parse_game_entry(game_entry)
+
+
+def add_bezel_to_game_entry(game_entry, game_data):
+    ET.SubElement(game_entry, 'bezel_match').text = game_data.bezel_match
+    ET.SubElement(game_entry, 'bezel_path').text = game_data.bezel_path
+
+
+def get_stage(input_path, platform, min_match_score=None, compare_filename=False, filter_unsupported_regions=True,
+              jobs=None):
     platform_data = configs.PLATFORMS.get(platform, False)
-    if not platform_data or not validate_args(input_path, platform, min_match_score):
-        return False
+    if not platform_data or not validate_args(input_path, platform, min_match_score, jobs):
+        return None
     # TODO - Avoid converting to int here and in validate_args
     min_match_score = int(min_match_score) if min_match_score else 85
-    init_local_dirs()
-    bezels = get_available_bezels(platform_data['bezel_repo'])
+    bezel_matcher = BezelMatcher(platform_data, min_match_score, compare_filename, filter_unsupported_regions)
+    jobs = common_utils.get_jobs(jobs)
+    if jobs > 1:
+        # Every game is matched up front, so the workers are started once rather than per game. Streaming the gamelist
+        # an extra time costs far less than the matching saves
+        bezel_matcher.match_all(common_utils.iter_gamelist(input_path), jobs)
+    return bezel_matcher
+
+
+@tracing.traced()
+def main(input_path, platform, min_match_score=None, compare_filename=False, filter_unsupported_regions=True,
+         jobs=None):
+    bezel_matcher = get_stage(input_path, platform, min_match_score=min_match_score,
+                              compare_filename=compare_filename, filter_unsupported_regions=filter_unsupported_regions,
+                              jobs=jobs)
+    if not bezel_matcher:
+        return False
     gamelist_tree = common_utils.read_gamelist_tree(input_path)
-    bezel_compare_names = set(bezels.keys())
-    default_bezel = get_default_data(platform_data)
-    if not compare_filename and platform_data.get('use_filename', False):
-        logger.warning(info_messages.FORCE_COMPARE_FILENAME)
-        compare_filename = True
-    for game_entry in gamelist_tree.getroot():
-        add_bezel_to_game_entry(game_entry, bezel_compare_names, bezels, default_bezel, min_match_score, compare_filename, filter_unsupported_regions)
-    common_utils.write_file(os.path.join(input_path), format_gamelist(gamelist_tree), 'w')
+    # Every game is matched first, so all of the bezels needed can be downloaded at once
+    game_entries = [(game_entry, get_game_data(game_entry)) for game_entry in gamelist_tree.getroot()]
+    for game_entry, game_data in game_entries:
+        bezel_matcher.prefetch(game_data)
+    for game_entry, game_data in game_entries:
+        bezel_matcher.visit(game_data)
+        add_bezel_to_game_entry(game_entry, game_data)
+    bezel_matcher.finish()
+    return common_utils.write_gamelist(input_path, gamelist_tree.getroot())
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, format="%(levelname)s : %(asctime)s : %(message)s", datefmt="%H:%M:%S")
     parser = common_utils.get_cmd_line_args(operations.operations['add_bezels_to_gamelist']['options'])
     args = vars(parser.parse_args())
-    main(args['input_dir'], args['platform'], min_match_score=args['min_match_score'], compare_filename=args['compare_filename'], filter_unsupported_regions=args['filter_unsupported_regions'])
+    main(args['input_dir'], args['platform'], min_match_score=args['min_match_score'], compare_filename=args['compare_filename'], filter_unsupported_regions=args['filter_unsupported_regions'], jobs=args['jobs'])
 
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+import sys
+import time
+import random
+import itertools
+import platform
+import argparse
+import logging
+
+from fuzzywuzzy import process
+
+from shared import common_utils, bezel_index
+
+logger = logging.getLogger(__name__)
+
+COMMON_WORDS = ('the', 'of', 'ii', 'iii', '2', '3', 'super', 'world', 'fighter', 'vs', 'and', 'deluxe', 'edition',
+                'championship', 'racing', 'star', 'dragon', 'legend', 'pro', 'soccer', 'street', 'mega', 'ninja')
+
+SYLLABLES = ('ka', 'ro', 'mi', 'zen', 'tor', 'bla', 'ster', 'vo', 'lin', 'gar', 'pu', 'rex', 'sho', 'dan', 'qui',
+             'mo', 'tek', 'bu', 'ra', 'jo', 'cy', 'ber', 'ax', 'el', 'nu', 'fi', 'gon', 'wu', 'ly', 'os')
+
+# The share of games in each kind: an exact (after cleaning) copy of a bezel name, a variant of one with typos or
+# missing words, and a game which has no bezel
+GAME_KINDS = {'exact': 0.4, 'variant': 0.35, 'missing': 0.25}
+
+VOCABULARY_SIZE = 20000
+
+RESULTS_VERSION = 1
+
+
+def get_args():
+    parser = argparse.ArgumentParser(prog='benchmark_bezel_match',
+                                     description='Time fuzzy bezel matching on generated names and check the '
+                                                 'indexed matcher agrees with extractOne.')
+    parser.add_argument('--bezels', dest='bezels', type=int, default=30000,
+                        help='Number of bezel names to generate. Defaults to 30000.')
+    parser.add_argument('--games', dest='games', type=int, default=30000,
+                        help='Number of game names to generate. Defaults to 30000.')
+    parser.add_argument('--sample', dest='sample', type=int, default=100,
+                        help='Number of games matched with extractOne, which is far too slow to run on every game. '
+                             'Defaults to 100.')
+    parser.add_argument('--min-match-score', dest='min_match_score', type=int, default=85,
+                        help='Score below which a game gets the default bezel. Defaults to 85.')
+    parser.add_argument('--jobs', '-j', dest='jobs', type=int, default=1,
+                        help='Number of processes to match every game with. Defaults to 1.')
+    parser.add_argument('--seed', dest='seed', type=int, default=1, help='Random seed. Defaults to 1.')
+    parser.add_argument('--output-path', '-o', dest='output_path', default='benchmark_bezel_match.json',
+                        help='Where to write the results. Defaults to benchmark_bezel_match.json.')
+    return parser.parse_args()
+
+
+def get_vocabulary(rand, size):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rand.choice(SYLLABLES) for _ in range(rand.randint(1, 4))))
+    words = sorted(words - set(COMMON_WORDS))
+    rand.shuffle(words)
+    return list(COMMON_WORDS) + words
+
+
+def get_cum_weights(vocabulary):
+    # Zipfian, like the words in real game names
+    return list(itertools.accumulate(1 / rank for rank in range(1, len(vocabulary) + 1)))
+
+
+def get_name(rand, vocabulary, cum_weights):
+    words = rand.choices(vocabulary, cum_weights=cum_weights, k=rand.randint(1, 5))
+    if rand.random() < 0.3:
+        words += ['-'] + rand.choices(vocabulary, cum_weights=cum_weights, k=rand.randint(1, 3))
+    return ' '.join(words)
+
+
+def get_names(rand, vocabulary, cum_weights, count, exclude=()):
+    names = set()
+    while len(names) < count:
+        name = get_name(rand, vocabulary, cum_weights)
+        if name not in exclude:
+            names.add(name)
+    return sorted(names)
+
+
+def get_variant(rand, name):
+    words = name.split()
+    change = rand.randrange(4)
+    if change == 0 and len(words) > 1:
+        del words[rand.randrange(len(words))]
+    elif change == 1:
+        words.insert(0, 'the')
+    elif change == 2:
+        words.append(rand.choice(('ii', '2', 'deluxe', 'plus', 'remix')))
+    else:
+        index = rand.randrange(len(words))
+        word = words[index]
+        position = rand.randrange(len(word))
+        words[index] = word[:position] + word[position + 1:] + rand.choice(SYLLABLES)[:1]
+    return ' '.join(words)
+
+
+def get_games(rand, vocabulary, cum_weights, bezel_names, count):
+    kinds = rand.choices(list(GAME_KINDS), weights=list(GAME_KINDS.values()), k=count)
+    missing_names = get_names(rand, vocabulary, cum_weights, kinds.count('missing'), exclude=set(bezel_names))
+    rand.shuffle(missing_names)
+    missing_names = iter(missing_names)
+    games = []
+    for kind in kinds:
+        if kind == 'missing':
+            games.append(next(missing_names))
+        elif kind == 'exact':
+            games.append(rand.choice(bezel_names).title().replace(' - ', ': '))
+        else:
+            games.append(get_variant(rand, rand.choice(bezel_names)))
+    return games
+
+
+def time_matches(match, games):
+    start = time.perf_counter()
+    results = [match(game) for game in games]
+    return time.perf_counter() - start, results
+
+
+def is_same_result(indexed, full, min_match_score):
+    # Below min_match_score the game gets the default bezel whatever the best match was. Above it, the scores must be
+    # the same. The names may still differ where several score equally well, as which of those extractOne picks
+    # depends on the order it was given them in
+    if indexed[1] < min_match_score and full[1] < min_match_score:
+        return True
+    return indexed[1] == full[1]
+
+
+def get_environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform()
+    }
+
+
+def run(args):
+    rand = random.Random(args.seed)
+    vocabulary = get_vocabulary(rand, VOCABULARY_SIZE)
+    cum_weights = get_cum_weights(vocabulary)
+    bezel_names = get_names(rand, vocabulary, cum_weights, args.bezels)
+    games = get_games(rand, vocabulary, cum_weights, bezel_names, args.games)
+    sample = rand.sample(games, min(args.sample, len(games)))
+    start = time.perf_counter()
+    index = bezel_index.BezelIndex(bezel_names)
+    index_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    indexed_results = bezel_index.extract_all(index, games, args.jobs)
+    indexed_seconds = time.perf_counter() - start
+    sample_indexed_seconds, sample_indexed_results = time_matches(index.extract_one, sample)
+    full_seconds, full_results = time_matches(lambda game: process.extractOne(game, bezel_names), sample)
+    mismatches = [{'game': game, 'indexed': indexed, 'extract_one': full}
+                  for game, indexed, full in zip(sample, sample_indexed_results, full_results)
+                  if not is_same_result(indexed, full, args.min_match_score)]
+    # extractOne is only timed on the sample, so its time for every game is estimated from that
+    full_per_game = full_seconds / len(sample)
+    indexed_per_game = sample_indexed_seconds / len(sample)
+    return {
+        'version': RESULTS_VERSION,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': get_environment(),
+        'config': {'bezels': args.bezels, 'games': args.games, 'sample': len(sample),
+                   'min_match_score': args.min_match_score, 'jobs': args.jobs, 'seed': args.seed},
+        'index_seconds': round(index_seconds, 4),
+        'indexed_seconds': round(indexed_seconds, 4),
+        'matched': len([result for result in indexed_results if result[1] >= args.min_match_score]),
+        'extract_one_seconds_estimated': round(full_per_game * len(games), 4),
+        'speedup': round(full_per_game / indexed_per_game, 2) if indexed_per_game else None,
+        'sample_agreement': round(1 - len(mismatches) / len(sample), 4) if sample else None,
+        'mismatches': mismatches
+    }
+
+
+def log_results(results):
+    logger.info('Indexed {0} bezels in {1}s'.format(results['config']['bezels'], results['index_seconds']))
+    logger.info('Indexed matcher: {0}s for {1} games in {2} processes, {3} matched'.format(
+        results['indexed_seconds'], results['config']['games'], results['config']['jobs'], results['matched']))
+    logger.info('extractOne: {0}s estimated for {1} games'.format(
+        results['extract_one_seconds_estimated'], results['config']['games']))
+    logger.info('Speedup: {0}x, agreement with extractOne on {1} games: {2}'.format(
+        results['speedup'], results['config']['sample'], results['sample_agreement']))
+
+
+def main():
+    args = get_args()
+    results = run(args)
+    log_results(results)
+    return common_utils.write_json(args.output_path, results)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s : %(asctime)s : %(message)s", datefmt="%H:%M:%S")
+    sys.exit(0 if main() else 1)
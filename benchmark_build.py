@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import zipfile
+import platform
+import argparse
+import logging
+
+import build_uce_tool
+import build_from_recipes
+import build_recipes
+from shared import common_utils, uce_utils, tracing
+
+logger = logging.getLogger(__name__)
+
+# Synthetic recipe kinds: the size of the rom file in MB and how the recipe provides its save partition
+RECIPE_KINDS = {
+    'cart': {'rom_size_mb': 1, 'save': None},
+    'disc': {'rom_size_mb': 700, 'save': None},
+    'save_dir': {'rom_size_mb': 1, 'save': 'dir'},
+    'save_zip': {'rom_size_mb': 1, 'save': 'zip'}
+}
+
+CORE_SIZE_MB = 2
+
+RESULTS_VERSION = 1
+
+
+def get_args():
+    parser = argparse.ArgumentParser(prog='benchmark_build',
+                                     description='Time UCE builds from generated recipes and report throughput.')
+    for kind in RECIPE_KINDS:
+        parser.add_argument('--{0}'.format(kind.replace('_', '-')), dest=kind, type=int, default=2,
+                            help="Number of '{0}' recipes to generate. Defaults to 2.".format(kind))
+    parser.add_argument('--disc-size-mb', dest='disc_size_mb', type=int, default=RECIPE_KINDS['disc']['rom_size_mb'],
+                        help='Size of each generated disc image in MB. Defaults to 700.')
+    parser.add_argument('--jobs', '-j', dest='jobs', default=None, help='Jobs value passed to build_from_recipes.')
+    parser.add_argument('--work-dir', '-w', dest='work_dir', default=None,
+                        help='Directory for generated recipes and UCEs. Defaults to a temp dir, removed afterwards.')
+    parser.add_argument('--output-path', '-o', dest='output_path', default='benchmark_results.json',
+                        help='Where to write the results. Defaults to benchmark_results.json.')
+    parser.add_argument('--baseline', '-b', dest='baseline', default=None,
+                        help='Results from an earlier run to compare against.')
+    return parser.parse_args()
+
+
+def write_data_file(file_path, size_mb):
+    # Alternate incompressible and empty blocks so mksquashfs has a realistic amount of work to do
+    with open(file_path, 'wb') as data_file:
+        for index in range(size_mb):
+            data_file.write(os.urandom(common_utils.CHUNK_SIZE) if index % 2 else bytes(common_utils.CHUNK_SIZE))
+
+
+def write_save_files(save_dir):
+    common_utils.make_dir(save_dir)
+    common_utils.make_dir(os.path.join(save_dir, 'upper'))
+    for index in range(8):
+        with open(os.path.join(save_dir, 'upper', 'save{0}.srm'.format(index)), 'wb') as save_file:
+            save_file.write(os.urandom(8192))
+
+
+def write_save_zip(recipe_dir, temp_dir):
+    save_contents_dir = os.path.join(temp_dir, 'save_contents')
+    save_img = os.path.join(temp_dir, 'save.img')
+    if not os.path.isfile(save_img):
+        write_save_files(save_contents_dir)
+        common_utils.make_dir(os.path.join(save_contents_dir, 'work'))
+        uce_utils.make_save_part_from_dir(save_contents_dir, save_img)
+    with zipfile.ZipFile(os.path.join(recipe_dir, 'save', 'save.zip'), 'w', zipfile.ZIP_DEFLATED) as zfile:
+        zfile.write(save_img, 'save.img')
+
+
+def make_recipe(recipes_dir, temp_dir, kind, index, rom_size_mb):
+    rom_file_name = '{0}_{1}.bin'.format(kind, index)
+    recipe_dir = os.path.join(recipes_dir, '{0}_{1}'.format(kind, index))
+    common_utils.make_dir(recipe_dir)
+    for sub_dir in ('emu', 'roms', 'boxart', 'save'):
+        common_utils.make_dir(os.path.join(recipe_dir, sub_dir))
+    build_recipes.write_cart_xml(recipe_dir, rom_file_name, 'Synthetic {0} recipe'.format(kind))
+    build_recipes.write_exec_sh(recipe_dir, 'core.so', rom_file_name)
+    write_data_file(os.path.join(recipe_dir, 'emu', 'core.so'), CORE_SIZE_MB)
+    write_data_file(os.path.join(recipe_dir, 'roms', rom_file_name), rom_size_mb)
+    common_utils.copyfile(os.path.join(common_utils.get_app_root(), 'data', 'title.png'),
+                          os.path.join(recipe_dir, 'boxart', 'boxart.png'))
+    if RECIPE_KINDS[kind]['save'] == 'dir':
+        write_save_files(os.path.join(recipe_dir, 'save'))
+    elif RECIPE_KINDS[kind]['save'] == 'zip':
+        write_save_zip(recipe_dir, temp_dir)
+    return recipe_dir
+
+
+def make_recipes(recipes_dir, temp_dir, counts, disc_size_mb):
+    recipe_dirs = {}
+    for kind, count in counts.items():
+        rom_size_mb = disc_size_mb if kind == 'disc' else RECIPE_KINDS[kind]['rom_size_mb']
+        recipe_dirs[kind] = [make_recipe(recipes_dir, temp_dir, kind, index, rom_size_mb) for index in range(count)]
+    return recipe_dirs
+
+
+def get_dir_size(dir_path):
+    return sum(os.path.getsize(os.path.join(root, file_name))
+               for root, dirs, files in os.walk(dir_path) for file_name in files)
+
+
+def get_stage_times(events):
+    stages = {}
+    for event in events:
+        if event['cat'] in ('stage', 'subprocess'):
+            stage = stages.setdefault(event['name'], {'count': 0, 'seconds': 0.0})
+            stage['count'] += 1
+            stage['seconds'] += event['dur'] / 1000000
+    return {name: {'count': stage['count'], 'seconds': round(stage['seconds'], 4)}
+            for name, stage in sorted(stages.items())}
+
+
+def get_throughput(input_bytes, num_uces, seconds):
+    return {
+        'seconds': round(seconds, 4),
+        'input_mb': round(input_bytes / 1048576, 2),
+        'mb_per_second': round(input_bytes / 1048576 / seconds, 2) if seconds else None,
+        'uces_per_minute': round(num_uces * 60 / seconds, 2) if seconds else None
+    }
+
+
+def time_call(func, *args, **kwargs):
+    tracing.reset(enabled=True)
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    return seconds, result, tracing.pop_events()
+
+
+def bench_single_builds(recipe_dirs, uce_dir):
+    results = {}
+    for kind, dirs in recipe_dirs.items():
+        if not dirs:
+            continue
+        recipe_dir = dirs[0]
+        seconds, built, events = time_call(build_uce_tool.main, recipe_dir,
+                                           os.path.join(uce_dir, '{0}.uce'.format(os.path.basename(recipe_dir))))
+        results[kind] = get_throughput(get_dir_size(recipe_dir), 1 if built else 0, seconds)
+        results[kind]['succeeded'] = bool(built)
+        results[kind]['stages'] = get_stage_times(events)
+    return results
+
+
+def bench_multi_build(recipes_dir, uce_dir, jobs):
+    seconds, built, events = time_call(build_from_recipes.main, recipes_dir, output_dir=uce_dir, jobs=jobs,
+                                       force=True)
+    num_uces = len([dir_ for dir_ in os.listdir(recipes_dir) if os.path.isdir(os.path.join(recipes_dir, dir_))])
+    # Only the UCEs actually built count, so a build which fails fast doesn't look quick
+    num_built = len([dir_ for dir_ in built if built[dir_]]) if built else 0
+    results = get_throughput(get_dir_size(recipes_dir), num_built, seconds)
+    results['succeeded'] = num_built == num_uces
+    results['stages'] = get_stage_times(events)
+    return results
+
+
+def get_environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def compare_with_baseline(results, baseline):
+    comparisons = {}
+    for name in ('build_from_recipes', *RECIPE_KINDS):
+        current = results['builds'].get(name)
+        previous = baseline.get('builds', {}).get(name)
+        # Baselines from before builds recorded whether they succeeded are taken to have succeeded
+        if not current or not previous or not previous.get('succeeded', True):
+            continue
+        # Throughput rather than time is compared, so runs with different recipe counts stay comparable
+        if current.get('mb_per_second') and previous.get('mb_per_second'):
+            comparisons[name] = round(current['mb_per_second'] / previous['mb_per_second'], 3)
+    return comparisons
+
+
+def log_results(results):
+    for name, build in results['builds'].items():
+        speedup = results.get('speedup_vs_baseline', {}).get(name)
+        if not build['succeeded']:
+            logger.error('{0}: build failed after {1}s'.format(name, build['seconds']))
+            continue
+        logger.info('{0}: {1}s, {2} MB/s, {3} UCEs/min{4}'.format(
+            name, build['seconds'], build['mb_per_second'], build['uces_per_minute'],
+            ', {0}x baseline'.format(speedup) if speedup else ''))
+
+
+def run(args, work_dir):
+    recipes_dir = os.path.join(work_dir, 'recipes')
+    uce_dir = os.path.join(work_dir, 'uces')
+    common_utils.make_dir(recipes_dir)
+    common_utils.make_dir(uce_dir)
+    counts = {kind: getattr(args, kind) for kind in RECIPE_KINDS}
+    recipe_dirs = make_recipes(recipes_dir, work_dir, counts, args.disc_size_mb)
+    builds = bench_single_builds(recipe_dirs, uce_dir)
+    builds['build_from_recipes'] = bench_multi_build(recipes_dir, os.path.join(uce_dir, 'multi'), args.jobs)
+    return {
+        'version': RESULTS_VERSION,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': get_environment(),
+        'config': {'counts': counts, 'disc_size_mb': args.disc_size_mb, 'jobs': args.jobs},
+        'builds': builds
+    }
+
+
+def main():
+    args = get_args()
+    work_dir = os.path.abspath(args.work_dir) if args.work_dir else common_utils.create_temp_dir(__name__)
+    common_utils.make_dir(work_dir)
+    try:
+        results = run(args, work_dir)
+    finally:
+        if not args.work_dir:
+            common_utils.cleanup_temp_dir(__name__)
+    succeeded = all(build['succeeded'] for build in results['builds'].values())
+    # Timings from failed builds aren't comparable with anything, so there is no baseline comparison
+    if args.baseline and succeeded:
+        baseline = common_utils.read_json(args.baseline)
+        if baseline:
+            results['speedup_vs_baseline'] = compare_with_baseline(results, baseline)
+    log_results(results)
+    return common_utils.write_json(args.output_path, results) and succeeded
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s : %(asctime)s : %(message)s", datefmt="%H:%M:%S")
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import os
+import queue
+import logging
+import threading
+
+import build_recipes
+import build_from_recipes
+from shared import common_utils, error_messages, info_messages, tracing, gamelist_stages
+import operations
+
+logger = logging.getLogger(__name__)
+
+# Put on the queue once per builder thread when there are no more recipes
+NO_MORE_RECIPES = None
+
+
+def build_queued_recipes(recipe_queue, output_dir, results):
+    while True:
+        recipe_dir = recipe_queue.get()
+        if recipe_dir is NO_MORE_RECIPES:
+            return
+        try:
+            results[recipe_dir] = build_from_recipes.make_recipe(recipe_dir, output_dir)
+        except Exception as e:
+            logger.error(error_messages.recipe_build_exception(recipe_dir, e))
+            results[recipe_dir] = False
+        common_utils.remove_dir(recipe_dir)
+
+
+def start_builders(recipe_queue, output_dir, results, jobs):
+    builders = [threading.Thread(target=build_queued_recipes, args=(recipe_queue, output_dir, results), daemon=True)
+                for _ in range(jobs)]
+    for builder in builders:
+        builder.start()
+    return builders
+
+
+def stop_builders(recipe_queue, builders):
+    for _ in builders:
+        recipe_queue.put(NO_MORE_RECIPES)
+    for builder in builders:
+        builder.join()
+
+
+# Gamelist stage which makes a recipe for each game and queues it for the builder threads
+class UCEBuilder:
+
+    def __init__(self, core_path, bios_dir, output_dir, link_strategy=None, jobs=1):
+        self.core_path = core_path
+        self.bios_dir = bios_dir
+        self.output_dir = output_dir
+        self.link_strategy = link_strategy
+        self.temp_dir = common_utils.create_temp_dir(__name__)
+        self.used_dir_names = set()
+        self.resized_bezels = build_recipes.ResizedBezels()
+        self.recipe_queue = queue.Queue(maxsize=jobs)
+        self.results = {}
+        logger.info(info_messages.building_from_gamelist(jobs))
+        self.builders = start_builders(self.recipe_queue, output_dir, self.results, jobs)
+
+    def visit(self, game_data):
+        recipe_spec = build_recipes.get_recipe_spec(game_data, self.temp_dir, self.used_dir_names)
+        recipe_dir = recipe_spec[1]
+        if build_recipes.make_recipe(self.core_path, self.bios_dir, recipe_spec, self.resized_bezels,
+                                     self.link_strategy):
+            # Blocks while the builders are busy, so only a few recipes ever exist on disk at once
+            self.recipe_queue.put(recipe_dir)
+        else:
+            self.results[recipe_dir] = False
+            if os.path.isdir(recipe_dir):
+                common_utils.remove_dir(recipe_dir)
+
+    def finish(self):
+        stop_builders(self.recipe_queue, self.builders)
+        self.resized_bezels.cleanup()
+        common_utils.cleanup_temp_dir(__name__, self.temp_dir)
+        build_from_recipes.log_build_summary(self.results, self.output_dir)
+
+
+def get_stage(input_path, core_path, bios_dir=None, output_dir=None, link_strategy=None, jobs=None):
+    if not build_recipes.validate_args(input_path, core_path, bios_dir, output_dir, link_strategy, jobs):
+        return None
+    output_dir = os.path.abspath(output_dir) if output_dir else os.path.join(os.path.dirname(input_path), 'UCE')
+    common_utils.make_dir(output_dir)
+    return UCEBuilder(core_path, bios_dir, output_dir, link_strategy, common_utils.get_jobs(jobs))
+
+
+@tracing.traced()
+def main(input_path, core_path, bios_dir=None, output_dir=None, link_strategy=None, jobs=None):
+    uce_builder = get_stage(input_path, core_path, bios_dir=bios_dir, output_dir=output_dir,
+                            link_strategy=link_strategy, jobs=jobs)
+    if not uce_builder:
+        return False
+    gamelist_stages.run(input_path, [uce_builder])
+    return uce_builder.results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s : %(asctime)s : %(message)s", datefmt="%H:%M:%S")
+    parser = common_utils.get_cmd_line_args(operations.operations['gamelist_to_uces']['options'])
+    args = vars(parser.parse_args())
+    main(args['input_path'], args['core_path'], bios_dir=args['bios_dir'], output_dir=args['output_dir'],
+         link_strategy=args['link_strategy'], jobs=args['jobs'])
@@ -2,21 +2,24 @@
 
 import os
 import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import build_uce_tool
-from shared import common_utils, error_messages, info_messages
+from shared import common_utils, error_messages, info_messages, build_cache, tracing
 import operations
 
 logger = logging.getLogger(__name__)
 
 
-def validate_args(input_dir, output_dir):
+def validate_args(input_dir, output_dir, jobs):
     logger.info('Validating arguments for build_from_recipes')
     valid = True
     if not common_utils.validate_existing_dir(input_dir, 'Input dir'):
         valid = False
     if not common_utils.validate_parent_dir(output_dir, 'Output dir'):
         valid = False
+    if not common_utils.validate_jobs(jobs):
+        valid = False
     return valid
 
 
@@ -55,24 +58,92 @@ def get_recipe_dirs(input_dir):
     return recipe_dirs
 
 
-def make_recipes(recipe_dirs, output_dir):
-    for dir_ in recipe_dirs:
-        output_path = os.path.join(output_dir, '{0}.uce'.format(os.path.split(dir_)[-1]))
-        build_uce_tool.main(dir_, output_path)
+def get_output_path(dir_, output_dir):
+    return os.path.join(output_dir, '{0}.uce'.format(os.path.split(dir_)[-1]))
+
+
+def make_recipe(dir_, output_dir):
+    return build_uce_tool.main(dir_, get_output_path(dir_, output_dir))
 
 
-def main(input_dir, output_dir=None):
+def make_recipe_in_worker(dir_, output_dir, trace):
+    # Timings recorded in a worker process are handed back with the result, so they end up in the parent's trace
+    tracing.reset(enabled=trace)
+    return make_recipe(dir_, output_dir), tracing.pop_events()
+
+
+def make_recipes(recipe_dirs, output_dir):
+    return {dir_: make_recipe(dir_, output_dir) for dir_ in recipe_dirs}
+
+
+def make_recipes_in_parallel(recipe_dirs, output_dir, jobs):
+    logger.info(info_messages.building_recipes_in_parallel(len(recipe_dirs), jobs))
+    results = {}
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(make_recipe_in_worker, dir_, output_dir, tracing.is_enabled()): dir_
+                   for dir_ in recipe_dirs}
+        for future in as_completed(futures):
+            dir_ = futures[future]
+            try:
+                results[dir_], events = future.result()
+                tracing.add_events(events)
+            except Exception as e:
+                logger.error(error_messages.recipe_build_exception(dir_, e))
+                results[dir_] = False
+    return results
+
+
+def log_build_summary(results, output_dir, num_skipped=0):
+    for dir_ in sorted(results):
+        if results[dir_]:
+            logger.info(info_messages.recipe_build_succeeded(dir_, get_output_path(dir_, output_dir)))
+        else:
+            logger.error(error_messages.recipe_build_failed(dir_))
+    num_built = len([dir_ for dir_ in results if results[dir_]])
+    logger.info(info_messages.recipe_build_summary(num_built, len(results) - num_built, num_skipped))
+
+
+def get_recipes_to_build(recipe_dirs, output_dir, manifest, fingerprints, force, hash_contents):
+    if force:
+        return recipe_dirs
+    return [dir_ for dir_ in recipe_dirs if not build_cache.is_up_to_date(manifest, get_output_path(dir_, output_dir),
+                                                                          fingerprints[dir_], hash_contents)]
+
+
+def update_manifest(manifest, results, output_dir, fingerprints, hash_contents=False):
+    for dir_, built in results.items():
+        output_path = get_output_path(dir_, output_dir)
+        if built:
+            build_cache.record_build(manifest, output_path, fingerprints[dir_], hash_contents)
+        else:
+            build_cache.forget_build(manifest, output_path)
+    build_cache.write_manifest(output_dir, manifest)
+
+
+@tracing.traced()
+def main(input_dir, output_dir=None, jobs=None, force=False, hash_contents=False):
     input_dir = os.path.abspath(input_dir) if input_dir else os.getcwd()
-    if not validate_args(input_dir, output_dir):
+    if not validate_args(input_dir, output_dir, jobs):
         return False
     recipe_dirs = get_recipe_dirs(input_dir)
     output_dir = os.path.abspath(output_dir) if output_dir else os.path.join(input_dir, 'UCE')
     common_utils.make_dir(output_dir)
-    make_recipes(recipe_dirs, output_dir)
+    manifest = build_cache.read_manifest(output_dir)
+    fingerprints = {dir_: build_cache.get_recipe_fingerprint(dir_, hash_contents) for dir_ in recipe_dirs}
+    to_build = get_recipes_to_build(recipe_dirs, output_dir, manifest, fingerprints, force, hash_contents)
+    jobs = common_utils.get_jobs(jobs)
+    if jobs > 1 and len(to_build) > 1:
+        results = make_recipes_in_parallel(to_build, output_dir, jobs)
+    else:
+        results = make_recipes(to_build, output_dir)
+    update_manifest(manifest, results, output_dir, fingerprints, hash_contents)
+    log_build_summary(results, output_dir, num_skipped=len(recipe_dirs) - len(to_build))
+    return results
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, format="%(levelname)s : %(asctime)s : %(message)s", datefmt="%H:%M:%S")
     parser = common_utils.get_cmd_line_args(operations.operations['recipes_to_uces']['options'])
     args = vars(parser.parse_args())
-    main(args['input_dir'], output_dir=args['output_dir'])
+    main(args['input_dir'], output_dir=args['output_dir'], jobs=args['jobs'], force=args['force'],
+         hash_contents=args['hash_contents'])
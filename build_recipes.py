@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
 
 import os
+import hashlib
 import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-from shared import common_utils, configs, info_messages
+from shared import common_utils, configs, info_messages, error_messages, tracing, gamelist_stages
 import operations
 
 logger = logging.getLogger(__name__)
@@ -11,7 +15,33 @@ logger = logging.getLogger(__name__)
 MAX_FILE_NAME_LENGTH = 62
 
 
-def validate_args(input_path, core_path, bios_dir, output_dir):
+# Many games share a bezel (at least the platform default), so each is resized once into a temp dir and then linked
+# or copied into every recipe which uses it
+class ResizedBezels:
+
+    def __init__(self):
+        self.temp_dir = common_utils.create_temp_dir(__name__)
+        self.paths = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def get(self, bezel_path):
+        with self.lock:
+            bezel_lock = self.locks.setdefault(bezel_path, threading.Lock())
+        with bezel_lock:
+            if bezel_path not in self.paths:
+                resized_path = os.path.join(self.temp_dir,
+                                            '{0}.png'.format(hashlib.sha1(bezel_path.encode()).hexdigest()))
+                if not common_utils.resize_and_save_image(bezel_path, resized_path, 1280, 720):
+                    return None
+                self.paths[bezel_path] = resized_path
+            return self.paths[bezel_path]
+
+    def cleanup(self):
+        common_utils.cleanup_temp_dir(__name__, self.temp_dir)
+
+
+def validate_args(input_path, core_path, bios_dir, output_dir, link_strategy, jobs):
     logger.info('Validating arguments for build_recipes')
     valid = True
     if not common_utils.validate_required_path(input_path, 'Specified gamelist'):
@@ -22,6 +52,11 @@ def validate_args(input_path, core_path, bios_dir, output_dir):
         valid = False
     if not common_utils.validate_optional_dir(bios_dir, 'Bios dir'):
         valid = False
+    if link_strategy and link_strategy not in configs.LINK_STRATEGIES:
+        logger.error(error_messages.invalid_link_strategy(link_strategy, configs.LINK_STRATEGIES))
+        valid = False
+    if not common_utils.validate_jobs(jobs):
+        valid = False
     return valid
 
 
@@ -37,6 +72,28 @@ def get_target_filename(filename):
     return filename
 
 
+def get_unique_dir_name(dir_name, used_dir_names):
+    # Names are compared case-insensitively as recipes and UCEs often end up on case-insensitive filesystems
+    unique_name = dir_name
+    index = 1
+    while unique_name.lower() in used_dir_names:
+        index += 1
+        suffix = ' ({0})'.format(index)
+        unique_name = '{0}{1}'.format(dir_name[:MAX_FILE_NAME_LENGTH - len('.uce') - len(suffix)], suffix)
+    if unique_name != dir_name:
+        logger.warning(error_messages.recipe_name_collision(dir_name, unique_name))
+    used_dir_names.add(unique_name.lower())
+    return unique_name
+
+
+def get_recipe_spec(game_data, output_dir, used_dir_names):
+    # Each recipe's target names are settled, in gamelist order, before it is handed out to be made, so duplicates
+    # can't overwrite each other. The target_rom_filename deals with limits on exec.sh rom name length, special chars
+    target_rom_filename = get_target_filename(os.path.basename(game_data.rom_path))
+    dir_name = get_unique_dir_name(os.path.splitext(target_rom_filename)[0], used_dir_names)
+    return game_data, os.path.join(output_dir, dir_name), target_rom_filename
+
+
 def make_uce_sub_dirs(game_dir):
     for sub_dir in ('emu', 'roms', 'boxart', 'save'):
         common_utils.make_dir(os.path.join(game_dir, sub_dir))
@@ -56,71 +113,127 @@ def write_exec_sh(game_dir, core_file_name, game_file_name):
     common_utils.write_file(os.path.join(game_dir, 'exec.sh'), exec_sh, 'w')
 
 
-def copy_dir_contents(source_dir, dest_dir):
+def copy_dir_contents(source_dir, dest_dir, link_strategy=None):
     for file_name in os.listdir(source_dir):
         source_file_path = os.path.join(source_dir, file_name)
         if os.path.isfile(source_file_path):
-            common_utils.copyfile(source_file_path, os.path.join(dest_dir, file_name))
+            common_utils.link_file(source_file_path, os.path.join(dest_dir, file_name), link_strategy)
 
 
-def copy_and_resize_bezel(game_data, game_dir):
-    bezel_path = game_data['bezel_path']
+def copy_and_resize_bezel(game_data, game_dir, resized_bezels, link_strategy=None):
+    bezel_path = game_data.bezel_path
     if bezel_path:
-        common_utils.resize_and_save_image(bezel_path, os.path.join(game_dir, 'boxart', 'addon.z.png'), 1280, 720)
+        resized_bezel_path = resized_bezels.get(bezel_path)
+        if resized_bezel_path:
+            common_utils.link_file(resized_bezel_path, os.path.join(game_dir, 'boxart', 'addon.z.png'), link_strategy)
 
 
-def copy_boxart(game_data, game_dir):
-    boxart_source_path = game_data['boxart_path']
+def copy_boxart(game_data, game_dir, link_strategy=None):
+    boxart_source_path = game_data.boxart_path
     box_art_target_path = os.path.join(game_dir, 'boxart', 'boxart.png')
     if boxart_source_path:
         common_utils.copyfile(boxart_source_path, box_art_target_path)
     else:
         logger.info(info_messages.NO_BOXART_FOUND)
-        common_utils.copyfile(os.path.join(common_utils.get_app_root(), 'data', 'title.png'), box_art_target_path)
+        common_utils.link_file(os.path.join(common_utils.get_app_root(), 'data', 'title.png'), box_art_target_path,
+                               link_strategy)
     if not common_utils.create_symlink(box_art_target_path, os.path.join(game_dir, 'title.png')):
         logger.info(info_messages.COPY_SYMLINK_FAILED)
-        common_utils.copyfile(game_data['boxart_path'], os.path.join(game_dir, 'title.png'))
+        common_utils.copyfile(game_data.boxart_path, os.path.join(game_dir, 'title.png'))
 
 
-def copy_source_files(core_path, bios_dir, game_data, game_dir, target_rom_filename):
-    common_utils.copyfile(core_path, os.path.join(game_dir, 'emu', os.path.basename(core_path)))
-    common_utils.copyfile(game_data['rom_path'], os.path.join(game_dir, 'roms', target_rom_filename))
-    copy_boxart(game_data, game_dir)
-    copy_and_resize_bezel(game_data, game_dir)
+@tracing.traced()
+def copy_source_files(core_path, bios_dir, game_data, game_dir, target_rom_filename, resized_bezels,
+                      link_strategy=None):
+    common_utils.link_file(core_path, os.path.join(game_dir, 'emu', os.path.basename(core_path)), link_strategy)
+    common_utils.copyfile(game_data.rom_path, os.path.join(game_dir, 'roms', target_rom_filename))
+    copy_boxart(game_data, game_dir, link_strategy)
+    copy_and_resize_bezel(game_data, game_dir, resized_bezels, link_strategy)
     if bios_dir:
-        copy_dir_contents(bios_dir, os.path.join(game_dir, 'roms'))
+        copy_dir_contents(bios_dir, os.path.join(game_dir, 'roms'), link_strategy)
 
 
-def setup_uce_source(core_path, bios_dir, game_data, output_dir):
-    # Modify the target_rom_filename to deal with limitations on exec.sh rom name length, special chars
-    # target_rom_filename = common_utils.remove_special_chars(os.path.basename(game_data['rom_path']))
-    target_rom_filename = get_target_filename(os.path.basename(game_data['rom_path']))
-    game_dir = os.path.join(output_dir, os.path.splitext(target_rom_filename)[0])
+def setup_uce_source(core_path, bios_dir, game_data, game_dir, target_rom_filename, resized_bezels,
+                     link_strategy=None):
     common_utils.make_dir(game_dir)
     make_uce_sub_dirs(game_dir)
-    cart_xml_game_name = game_data['name'] if game_data['name'] else os.path.splitext(target_rom_filename)[0]
-    write_cart_xml(game_dir, cart_xml_game_name, game_data['description'])
+    cart_xml_game_name = game_data.name if game_data.name else os.path.splitext(target_rom_filename)[0]
+    write_cart_xml(game_dir, cart_xml_game_name, game_data.description)
     write_exec_sh(game_dir, os.path.basename(core_path), target_rom_filename)
-    copy_source_files(core_path, bios_dir, game_data, game_dir, target_rom_filename)
-
-
-def main(input_path, core_path, bios_dir=None, output_dir=None):
-    if not validate_args(input_path, core_path, bios_dir, output_dir):
-        return
+    copy_source_files(core_path, bios_dir, game_data, game_dir, target_rom_filename, resized_bezels, link_strategy)
+
+
+def make_recipe(core_path, bios_dir, recipe_spec, resized_bezels, link_strategy=None):
+    game_data, game_dir, target_rom_filename = recipe_spec
+    with tracing.span('setup_uce_source', 'game', rom=game_data.rom_path):
+        try:
+            setup_uce_source(core_path, bios_dir, game_data, game_dir, target_rom_filename, resized_bezels,
+                             link_strategy)
+        except Exception as e:
+            logger.error(error_messages.recipe_setup_exception(game_data.rom_path, e))
+            return False
+    return True
+
+
+# Gamelist stage which makes a recipe for each game, on worker threads if more than one job is given
+class RecipeMaker:
+
+    def __init__(self, core_path, bios_dir, output_dir, link_strategy=None, jobs=1):
+        self.core_path = core_path
+        self.bios_dir = bios_dir
+        self.output_dir = output_dir
+        self.link_strategy = link_strategy
+        self.jobs = jobs
+        self.used_dir_names = set()
+        self.resized_bezels = ResizedBezels()
+        self.results = []
+        # Only a few games are submitted ahead of the workers, so memory use doesn't grow with the gamelist
+        self.pending = deque()
+        self.executor = ThreadPoolExecutor(max_workers=jobs) if jobs > 1 else None
+        if self.executor:
+            logger.info(info_messages.making_recipes_in_parallel(jobs))
+
+    def visit(self, game_data):
+        recipe_spec = get_recipe_spec(game_data, self.output_dir, self.used_dir_names)
+        if not self.executor:
+            self.results.append(make_recipe(self.core_path, self.bios_dir, recipe_spec, self.resized_bezels,
+                                            self.link_strategy))
+            return
+        if len(self.pending) >= self.jobs * 2:
+            self.results.append(self.pending.popleft().result())
+        self.pending.append(self.executor.submit(make_recipe, self.core_path, self.bios_dir, recipe_spec,
+                                                 self.resized_bezels, self.link_strategy))
+
+    def finish(self):
+        if self.executor:
+            self.results.extend(future.result() for future in self.pending)
+            self.pending.clear()
+            self.executor.shutdown()
+        self.resized_bezels.cleanup()
+
+
+def get_stage(input_path, core_path, bios_dir=None, output_dir=None, link_strategy=None, jobs=None):
+    if not validate_args(input_path, core_path, bios_dir, output_dir, link_strategy, jobs):
+        return None
     output_dir = os.path.abspath(output_dir) if output_dir else os.path.join(os.path.split(os.path.abspath(input_path))[0], 'recipes')
     common_utils.make_dir(output_dir)
-    gamelist = common_utils.read_gamelist_tree(input_path).getroot()
-    if gamelist:
-        for game_entry in gamelist:
-            game_data = common_utils.parse_game_entry(game_entry)
-            setup_uce_source(core_path, bios_dir, game_data, output_dir)
+    return RecipeMaker(core_path, bios_dir, output_dir, link_strategy, common_utils.get_jobs(jobs))
+
+
+@tracing.traced()
+def main(input_path, core_path, bios_dir=None, output_dir=None, link_strategy=None, jobs=None):
+    recipe_maker = get_stage(input_path, core_path, bios_dir=bios_dir, output_dir=output_dir,
+                             link_strategy=link_strategy, jobs=jobs)
+    if recipe_maker:
+        gamelist_stages.run(input_path, [recipe_maker])
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, format="%(levelname)s : %(asctime)s : %(message)s", datefmt="%H:%M:%S")
     parser = common_utils.get_cmd_line_args(operations.operations['gamelist_to_recipes']['options'])
     args = vars(parser.parse_args())
-    main(args['input_path'], args['core_path'], bios_dir=args['bios_dir'], output_dir=args['output_dir'])
+    main(args['input_path'], args['core_path'], bios_dir=args['bios_dir'], output_dir=args['output_dir'],
+         link_strategy=args['link_strategy'], jobs=args['jobs'])
 
 
 
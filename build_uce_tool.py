@@ -2,32 +2,43 @@
 
 import math
 import os
+import re
 import hashlib
 import zipfile
 import logging
 
-from shared import common_utils, info_messages, uce_utils, error_messages
+from shared import common_utils, info_messages, uce_utils, error_messages, tracing
 import operations
 
 logger = logging.getLogger(__name__)
 
+# Adjustments applied to the recipe as mksquashfs reads it, so the recipe never has to be copied or modified
+SQUASHFS_PSEUDO_DEFINITIONS = (
+    'exec.sh m 755 12 12',
+    'title.png s 777 12 12 boxart/boxart.png',
+    'save d 755 12 12'
+)
+
+SQUASHFS_EXCLUDES = ('title.png', 'save')
+
+SQUASHFS_WILDCARD_CHARS = re.compile(r'([\\*?\[\]!@+()|])')
+
 
 class UCEBuildPaths:
 
-    def __init__(self):
+    def __init__(self, input_dir):
         self.temp_dir = common_utils.create_temp_dir(__name__)
-        self.debugfs_temp_dir = (os.path.join(self.temp_dir, 'debugfs'))
         self.cart_tmp_file = os.path.join(self.temp_dir, 'cart_tmp_file.img')
         self.cart_save_file = os.path.join(self.temp_dir, 'cart_save_file.img')
-        self.md5_file = os.path.join(self.temp_dir, 'md5_file')
-        self.data_dir = os.path.join(self.temp_dir, 'data')
-        self.save_dir = os.path.join(self.temp_dir, 'data', 'save')
+        self.pseudo_file = os.path.join(self.temp_dir, 'pseudo_definitions.txt')
+        self.data_dir = input_dir
+        self.save_dir = os.path.join(input_dir, 'save')
         self.save_workdir = os.path.join(self.temp_dir, 'save_workdir')
         self.blank_save_workdir = os.path.join(self.temp_dir, 'blank_save_workdir')
         self.zip_workdir = os.path.join(self.temp_dir, 'zip_workdir')
 
     def cleanup(self):
-        common_utils.cleanup_temp_dir(__name__)
+        common_utils.cleanup_temp_dir(__name__, self.temp_dir)
 
 
 def check_os():
@@ -45,15 +56,24 @@ def validate_args(input_dir):
     return valid
 
 
-def relink_boxart(data_dir):
-    title_png = os.path.join(data_dir, 'title.png')
-    common_utils.delete_file(title_png)
-    if not common_utils.create_symlink('boxart/boxart.png', title_png):
-        logger.info(info_messages.COPY_SYMLINK_FAILED)
-        common_utils.copyfile(os.path.join(data_dir, 'boxart', 'boxart.png'), title_png)
+def escape_squashfs_wildcards(file_name):
+    return SQUASHFS_WILDCARD_CHARS.sub(r'\\\1', file_name)
+
+
+def get_squashfs_excludes(input_dir, output_path):
+    excludes = list(SQUASHFS_EXCLUDES)
+    # A UCE written into its own recipe dir by an earlier build must not end up inside the new one
+    if output_path and os.path.dirname(os.path.abspath(output_path)) == os.path.abspath(input_dir):
+        output_name = escape_squashfs_wildcards(os.path.basename(output_path))
+        excludes += [output_name, '{0}.tmp'.format(output_name)]
+    return excludes
+
+
+def write_pseudo_file(pseudo_file):
+    return common_utils.write_file(pseudo_file, '\n'.join(SQUASHFS_PSEUDO_DEFINITIONS) + '\n', 'w')
 
 
-def call_mksquashfs(input_dir, target_file, app_root):
+def call_mksquashfs(input_dir, target_file, app_root, pseudo_file, excludes):
     mksquashfs_args = [
         input_dir,
         target_file,
@@ -61,14 +81,17 @@ def call_mksquashfs(input_dir, target_file, app_root):
         '-force-uid', '12',
         '-force-gid', '12',
         '-noappend',
-        '-nopad'
+        '-nopad',
+        '-pf', pseudo_file,
+        '-wildcards',
+        '-e', *excludes
     ]
     if common_utils.get_platform() == 'win32':
         cmd = [os.path.join(app_root, 'windows', 'mksquashfs.exe')]
     else:
         cmd = ['mksquashfs']
     cmd += mksquashfs_args
-    common_utils.execute_with_output(cmd)
+    return common_utils.execute_with_output(cmd)
 
 
 def get_sq_image_real_bytes_used(sq_img_file_size):
@@ -78,48 +101,57 @@ def get_sq_image_real_bytes_used(sq_img_file_size):
     return real_bytes_used_divided_by_4K * 4096
 
 
-def make_squashfs_img(app_root, ub_paths):
-    call_mksquashfs(ub_paths.data_dir, ub_paths.cart_tmp_file, app_root)
-    sq_img_file_size = os.path.getsize(ub_paths.cart_tmp_file)
-    real_bytes_used = get_sq_image_real_bytes_used(sq_img_file_size)
-    count = int(real_bytes_used) - int(sq_img_file_size)
-    logger.info('Appending {0} bytes to {1}'.format(count, ub_paths.cart_tmp_file))
-    append_to_file(ub_paths.cart_tmp_file, bytearray(count))
-
-
-def get_md5(cart_temp_file):
-    md5_hash = hashlib.md5()
-    content = common_utils.get_file_content(cart_temp_file, 'rb')
-    md5_hash.update(content)
-    md5_hex_digest = md5_hash.hexdigest()
-    logger.info('md5 of {0} is {1}'.format(cart_temp_file, md5_hex_digest))
-    return md5_hex_digest
-
-
-def create_hex_file(md5_hex_digest, file_path):
-    binary_md5 = bytearray.fromhex(md5_hex_digest)
-    common_utils.write_file(file_path, binary_md5, 'wb')
-
-
-def append_to_file(start_file, append_data):
-    common_utils.write_file(start_file, append_data, 'ab')
-
-
-def append_file_to_file(start_file, end_file):
-    end_content = common_utils.get_file_content(end_file, 'rb')
-    append_to_file(start_file, end_content)
+@tracing.traced()
+def make_squashfs_img(app_root, ub_paths, output_path):
+    if not write_pseudo_file(ub_paths.pseudo_file):
+        return False
+    excludes = get_squashfs_excludes(ub_paths.data_dir, output_path)
+    return call_mksquashfs(ub_paths.data_dir, ub_paths.cart_tmp_file, app_root, ub_paths.pseudo_file, excludes)
 
 
-def append_md5_to_img(md5_source, md5_file, append_target):
-    md5_string = get_md5(md5_source)
-    create_hex_file(md5_string, md5_file)
-    append_file_to_file(append_target, md5_file)
+def get_md5(file_path):
+    md5_hash = common_utils.get_file_md5(file_path)
+    if md5_hash:
+        logger.info('md5 of {0} is {1}'.format(file_path, md5_hash.hexdigest()))
+    return md5_hash
 
 
-def prepare_source_files(input_dir, ub_paths):
-    common_utils.copytree(input_dir, ub_paths.data_dir, symlinks=True)
-    common_utils.set_755(os.path.join(ub_paths.data_dir, 'exec.sh'))
-    relink_boxart(ub_paths.data_dir)
+def write_uce(uce_file, ub_paths, save_md5_digest):
+    sq_img_file_size = os.path.getsize(ub_paths.cart_tmp_file)
+    padding = get_sq_image_real_bytes_used(sq_img_file_size) - sq_img_file_size
+    sq_md5 = hashlib.md5()
+    with open(ub_paths.cart_tmp_file, 'rb') as sq_img_file:
+        common_utils.copy_file_obj(sq_img_file, uce_file, sq_md5)
+    logger.info('Appending {0} bytes of padding to squashfs image'.format(padding))
+    sq_md5.update(bytes(padding))
+    uce_file.write(bytes(padding))
+    logger.info('md5 of {0} is {1}'.format(ub_paths.cart_tmp_file, sq_md5.hexdigest()))
+    uce_file.write(sq_md5.digest())
+    uce_file.write(bytes(32))
+    uce_file.write(save_md5_digest)
+    with open(ub_paths.cart_save_file, 'rb') as save_img_file:
+        common_utils.copy_file_obj(save_img_file, uce_file)
+
+
+@tracing.traced()
+def assemble_uce(ub_paths, output_path, save_md5_digest=None):
+    if not save_md5_digest:
+        save_md5 = get_md5(ub_paths.cart_save_file)
+        if not save_md5:
+            return False
+        save_md5_digest = save_md5.digest()
+    temp_output_path = '{0}.tmp'.format(output_path)
+    try:
+        with open(temp_output_path, 'wb') as uce_file:
+            write_uce(uce_file, ub_paths, save_md5_digest)
+        os.replace(temp_output_path, output_path)
+    except OSError as e:
+        logger.error(error_messages.access_failure('write', output_path, e))
+        if os.path.isfile(temp_output_path):
+            common_utils.delete_file(temp_output_path)
+        return False
+    logger.info(info_messages.access_success('wrote', output_path))
+    return True
 
 
 def get_first_save_file_in_dir(dir_path):
@@ -180,52 +212,55 @@ def prepare_files_based_save_contents(ub_paths):
 
 def prepare_blank_save(ub_paths):
     common_utils.make_dir(ub_paths.blank_save_workdir)
-    common_utils.make_dir(os.path.join(ub_paths.blank_save_workdir, 'upper'))
-    common_utils.make_dir(os.path.join(ub_paths.blank_save_workdir, 'work'))
-    common_utils.write_file(os.path.join(ub_paths.blank_save_workdir, 'upper', 'hiscore.dat'), '', 'w')
+    uce_utils.make_blank_save_dir(ub_paths.blank_save_workdir)
+
+
+def create_blank_save_img(ub_paths):
+    logger.info(info_messages.CREATING_BLANK_SAVE_PART)
+    save_md5_digest = uce_utils.copy_blank_save_part(ub_paths.cart_save_file)
+    if save_md5_digest:
+        return save_md5_digest
+    prepare_blank_save(ub_paths)
+    uce_utils.make_save_part_from_dir(ub_paths.blank_save_workdir, ub_paths.cart_save_file)
+    return None
 
 
+@tracing.traced()
 def create_save_img(ub_paths):
     save_file = look_for_save_file(ub_paths)
-    common_utils.make_dir(ub_paths.debugfs_temp_dir)
+    save_md5_digest = None
     if save_file:
         logger.info(info_messages.processing_save_file(save_file))
         save_img_from_save_file(save_file, ub_paths)
+        if os.path.isfile(ub_paths.cart_save_file):
+            uce_utils.modify_inodes(ub_paths.cart_save_file)
     elif os.path.isdir(ub_paths.save_dir) and os.listdir(ub_paths.save_dir):
         logger.info(info_messages.creating_save_from_files(ub_paths.save_dir))
         prepare_files_based_save_contents(ub_paths)
         uce_utils.make_save_part_from_dir(ub_paths.save_workdir, ub_paths.cart_save_file)
     if not os.path.isfile(ub_paths.cart_save_file):
-        logger.info(info_messages.CREATING_BLANK_SAVE_PART)
-        prepare_blank_save(ub_paths)
-        uce_utils.make_save_part_from_dir(ub_paths.blank_save_workdir, ub_paths.cart_save_file)
-    if os.path.isdir(ub_paths.save_dir):
-        common_utils.remove_dir(ub_paths.save_dir)
-    common_utils.make_dir(ub_paths.save_dir)
-    common_utils.make_dir(ub_paths.debugfs_temp_dir)
-    uce_utils.modify_inodes(ub_paths.debugfs_temp_dir, ub_paths.cart_save_file)
+        save_md5_digest = create_blank_save_img(ub_paths)
+    return save_md5_digest
 
 
-def main(input_dir, output_path=None):    
+def main(input_dir, output_path=None):
     input_dir = input_dir if input_dir else os.getcwd()
     if not check_os() or not validate_args(input_dir):
-        return
+        return False
     if not output_path:
         # TODO - Use os.path.basename
         output_path = os.path.join(input_dir, '{0}.uce'.format(os.path.split(os.path.abspath(input_dir))[-1]))
     logger.info('Building new UCE')
     app_root = common_utils.get_app_root()
-    ub_paths = UCEBuildPaths()
-    prepare_source_files(input_dir, ub_paths)
-    create_save_img(ub_paths)
-    make_squashfs_img(app_root, ub_paths)
-    append_md5_to_img(ub_paths.cart_tmp_file, ub_paths.md5_file, ub_paths.cart_tmp_file)
-    append_to_file(ub_paths.cart_tmp_file, bytearray(32))
-    append_md5_to_img(ub_paths.cart_save_file, ub_paths.md5_file, ub_paths.cart_tmp_file)
-    append_file_to_file(ub_paths.cart_tmp_file, ub_paths.cart_save_file)
-    common_utils.copyfile(ub_paths.cart_tmp_file, output_path)
-    logger.info('Built: {0}'.format(output_path))
+    ub_paths = UCEBuildPaths(os.path.abspath(input_dir))
+    with tracing.span('build_uce', 'game', recipe=input_dir):
+        save_md5_digest = create_save_img(ub_paths)
+        built = make_squashfs_img(app_root, ub_paths, output_path) and \
+            assemble_uce(ub_paths, output_path, save_md5_digest)
+    if built:
+        logger.info('Built: {0}'.format(output_path))
     ub_paths.cleanup()
+    return built
 
 
 if __name__ == "__main__":
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+import os
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from shared import common_utils, error_messages, info_messages, uce_utils
+import operations
+
+logger = logging.getLogger(__name__)
+
+REPORT_FILE_NAME = 'save_partitions_report.json'
+
+SAVE_PART_EXT = '.img'
+
+
+def validate_args(input_dir, parts_dir, parts_manifest, jobs):
+    logger.info('Validating arguments for bulk_save_parts')
+    valid = True
+    if not common_utils.validate_existing_dir(input_dir, 'Input dir'):
+        valid = False
+    if not common_utils.validate_optional_dir(parts_dir, 'Parts dir'):
+        valid = False
+    if parts_manifest and not common_utils.validate_required_path(parts_manifest, 'Parts manifest'):
+        valid = False
+    if not common_utils.validate_jobs(jobs):
+        valid = False
+    return valid
+
+
+def get_uce_paths(input_dir):
+    return sorted(os.path.join(input_dir, file_name) for file_name in os.listdir(input_dir)
+                  if os.path.splitext(file_name)[1].lower() == '.uce'
+                  and os.path.isfile(os.path.join(input_dir, file_name)))
+
+
+def get_uce_key(uce_path):
+    return common_utils.get_basename_no_ext(uce_path).lower()
+
+
+def read_parts_manifest(parts_manifest):
+    # Maps UCE file names to save partition paths, relative paths being relative to the manifest itself
+    manifest = common_utils.read_json(parts_manifest)
+    if not isinstance(manifest, dict):
+        logger.error(error_messages.invalid_parts_manifest(parts_manifest))
+        return None
+    manifest_dir = os.path.dirname(os.path.abspath(parts_manifest))
+    return {get_uce_key(uce_name): os.path.join(manifest_dir, str(part_path))
+            for uce_name, part_path in manifest.items()}
+
+
+def get_parts_in_dir(parts_dir):
+    return {get_uce_key(file_name): os.path.join(parts_dir, file_name) for file_name in sorted(os.listdir(parts_dir))
+            if os.path.splitext(file_name)[1].lower() == SAVE_PART_EXT}
+
+
+def match_parts_by_name(uce_paths, parts_dir):
+    # Names are matched case-insensitively since FAT32/exFAT USB sticks don't preserve case reliably
+    parts = get_parts_in_dir(parts_dir)
+    return {uce_path: parts.get(get_uce_key(uce_path), os.path.join(
+        parts_dir, common_utils.get_basename_no_ext(uce_path) + SAVE_PART_EXT)) for uce_path in uce_paths}
+
+
+def match_parts_from_manifest(uce_paths, manifest):
+    # UCEs the manifest doesn't list are kept, without a save partition, so they are reported as skipped
+    part_matches = {}
+    for uce_path in uce_paths:
+        part_matches[uce_path] = manifest.get(get_uce_key(uce_path))
+        if not part_matches[uce_path]:
+            logger.warning(error_messages.uce_not_in_parts_manifest(uce_path))
+    return part_matches
+
+
+def get_part_matches(uce_paths, parts_dir, parts_manifest):
+    if parts_manifest:
+        manifest = read_parts_manifest(parts_manifest)
+        return match_parts_from_manifest(uce_paths, manifest) if manifest is not None else None
+    return match_parts_by_name(uce_paths, parts_dir)
+
+
+def extract_one(uce_path, part_path):
+    common_utils.make_dir(os.path.dirname(part_path))
+    return uce_utils.extract_save_part(uce_path, part_path)
+
+
+def replace_one(uce_path, part_path, backup_uce=False):
+    if not os.path.isfile(part_path):
+        logger.warning(error_messages.no_save_part_for_uce(uce_path, part_path))
+        return None
+    if not uce_utils.recover_save_part(uce_path):
+        return False
+    if backup_uce:
+        common_utils.copyfile(uce_path, uce_path + '.bak')
+    return uce_utils.replace_save_part(uce_path, part_path)
+
+
+def run_for_each_uce(func, part_matches, jobs, **kwargs):
+    logger.info(info_messages.processing_save_parts(len(part_matches), jobs))
+    results = {}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(func, uce_path, part_path, **kwargs): uce_path
+                   for uce_path, part_path in part_matches.items() if part_path}
+        for future in as_completed(futures):
+            uce_path = futures[future]
+            try:
+                results[uce_path] = future.result()
+            except Exception as e:
+                logger.error(error_messages.save_part_exception(uce_path, e))
+                results[uce_path] = False
+    return results
+
+
+def get_report(operation_name, part_matches, results):
+    entries = []
+    for uce_path in sorted(part_matches):
+        result = results.get(uce_path)
+        status = 'skipped' if result is None else 'succeeded' if result else 'failed'
+        entries.append({'uce': uce_path, 'save_partition': part_matches[uce_path], 'status': status})
+    report = {'operation': operation_name, 'uces': entries}
+    for status in ('succeeded', 'failed', 'skipped'):
+        report[status] = len([entry for entry in entries if entry['status'] == status])
+    return report
+
+
+def write_report(report, report_dir):
+    for entry in report['uces']:
+        if entry['status'] == 'failed':
+            logger.error(error_messages.save_part_operation_failed(report['operation'], entry['uce']))
+    logger.info(info_messages.save_parts_summary(report['operation'], report['succeeded'], report['failed'],
+                                                 report['skipped']))
+    common_utils.write_json(os.path.join(report_dir, REPORT_FILE_NAME), report)
+
+
+def extract(input_dir, output_dir=None, parts_manifest=None, jobs=None):
+    input_dir = os.path.abspath(input_dir) if input_dir else os.getcwd()
+    if not validate_args(input_dir, None, parts_manifest, jobs):
+        return False
+    output_dir = os.path.abspath(output_dir) if output_dir else os.path.join(input_dir, 'saves')
+    common_utils.make_dir(output_dir)
+    part_matches = get_part_matches(get_uce_paths(input_dir), output_dir, parts_manifest)
+    if part_matches is None:
+        return False
+    results = run_for_each_uce(extract_one, part_matches, common_utils.get_jobs(jobs))
+    report = get_report('extract', part_matches, results)
+    write_report(report, output_dir)
+    return report
+
+
+def replace(input_dir, parts_dir=None, parts_manifest=None, backup_uce=False, jobs=None):
+    input_dir = os.path.abspath(input_dir) if input_dir else os.getcwd()
+    if not validate_args(input_dir, parts_dir, parts_manifest, jobs):
+        return False
+    if not parts_dir and not parts_manifest:
+        logger.error(error_messages.NO_SAVE_PARTS_SOURCE)
+        return False
+    parts_dir = os.path.abspath(parts_dir) if parts_dir else None
+    part_matches = get_part_matches(get_uce_paths(input_dir), parts_dir, parts_manifest)
+    if part_matches is None:
+        return False
+    results = run_for_each_uce(replace_one, part_matches, common_utils.get_jobs(jobs), backup_uce=backup_uce)
+    report = get_report('replace', part_matches, results)
+    write_report(report, input_dir)
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s : %(asctime)s : %(message)s", datefmt="%H:%M:%S")
+    parser = argparse.ArgumentParser(prog='bulk_save_parts')
+    sub_parsers = parser.add_subparsers(dest='operation', title='Operations')
+    sub_parsers.required = True
+    for operation in ('extract', 'replace'):
+        spec = operations.operations['{0}_save_partitions'.format(operation)]
+        common_utils.add_arguments_to_parser(sub_parsers.add_parser(operation, help=spec['help']), spec['options'])
+    args = vars(parser.parse_args())
+    if args['operation'] == 'extract':
+        extract(args['input_dir'], output_dir=args['output_dir'], parts_manifest=args['parts_manifest'],
+                jobs=args['jobs'])
+    else:
+        replace(args['input_dir'], parts_dir=args['parts_dir'], parts_manifest=args['parts_manifest'],
+                backup_uce=args['backup_uce'], jobs=args['jobs'])
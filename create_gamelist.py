@@ -1,16 +1,25 @@
 #!/usr/bin/env python3
 
 import os
+import hashlib
 from pathlib import Path
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
-from shared import configs, common_utils, error_messages, info_messages
+from shared import configs, common_utils, error_messages, info_messages, tracing, rom_manifest
 import operations
 
 logger = logging.getLogger(__name__)
 
 
-def validate_args(platform, scrape_module, input_dir, output_dir):
+# Per-shard Skyscraper caches are kept between runs, as the shared cache is not safe for concurrent scrapes
+SHARD_CACHE_ROOT_DIR = os.path.join(configs.CACHE_ROOT_DIR, 'skyscraper_shards')
+
+# Gamelist tags which hold paths to scraped media
+MEDIA_TAGS = ('thumbnail', 'marquee', 'image', 'video')
+
+
+def validate_args(platform, scrape_module, input_dir, output_dir, scrape_shards=None, scrape_threads=None):
     logger.info('Validating arguments for create_gamelist')
     valid = True
     if not platform or platform not in configs.PLATFORMS.keys():
@@ -23,6 +32,10 @@ def validate_args(platform, scrape_module, input_dir, output_dir):
         valid = False
     if not common_utils.validate_parent_dir(output_dir, 'Output dir'):
         valid = False
+    if not common_utils.validate_count(scrape_shards, 'Scrape shards'):
+        valid = False
+    if not common_utils.validate_count(scrape_threads, 'Scrape threads'):
+        valid = False
     return valid
 
 
@@ -61,44 +74,224 @@ def run_skyscraper(platform, input_dir, flags, config_path, sky_args):
            '-i', '{0}'.format(input_dir),
            '-c', '{0}'.format(config_path)] + sky_args
     cmd += ['--flags', ','.join(flags)] if flags else cmd
-    common_utils.execute_with_output(cmd)
+    return common_utils.execute_with_output(cmd)
 
 
-def scrape(platform, input_dir, scrape_flags, config_path, scrape_module, user_creds, refresh_rom_data, scrape_videos):
+@tracing.traced()
+def scrape(platform, input_dir, scrape_flags, config_path, scrape_module, user_creds, refresh_rom_data, scrape_videos,
+           scrape_threads=None, shard_args=()):
     sky_args = ['-s', scrape_module]
     if user_creds:
         sky_args += ['-u', user_creds]
     if refresh_rom_data:
         sky_args.append('--refresh')
+    if scrape_threads:
+        sky_args += ['-t', str(common_utils.get_jobs(scrape_threads))]
     if scrape_videos:
-        scrape_flags.append('videos')
-    run_skyscraper(platform, input_dir, scrape_flags, config_path, sky_args)
+        scrape_flags = scrape_flags + ['videos']
+    return run_skyscraper(platform, input_dir, scrape_flags, config_path, sky_args + list(shard_args))
 
 
-def create_gamelist(platform, input_dir, game_list_flags, config_path, art_xml_path, output_dir):
+@tracing.traced()
+def create_gamelist(platform, input_dir, game_list_flags, config_path, art_xml_path, output_dir, shard_args=()):
     sky_args = ['-a', '{0}'.format(art_xml_path),
                 '-g', '{0}'.format(output_dir),
                 '-o', '{0}'.format(os.path.join(output_dir, 'media'))]
-    run_skyscraper(platform, input_dir, game_list_flags, config_path, sky_args)
+    return run_skyscraper(platform, input_dir, game_list_flags, config_path, sky_args + list(shard_args))
+
+
+def get_rom_paths(input_dir, output_dir):
+    # Skyscraper is run with 'nosubdirs' and skips any files it doesn't recognise for the platform, so every file at
+    # the top of the input dir is a candidate, apart from the gamelist and manifest when they are written there too
+    output_paths = {os.path.join(output_dir, 'gamelist.xml'), rom_manifest.get_manifest_path(output_dir)}
+    rom_paths = (os.path.join(input_dir, file_name) for file_name in os.listdir(input_dir))
+    return sorted(rom_path for rom_path in rom_paths if os.path.isfile(rom_path) and rom_path not in output_paths)
+
+
+def get_shard_index(rom_path, num_shards):
+    # Based on the file name only, so a rom stays in the same shard (and its cache) from one run to the next
+    name_hash = hashlib.md5(os.path.basename(rom_path).encode('utf-8')).hexdigest()
+    return int(name_hash, 16) % num_shards
+
+
+def get_shards(rom_paths, num_shards):
+    shards = [[] for _ in range(num_shards)]
+    for rom_path in rom_paths:
+        shards[get_shard_index(rom_path, num_shards)].append(rom_path)
+    return [(index, shard) for index, shard in enumerate(shards) if shard]
+
+
+def setup_shard(platform, index, rom_paths, num_shards, temp_dir):
+    shard_dir = os.path.join(temp_dir, 'shard_{0}'.format(index))
+    common_utils.make_dir(shard_dir)
+    config_path = os.path.join(shard_dir, 'config.ini')
+    common_utils.write_file(config_path, ''.join(configs.SKYSCRAPER_CONFIG), 'w')
+    include_path = os.path.join(shard_dir, 'roms.txt')
+    common_utils.write_file(include_path, '\n'.join(rom_paths), 'w')
+    shard_args = ['--includefrom', include_path]
+    if num_shards > 1:
+        cache_dir = os.path.join(SHARD_CACHE_ROOT_DIR, platform, '{0}_of_{1}'.format(index + 1, num_shards))
+        os.makedirs(cache_dir, exist_ok=True)
+        shard_args = ['-d', cache_dir] + shard_args
+    return {
+        'config_path': config_path,
+        'output_dir': os.path.join(shard_dir, 'gamelist'),
+        'shard_args': shard_args
+    }
+
+
+def scrape_shard(platform, input_dir, shard, scrape_module, user_creds, refresh_rom_data, scrape_videos,
+                 scrape_threads, art_xml_path):
+    with tracing.span('scrape_shard', 'shard', output_dir=shard['output_dir']):
+        if not scrape(platform, input_dir, configs.SCRAPE_FLAGS, shard['config_path'], scrape_module, user_creds,
+                      refresh_rom_data, scrape_videos, scrape_threads, shard['shard_args']):
+            return False
+        return create_gamelist(platform, input_dir, configs.GAME_LIST_FLAGS, shard['config_path'], art_xml_path,
+                               shard['output_dir'], shard['shard_args'])
+
+
+def merge_shard_media(shard_media_dir, media_dir):
+    for root, dirs, files in os.walk(shard_media_dir):
+        dest_dir = os.path.join(media_dir, os.path.relpath(root, shard_media_dir))
+        os.makedirs(dest_dir, exist_ok=True)
+        for file_name in files:
+            common_utils.move_file(os.path.join(root, file_name), os.path.join(dest_dir, file_name))
+
+
+def get_media_paths(game_entry, media_dir):
+    # Only absolute paths inside the media dir are ever moved or deleted, never art the user pointed at themselves
+    for tag in game_entry:
+        if tag.tag in MEDIA_TAGS and tag.text and os.path.isabs(tag.text):
+            rel_path = os.path.relpath(tag.text, media_dir)
+            if not rel_path.startswith(os.pardir):
+                yield tag, rel_path
+
+
+def relocate_media_paths(game_entry, shard_media_dir, media_dir):
+    for tag, rel_path in get_media_paths(game_entry, shard_media_dir):
+        tag.text = os.path.join(media_dir, rel_path)
+
+
+def get_entry_sort_key(game_entry):
+    return game_entry.tag, common_utils.get_game_entry_val(game_entry, 'path'), \
+        common_utils.get_game_entry_val(game_entry, 'name')
+
+
+def get_kept_entries(gamelist_path, dropped_rom_names, media_dir):
+    # Entries for changed or deleted roms are dropped, along with their media, and the rest carried over as they are
+    gamelist_tree = common_utils.read_gamelist_tree(gamelist_path)
+    if not gamelist_tree:
+        return []
+    kept_entries = []
+    for game_entry in gamelist_tree.getroot():
+        if os.path.basename(common_utils.get_game_entry_val(game_entry, 'path')) not in dropped_rom_names:
+            kept_entries.append(game_entry)
+            continue
+        for tag, rel_path in get_media_paths(game_entry, media_dir):
+            if os.path.isfile(tag.text):
+                common_utils.delete_file(tag.text)
+    return kept_entries
+
+
+@tracing.traced()
+def merge_gamelists(shards, output_dir, game_entries=None):
+    # Entries are sorted by path so the merged gamelist is the same however the roms were split between shards
+    media_dir = os.path.join(output_dir, 'media')
+    game_entries = list(game_entries) if game_entries else []
+    for shard in shards:
+        shard_gamelist_path = os.path.join(shard['output_dir'], 'gamelist.xml')
+        gamelist_tree = common_utils.read_gamelist_tree(shard_gamelist_path) \
+            if os.path.isfile(shard_gamelist_path) else None
+        if not gamelist_tree:
+            continue
+        shard_media_dir = os.path.join(shard['output_dir'], 'media')
+        for game_entry in gamelist_tree.getroot():
+            relocate_media_paths(game_entry, shard_media_dir, media_dir)
+            game_entries.append(game_entry)
+        merge_shard_media(shard_media_dir, media_dir)
+    logger.info(info_messages.merged_shard_gamelists(len(shards), len(game_entries)))
+    return common_utils.write_gamelist(os.path.join(output_dir, 'gamelist.xml'),
+                                       sorted(game_entries, key=get_entry_sort_key))
+
+
+@tracing.traced()
+def scrape_in_shards(platform, input_dir, rom_paths, num_shards, scrape_module, user_creds, refresh_rom_data,
+                     scrape_videos, scrape_threads, art_xml_path, temp_dir):
+    shards = [setup_shard(platform, index, shard_rom_paths, num_shards, temp_dir)
+              for index, shard_rom_paths in get_shards(rom_paths, num_shards)]
+    if num_shards > 1:
+        logger.info(info_messages.scraping_in_shards(len(shards)))
+    # Sets up a packaged Skyscraper, if there is one, before the shards start using it
+    get_skyscraper_bin()
+    with ThreadPoolExecutor(max_workers=max(len(shards), 1)) as executor:
+        results = list(executor.map(lambda shard: scrape_shard(platform, input_dir, shard, scrape_module, user_creds,
+                                                               refresh_rom_data, scrape_videos, scrape_threads,
+                                                               art_xml_path), shards))
+    if not all(results):
+        logger.error(error_messages.SCRAPE_SHARD_FAILED)
+    return shards, all(results)
+
+
+def get_cached_output_dir(platform, input_dir):
+    # Where the scrape to UCEs/recipes operations keep their gamelist, so later runs only scrape what has changed
+    input_dir = os.path.abspath(input_dir) if input_dir else os.getcwd()
+    platform_dir = os.path.join(configs.SCRAPED_GAMELIST_ROOT_DIR, platform)
+    os.makedirs(platform_dir, exist_ok=True)
+    return os.path.join(platform_dir, hashlib.sha1(input_dir.encode('utf-8')).hexdigest()[:16])
 
 
-def main(platform, input_dir, scrape_module=None, user_name=None, password=None, output_dir=None, refresh_rom_data=False, scrape_videos=False):
+@tracing.traced()
+def main(platform, input_dir, scrape_module=None, user_name=None, password=None, output_dir=None, refresh_rom_data=False, scrape_videos=False,
+         scrape_shards=None, scrape_threads=None):
     logger.info('Starting gamelist builder')
     scrape_module = scrape_module if scrape_module else 'screenscraper'
     input_dir = os.path.abspath(input_dir) if input_dir else os.getcwd()
-    if not validate_args(platform, scrape_module, input_dir, output_dir):
+    if not validate_args(platform, scrape_module, input_dir, output_dir, scrape_shards, scrape_threads):
         return
     output_dir = os.path.abspath(output_dir) if output_dir else os.path.join(input_dir, 'gamelist')
+    gamelist_path = os.path.join(output_dir, 'gamelist.xml')
+    if not os.path.isdir(output_dir):
+        common_utils.make_dir(output_dir)
+    manifest = rom_manifest.read_manifest(output_dir, platform, scrape_module, scrape_videos)
+    # Refreshing rom data means scraping everything again, so only an otherwise complete previous run is built on
+    incremental = bool(manifest['roms']) and not refresh_rom_data and os.path.isfile(gamelist_path)
+    rom_paths = get_rom_paths(input_dir, output_dir)
+    changed_paths, removed_names, records = rom_manifest.get_rom_changes(
+        manifest if incremental else rom_manifest.get_blank_manifest(platform, scrape_module, scrape_videos), rom_paths)
+    if incremental and not changed_paths and not removed_names:
+        logger.info(info_messages.GAMELIST_UP_TO_DATE)
+        rom_manifest.write_manifest(output_dir, dict(manifest, roms=records))
+        return gamelist_path
     temp_dir = common_utils.create_temp_dir(__name__)
     config_path = os.path.join(temp_dir, 'config.ini')
     art_xml_path = os.path.join(temp_dir, 'artwork.xml')
     common_utils.write_file(config_path, ''.join(configs.SKYSCRAPER_CONFIG), 'w')
     common_utils.write_file(art_xml_path, ''.join(configs.ARTWORK), 'w')
     user_creds = get_user_creds_arg(user_name, password)
-    scrape(platform, input_dir, configs.SCRAPE_FLAGS, config_path, scrape_module, user_creds, refresh_rom_data, scrape_videos)
-    create_gamelist(platform, input_dir, configs.GAME_LIST_FLAGS, config_path, art_xml_path, output_dir)
+    num_shards = common_utils.get_jobs(scrape_shards)
+    if incremental:
+        logger.info(info_messages.scraping_changed_roms(len(changed_paths), len(removed_names)))
+        shards, success = scrape_in_shards(platform, input_dir, changed_paths, num_shards, scrape_module, user_creds,
+                                           refresh_rom_data, scrape_videos, scrape_threads, art_xml_path, temp_dir) \
+            if changed_paths else ([], True)
+        dropped_rom_names = set(removed_names) | {os.path.basename(rom_path) for rom_path in changed_paths}
+        merge_gamelists(shards, output_dir,
+                        get_kept_entries(gamelist_path, dropped_rom_names, os.path.join(output_dir, 'media')))
+    elif num_shards > 1:
+        shards, success = scrape_in_shards(platform, input_dir, rom_paths, num_shards, scrape_module, user_creds,
+                                           refresh_rom_data, scrape_videos, scrape_threads, art_xml_path, temp_dir)
+        merge_gamelists(shards, output_dir)
+    else:
+        success = scrape(platform, input_dir, configs.SCRAPE_FLAGS, config_path, scrape_module, user_creds, refresh_rom_data, scrape_videos,
+                         scrape_threads)
+        success = create_gamelist(platform, input_dir, configs.GAME_LIST_FLAGS, config_path, art_xml_path, output_dir) and success
+    if not success:
+        # Left out of the manifest so they are tried again next time
+        for rom_path in changed_paths:
+            records.pop(os.path.basename(rom_path), None)
+    rom_manifest.write_manifest(output_dir, dict(manifest, roms=records))
     common_utils.cleanup_temp_dir(__name__)
-    return os.path.join(output_dir, 'gamelist.xml')
+    return gamelist_path
 
 
 if __name__ == "__main__":
@@ -107,4 +300,4 @@ if __name__ == "__main__":
     args = vars(parser.parse_args())
     main(args['platform'], args['input_dir'], scrape_module=args['scrape_module'], user_name=args['user_name'],
          password=args['password'], output_dir=args['output_dir'], refresh_rom_data=args['refresh_rom_data'],
-         scrape_videos=args['scrape_videos'])
+         scrape_videos=args['scrape_videos'], scrape_shards=args['scrape_shards'], scrape_threads=args['scrape_threads'])
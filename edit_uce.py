@@ -14,7 +14,6 @@ class EditUCEConfig:
 
     def __init__(self, input_path, file_manager):
         self.temp_dir = common_utils.create_temp_dir(__name__)
-        self.debugfs_temp_dir = (os.path.join(self.temp_dir, 'debugfs'))
         self.input_path = os.path.abspath(input_path)
         self.img_path = os.path.join(self.temp_dir, 'save.img')
         self.save_part_contents_path = os.path.join(self.temp_dir, 'save_part_contents')
@@ -39,7 +38,7 @@ class EditUCEConfig:
         logger.error(error_messages.NO_FILE_MAN_FOUND)
 
     def cleanup(self):
-        common_utils.cleanup_temp_dir(__name__)
+        common_utils.cleanup_temp_dir(__name__, self.temp_dir)
 
 
 def validate_args(input_path):
@@ -83,21 +82,6 @@ def unmount_image(save_part_contents_path):
 # Cmd-based edit functions
 
 
-def extract_img_contents(temp_dir, return_dir=os.getcwd()):
-    bin_ = common_utils.get_platform_bin('debugfs.exe', 'debugfs')
-    cmd_file_path = os.path.join(temp_dir, 'extract_cmd.txt')
-    common_utils.write_file(cmd_file_path, 'rdump / save_part_contents', 'w')
-    os.chdir(temp_dir)
-    cmd = [
-        bin_,
-        '-f',
-        cmd_file_path,
-        'save.img'
-    ]
-    common_utils.execute_with_output(cmd)
-    os.chdir(return_dir)
-
-
 def get_save_contents(save_part_contents_path):
     save_dirs = []
     save_files = []
@@ -130,15 +114,13 @@ def edit_save_part_with_mount(ec_config):
 
 
 def edit_save_part_with_cmds(ec_config, continue_check):
-    extract_img_contents(ec_config.temp_dir)
+    if not uce_utils.dump_save_part(ec_config.img_path, ec_config.save_part_contents_path, from_uce=False):
+        return False
     set_all_755(ec_config.save_part_contents_path)
     edit_contents(ec_config.save_part_contents_path, ec_config.file_manager)
     continue_check()
     common_utils.delete_file(ec_config.img_path)
-    uce_utils.make_save_part_from_dir(ec_config.save_part_contents_path, ec_config.img_path)
-    common_utils.make_dir(ec_config.debugfs_temp_dir)
-    uce_utils.modify_inodes(ec_config.debugfs_temp_dir, ec_config.img_path)
-    return True
+    return uce_utils.make_save_part_from_dir(ec_config.save_part_contents_path, ec_config.img_path)
 
 
 def edit_save_part(ec_config, mount_method, continue_check):
@@ -159,15 +141,17 @@ def main(input_path, backup_uce=False, mount_method=False, file_manager=None, co
     if not ec_config.file_manager:
         return False
     continue_check = continue_check if continue_check else console_continue_check
-    squashfs_etc_data, save_data = uce_utils.split_uce(input_path)
-    common_utils.write_file(ec_config.img_path, save_data, 'wb')
+    if not uce_utils.extract_save_part(ec_config.input_path, ec_config.img_path):
+        ec_config.cleanup()
+        return False
     if backup_uce:
         backup_path = input_path + '.bak'
         common_utils.copyfile(input_path, backup_path)
     common_utils.make_dir(ec_config.save_part_contents_path)
-    if edit_save_part(ec_config, mount_method, continue_check):
-        uce_utils.rebuild_uce(ec_config.input_path, squashfs_etc_data, ec_config.img_path)
+    edited = edit_save_part(ec_config, mount_method, continue_check) and \
+        uce_utils.replace_save_part(ec_config.input_path, ec_config.img_path)
     ec_config.cleanup()
+    return edited
 
 
 if __name__ == "__main__":
@@ -6,7 +6,7 @@ import logging
 from PIL import Image, ImageDraw, ImageFont
 
 import operations
-from shared import common_utils
+from shared import common_utils, tracing, gamelist_stages
 
 logger = logging.getLogger(__name__)
 
@@ -64,26 +64,26 @@ def make_asset_dirs(asset_paths, export_cox_assets, export_bitpixel_marquees):
 
 
 def exp_bitpixel_marquee(game_data, asset_paths):
-    marquee_path = game_data['marquee_path']
+    marquee_path = game_data.marquee_path
     if marquee_path:
         save_path = os.path.join(asset_paths['bitpixel'], os.path.basename(marquee_path))
         common_utils.resize_and_save_image(marquee_path, save_path, 128, 32)
 
 
 def add_to_playlists(game_data, playlists):
-    genres = [genre.strip() for genre in game_data['genre'].split(',')]
-    uce_basename = os.path.basename(game_data['rom_path'])
+    genres = [genre.strip() for genre in game_data.genre.split(',')]
+    uce_basename = os.path.basename(game_data.rom_path)
     for genre in genres:
         if genre:
             if genre not in playlists['genres']:
                 playlists['genres'][genre] = []
             playlists['genres'][genre].append(uce_basename)
-    publisher = game_data['publisher']
+    publisher = game_data.publisher
     if publisher:
         if publisher not in playlists['publishers']:
             playlists['publishers'][publisher] = []
         playlists['publishers'][publisher].append(uce_basename)
-    num_players = game_data['players']
+    num_players = game_data.players
     if num_players:
         players_key = '{0} Player'.format(num_players)
         if players_key not in playlists['players']:
@@ -93,14 +93,14 @@ def add_to_playlists(game_data, playlists):
 
 
 def exp_cox_assets(game_data, asset_paths):
-    if game_data['boxart_path']:
-        common_utils.copyfile(game_data['boxart_path'], asset_paths['covers'])
-    if game_data['marquee_path']:
-        common_utils.copyfile(game_data['marquee_path'], asset_paths['marquees'])
-    if game_data['logo_path']:
-        common_utils.copyfile(game_data['logo_path'], asset_paths['logos'])
-    if game_data['video_path']:
-        common_utils.copyfile(game_data['video_path'], asset_paths['videos'])
+    if game_data.boxart_path:
+        common_utils.copyfile(game_data.boxart_path, asset_paths['covers'])
+    if game_data.marquee_path:
+        common_utils.copyfile(game_data.marquee_path, asset_paths['marquees'])
+    if game_data.logo_path:
+        common_utils.copyfile(game_data.logo_path, asset_paths['logos'])
+    if game_data.video_path:
+        common_utils.copyfile(game_data.video_path, asset_paths['videos'])
 
 
 def save_playlist_art(playlist_name, playlist_file_name, playlist_art_spec, asset_paths):
@@ -114,6 +114,7 @@ def save_playlist_art(playlist_name, playlist_file_name, playlist_art_spec, asse
     img.save(os.path.join(asset_paths['playlist_art'], '{0}{1}'.format(playlist_file_name, '.png')), 'PNG')
 
 
+@tracing.traced()
 def save_playlists(playlists, asset_paths):
     common_utils.make_dir(asset_paths['playlists'])
     common_utils.make_dir(asset_paths['playlist_art'])
@@ -126,28 +127,45 @@ def save_playlists(playlists, asset_paths):
             save_playlist_art(playlist, playlist_file_name, playlist_art_spec, asset_paths)
 
 
-def export(gamelist, asset_paths, export_cox_assets, export_bitpixel_marquees):
-    playlists = {'genres': {}, 'publishers': {}, 'players': {}, 'all': {'All': []}}
-    for game_entry in gamelist:
-        game_data = common_utils.parse_game_entry(game_entry)
-        if export_bitpixel_marquees:
-            exp_bitpixel_marquee(game_data, asset_paths)
-        if export_cox_assets:
-            exp_cox_assets(game_data, asset_paths)
-            add_to_playlists(game_data, playlists)
-    save_playlists(playlists, asset_paths)
+# Gamelist stage which exports each game's assets, then writes the playlists once every game has been seen
+class AssetExporter:
 
+    def __init__(self, asset_paths, export_cox_assets, export_bitpixel_marquees):
+        self.asset_paths = asset_paths
+        self.export_cox_assets = export_cox_assets
+        self.export_bitpixel_marquees = export_bitpixel_marquees
+        self.playlists = {'genres': {}, 'publishers': {}, 'players': {}, 'all': {'All': []}}
 
-def main(input_path, output_dir=None, export_cox_assets=False, export_bitpixel_marquees=False):
+    def visit(self, game_data):
+        with tracing.span('export_assets', 'game', rom=game_data.rom_path):
+            if self.export_bitpixel_marquees:
+                exp_bitpixel_marquee(game_data, self.asset_paths)
+            if self.export_cox_assets:
+                exp_cox_assets(game_data, self.asset_paths)
+                add_to_playlists(game_data, self.playlists)
+
+    def finish(self):
+        save_playlists(self.playlists, self.asset_paths)
+
+
+def get_stage(input_path, output_dir=None, export_cox_assets=False, export_bitpixel_marquees=False):
     if not check_export_required(export_cox_assets, export_bitpixel_marquees):
-        return False
+        return None
     output_dir = output_dir if output_dir else os.path.abspath(os.path.dirname(input_path))
     if not validate_args(input_path, output_dir):
-        return False
-    gamelist = common_utils.read_gamelist_tree(input_path).getroot()
+        return None
     asset_paths = get_asset_paths(output_dir)
     make_asset_dirs(asset_paths, export_cox_assets, export_bitpixel_marquees)
-    export(gamelist, asset_paths, export_cox_assets, export_bitpixel_marquees)
+    return AssetExporter(asset_paths, export_cox_assets, export_bitpixel_marquees)
+
+
+@tracing.traced()
+def main(input_path, output_dir=None, export_cox_assets=False, export_bitpixel_marquees=False):
+    asset_exporter = get_stage(input_path, output_dir=output_dir, export_cox_assets=export_cox_assets,
+                               export_bitpixel_marquees=export_bitpixel_marquees)
+    if not asset_exporter:
+        return False
+    gamelist_stages.run(input_path, [asset_exporter])
 
 
 if __name__ == "__main__":
@@ -17,16 +17,23 @@ def validate_args(input_path):
     return valid
 
 
-def main(input_path, output_path=None):
+def dump_contents_to_dir(input_path, output_path):
+    output_path = os.path.abspath(output_path) if output_path else \
+        os.path.join(os.path.dirname(input_path), '{0}_save'.format(common_utils.get_basename_no_ext(input_path)))
+    return uce_utils.dump_save_part(input_path, output_path)
+
+
+def main(input_path, output_path=None, dump_contents=False):
     if not validate_args(input_path):
         return False
+    if dump_contents:
+        return dump_contents_to_dir(input_path, output_path)
     output_path = os.path.abspath(output_path) if output_path else os.path.join(os.path.dirname(input_path), 'save.img')
-    _, save_data = uce_utils.split_uce(input_path)
-    common_utils.write_file(output_path, save_data, 'wb')
+    return uce_utils.extract_save_part(input_path, output_path)
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, format="%(levelname)s : %(asctime)s : %(message)s", datefmt="%H:%M:%S")
     parser = common_utils.get_cmd_line_args(operations.operations['extract_save_partition']['options'])
     args = vars(parser.parse_args())
-    main(args['input_path'], output_path=args['output_path'])
+    main(args['input_path'], output_path=args['output_path'], dump_contents=args['dump_contents'])
@@ -50,6 +50,15 @@ extra_build_opts = (
     }
 )
 
+link_strategy_opt = {
+    'name': 'link_strategy',
+    'cli_short': 'l',
+    'gui_required': False,
+    'type': 'text',
+    'help': help_messages.LINK_STRATEGY,
+    'selections': configs.LINK_STRATEGIES
+}
+
 platform_opt = {
         'name': 'platform',
         'cli_short': 'p',
@@ -95,6 +104,20 @@ other_scrape_opts = (
         'gui_required': False,
         'type': 'bool',
         'help': help_messages.REFRESH_ROM_DATA
+    },
+    {
+        'name': 'scrape_shards',
+        'cli_short': 'n',
+        'gui_required': False,
+        'type': 'text',
+        'help': help_messages.SCRAPE_SHARDS
+    },
+    {
+        'name': 'scrape_threads',
+        'cli_short': 't',
+        'gui_required': False,
+        'type': 'text',
+        'help': help_messages.SCRAPE_THREADS
     }
 )
 
@@ -163,6 +186,22 @@ replace_save_part_opt = {
     'help': help_messages.PART_PATH
 }
 
+parts_dir_opt = {
+    'name': 'parts_dir',
+    'cli_short': 'p',
+    'gui_required': False,
+    'type': 'dir',
+    'help': help_messages.PARTS_DIR
+}
+
+parts_manifest_opt = {
+    'name': 'parts_manifest',
+    'cli_short': 'm',
+    'gui_required': False,
+    'type': 'file_open',
+    'help': help_messages.PARTS_MANIFEST
+}
+
 edit_save_part_opts = (
     {
         'name': 'mount_method',
@@ -179,6 +218,47 @@ edit_save_part_opts = (
         'help': help_messages.FILE_MANAGER}
 )
 
+jobs_opt = {
+    'name': 'jobs',
+    'cli_short': 'j',
+    'gui_required': False,
+    'type': 'text',
+    'help': help_messages.JOBS
+}
+
+bezel_jobs_opt = {
+    'name': 'jobs',
+    'cli_short': 'j',
+    'gui_required': False,
+    'type': 'text',
+    'help': help_messages.BEZEL_JOBS
+}
+
+build_cache_opts = (
+    {
+        'name': 'force',
+        'cli_short': 'F',
+        'gui_required': False,
+        'type': 'bool',
+        'help': help_messages.FORCE
+    },
+    {
+        'name': 'hash_contents',
+        'cli_short': 'H',
+        'gui_required': False,
+        'type': 'bool',
+        'help': help_messages.HASH_CONTENTS
+    }
+)
+
+dump_contents_opt = {
+    'name': 'dump_contents',
+    'cli_short': 'D',
+    'gui_required': False,
+    'type': 'bool',
+    'help': help_messages.DUMP_CONTENTS
+}
+
 backup_save_part_opt = {
     'name': 'backup_uce',
     'cli_short': 'B',
@@ -187,9 +267,10 @@ backup_save_part_opt = {
     'help': help_messages.BACKUP_UCE
 }
 
-scrape_and_build_opts = (input_dir_opt, output_dir_opt, *extra_build_opts, platform_opt, *other_scrape_opts)
+scrape_and_build_opts = (input_dir_opt, output_dir_opt, *extra_build_opts, link_strategy_opt, jobs_opt, platform_opt,
+                         *other_scrape_opts)
 
-build_from_game_list_opts = (input_path_opt, output_dir_opt, *extra_build_opts)
+build_from_game_list_opts = (input_path_opt, output_dir_opt, *extra_build_opts, link_strategy_opt, jobs_opt)
 
 operations = {
     'scrape_to_uces': { #
@@ -205,7 +286,7 @@ operations = {
         'gui_user_continue_check': False
     },
     'scrape_to_gamelist': { #
-        'options': (input_dir_opt, output_dir_opt, platform_opt, *other_scrape_opts, do_summarise_gamelist_opt, do_bezel_scape_opt, *add_bezels_to_gamelist_opts,),
+        'options': (input_dir_opt, output_dir_opt, platform_opt, *other_scrape_opts, do_summarise_gamelist_opt, do_bezel_scape_opt, *add_bezels_to_gamelist_opts, bezel_jobs_opt),
         'runner': runners.scrape_and_make_gamelist,
         'help': help_messages.SCRAPE_TO_GAMELIST,
         'gui_user_continue_check': False
@@ -229,7 +310,7 @@ operations = {
         'gui_user_continue_check': False
     },
     'add_bezels_to_gamelist': { #
-        'options': (input_path_opt, platform_opt, *add_bezels_to_gamelist_opts, do_summarise_gamelist_opt),
+        'options': (input_path_opt, platform_opt, *add_bezels_to_gamelist_opts, bezel_jobs_opt, do_summarise_gamelist_opt),
         'runner': runners.add_bezels_to_existing_gamelist,
         'help': help_messages.ADD_BEZELS_TO_GAMELIST,
         'gui_user_continue_check': False
@@ -241,7 +322,7 @@ operations = {
         'gui_user_continue_check': False
     },
     'recipes_to_uces': {
-        'options': (input_dir_opt, output_dir_opt),
+        'options': (input_dir_opt, output_dir_opt, jobs_opt, *build_cache_opts),
         'runner': runners.build_uces_from_recipes,
         'help': help_messages.RECIPES_TO_UCES,
         'gui_user_continue_check': False
@@ -259,7 +340,7 @@ operations = {
         'gui_user_continue_check': True
     },
     'extract_save_partition': {
-        'options': (input_path_opt, output_path_opt),
+        'options': (input_path_opt, output_path_opt, dump_contents_opt),
         'runner': runners.extract_uce_save_partition,
         'help': help_messages.EXTRACT_SAVE_PARTITION,
         'gui_user_continue_check': False
@@ -269,5 +350,17 @@ operations = {
         'runner': runners.replace_uce_save_partition,
         'help': help_messages.REPLACE_SAVE_PARTITION,
         'gui_user_continue_check': False
+    },
+    'extract_save_partitions': {
+        'options': (input_dir_opt, output_dir_opt, parts_manifest_opt, jobs_opt),
+        'runner': runners.extract_uce_save_partitions,
+        'help': help_messages.EXTRACT_SAVE_PARTITIONS,
+        'gui_user_continue_check': False
+    },
+    'replace_save_partitions': {
+        'options': (input_dir_opt, parts_dir_opt, parts_manifest_opt, backup_save_part_opt, jobs_opt),
+        'runner': runners.replace_uce_save_partitions,
+        'help': help_messages.REPLACE_SAVE_PARTITIONS,
+        'gui_user_continue_check': False
     }
 }
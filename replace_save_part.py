@@ -20,11 +20,12 @@ def validate_args(input_path, part_path):
 def main(input_path, part_path, backup_uce=False):
     if not validate_args(input_path, part_path):
         return False
-    squashfs_etc_data, save_data = uce_utils.split_uce(input_path)
+    if not uce_utils.recover_save_part(input_path):
+        return False
     if backup_uce:
         backup_path = input_path + '.bak'
         common_utils.copyfile(input_path, backup_path)
-    uce_utils.rebuild_uce(input_path, squashfs_etc_data, part_path)
+    return uce_utils.replace_save_part(input_path, part_path)
 
 
 if __name__ == "__main__":
@@ -4,100 +4,138 @@ import os
 import logging
 
 import build_from_recipes
+import build_from_gamelist
 import build_uce_tool
 import create_gamelist
 import build_recipes
 import edit_uce
 import extract_save_part
 import replace_save_part
+import bulk_save_parts
 import export_gamelist_assets
 import summarise_gamelist
 import add_bezels_to_gamelist
-from shared import common_utils, info_messages
+from shared import info_messages, tracing, gamelist_stages
 
 logger = logging.getLogger(__name__)
 
 
-def scrape_and_build_uces(args):
-    logger.info(info_messages.start_operation("'scrape to uces'"))
-    temp_dir = common_utils.create_temp_dir(__name__)
-    recipes_temp_dir = os.path.join(temp_dir, 'recipes')
-    gamelist_path = create_gamelist.main(args['platform'], args['input_dir'], scrape_module=args['scrape_module'],
-                         user_name=args['user_name'], password=args['password'], output_dir=temp_dir,
-                         refresh_rom_data=args['refresh_rom_data'], scrape_videos=args['scrape_videos'])
-    # gamelist_path = os.path.join(temp_dir, 'gamelist.xml')
-    print('Hello 1')
-    add_bezels_to_gamelist.main(gamelist_path, args['platform'], min_match_score=args['min_match_score'], compare_filename=args['compare_filename'], filter_unsupported_regions=args['filter_unsupported_regions'])
+def get_temp_recipes_link_strategy(args):
+    # Recipes built only to be packed into UCEs are never edited, so they can safely share files by default
+    return args['link_strategy'] if args['link_strategy'] else 'hardlink'
 
 
-    build_recipes.main(gamelist_path, args['core_path'], bios_dir=args['bios_dir'],
-                       output_dir=recipes_temp_dir)
-    output_dir = args['output_dir'] if args['output_dir'] else os.path.join(args['input_dir'], 'UCE')
-    build_from_recipes.main(recipes_temp_dir, output_dir=output_dir)
-    export_gamelist_assets.main(gamelist_path, output_dir, export_cox_assets=args['export_cox_assets'], export_bitpixel_marquees=args['export_bitpixel_marquees'])
+def run_gamelist_stages(gamelist_path, *stages):
+    # Stages which were not asked for, or whose arguments were invalid, are None and are left out
+    stages = [stage for stage in stages if stage]
+    if stages:
+        gamelist_stages.run(gamelist_path, stages)
+
+
+def get_bezel_stage(gamelist_path, args):
+    return add_bezels_to_gamelist.get_stage(gamelist_path, args['platform'], min_match_score=args['min_match_score'],
+                                            compare_filename=args['compare_filename'],
+                                            filter_unsupported_regions=args['filter_unsupported_regions'],
+                                            jobs=args['jobs'])
+
 
+def get_export_stage(gamelist_path, output_dir, args):
+    return export_gamelist_assets.get_stage(gamelist_path, output_dir=output_dir,
+                                            export_cox_assets=args['export_cox_assets'],
+                                            export_bitpixel_marquees=args['export_bitpixel_marquees'])
+
+
+def get_summary_stage(gamelist_path, output_dir, args):
     if args['do_summarise_gamelist']:
-        summarise_gamelist.main(gamelist_path, output_dir=output_dir)
-    common_utils.cleanup_temp_dir(__name__)
+        return summarise_gamelist.get_stage(gamelist_path, output_dir=output_dir)
+    return None
+
+
+@tracing.traced('operation')
+def scrape_and_build_uces(args):
+    logger.info(info_messages.start_operation("'scrape to uces'"))
+    # The gamelist is kept between runs so that only new or changed roms are scraped next time
+    gamelist_dir = create_gamelist.get_cached_output_dir(args['platform'], args['input_dir'])
+    gamelist_path = create_gamelist.main(args['platform'], args['input_dir'], scrape_module=args['scrape_module'],
+                         user_name=args['user_name'], password=args['password'], output_dir=gamelist_dir,
+                         refresh_rom_data=args['refresh_rom_data'], scrape_videos=args['scrape_videos'],
+                         scrape_shards=args['scrape_shards'], scrape_threads=args['scrape_threads'])
+    output_dir = args['output_dir'] if args['output_dir'] else os.path.join(args['input_dir'], 'UCE')
+    # Bezels are matched, UCEs built, assets exported and the summary made in a single pass over the gamelist
+    run_gamelist_stages(gamelist_path,
+                        get_bezel_stage(gamelist_path, args),
+                        build_from_gamelist.get_stage(gamelist_path, args['core_path'], bios_dir=args['bios_dir'],
+                                                      output_dir=output_dir,
+                                                      link_strategy=get_temp_recipes_link_strategy(args),
+                                                      jobs=args['jobs']),
+                        get_export_stage(gamelist_path, output_dir, args),
+                        get_summary_stage(gamelist_path, output_dir, args))
     logger.info(info_messages.end_operation("'scrape to uces'"))
 
 
+@tracing.traced('operation')
 def scrape_and_make_recipes(args):
     logger.info(info_messages.start_operation("'scrape to recipes'"))
-    temp_dir = common_utils.create_temp_dir(__name__)
+    # The gamelist is kept between runs so that only new or changed roms are scraped next time
+    gamelist_dir = create_gamelist.get_cached_output_dir(args['platform'], args['input_dir'])
     gamelist_path = create_gamelist.main(args['platform'], args['input_dir'], scrape_module=args['scrape_module'],
-                         user_name=args['user_name'], password=args['password'], output_dir=temp_dir,
-                         refresh_rom_data=args['refresh_rom_data'], scrape_videos=args['scrape_videos'])
+                         user_name=args['user_name'], password=args['password'], output_dir=gamelist_dir,
+                         refresh_rom_data=args['refresh_rom_data'], scrape_videos=args['scrape_videos'],
+                         scrape_shards=args['scrape_shards'], scrape_threads=args['scrape_threads'])
     output_dir = args['output_dir'] if args['output_dir'] else os.path.join(args['input_dir'], 'recipes')
-    # gamelist_path = os.path.join(temp_dir, 'gamelist.xml')
-
-    add_bezels_to_gamelist.main(gamelist_path, args['platform'], min_match_score=args['min_match_score'], compare_filename=args['compare_filename'], filter_unsupported_regions=args['filter_unsupported_regions'])
-
-    build_recipes.main(gamelist_path, args['core_path'], bios_dir=args['bios_dir'],
-                       output_dir=output_dir)
-    export_gamelist_assets.main(gamelist_path, output_dir, export_cox_assets=args['export_cox_assets'], export_bitpixel_marquees=args['export_bitpixel_marquees'])
-    if args['do_summarise_gamelist']:
-        summarise_gamelist.main(gamelist_path, output_dir=output_dir)
-    common_utils.cleanup_temp_dir(__name__)
+    run_gamelist_stages(gamelist_path,
+                        get_bezel_stage(gamelist_path, args),
+                        build_recipes.get_stage(gamelist_path, args['core_path'], bios_dir=args['bios_dir'],
+                                                output_dir=output_dir, link_strategy=args['link_strategy'],
+                                                jobs=args['jobs']),
+                        get_export_stage(gamelist_path, output_dir, args),
+                        get_summary_stage(gamelist_path, output_dir, args))
     logger.info(info_messages.end_operation("'scrape to recipes'"))
 
 
+@tracing.traced('operation')
 def scrape_and_make_gamelist(args):
     logger.info(info_messages.start_operation("'scrape to gamelist'"))
     gamelist_path = create_gamelist.main(args['platform'], args['input_dir'], scrape_module=args['scrape_module'],
                          user_name=args['user_name'], password=args['password'], output_dir=args['output_dir'],
-                         refresh_rom_data=args['refresh_rom_data'], scrape_videos=args['scrape_videos'])
+                         refresh_rom_data=args['refresh_rom_data'], scrape_videos=args['scrape_videos'],
+                         scrape_shards=args['scrape_shards'], scrape_threads=args['scrape_threads'])
     # TODO - get path from create_gamelist.py
     # gamelist_path = os.path.join(args['output_dir'], 'gamelist.xml') if args['output_dir'] else os.path.join(args['input_dir'], 'gamelist', 'gamelist.xml')
-    add_bezels_to_gamelist.main(gamelist_path, args['platform'], min_match_score=args['min_match_score'], compare_filename=args['compare_filename'], filter_unsupported_regions=args['filter_unsupported_regions'])
+    add_bezels_to_gamelist.main(gamelist_path, args['platform'], min_match_score=args['min_match_score'], compare_filename=args['compare_filename'], filter_unsupported_regions=args['filter_unsupported_regions'], jobs=args['jobs'])
     if args['do_summarise_gamelist']:
         summarise_gamelist.main(gamelist_path, output_dir=args['output_dir'])
 
     logger.info(info_messages.end_operation("'scrape to gamelist'"))
 
 
+@tracing.traced('operation')
 def build_uces_from_gamelist(args):
     logger.info(info_messages.start_operation("'gamelist to uces'"))
-    temp_dir = common_utils.create_temp_dir(__name__)
-    build_recipes.main(args['input_path'], args['core_path'], bios_dir=args['bios_dir'], output_dir=temp_dir)
     output_dir = args['output_dir'] if args['output_dir'] else os.path.join(os.path.dirname(args['input_path']), 'UCE')
-    build_from_recipes.main(temp_dir, output_dir=output_dir)
-    export_gamelist_assets.main(args['input_path'], output_dir, export_cox_assets=args['export_cox_assets'], export_bitpixel_marquees=args['export_bitpixel_marquees'])
-    if args['do_summarise_gamelist']:
-        summarise_gamelist.main(args['input_path'], output_dir=args['output_dir'])
-    common_utils.cleanup_temp_dir(__name__)
+    run_gamelist_stages(args['input_path'],
+                        build_from_gamelist.get_stage(args['input_path'], args['core_path'], bios_dir=args['bios_dir'],
+                                                      output_dir=output_dir,
+                                                      link_strategy=get_temp_recipes_link_strategy(args),
+                                                      jobs=args['jobs']),
+                        get_export_stage(args['input_path'], output_dir, args),
+                        get_summary_stage(args['input_path'], args['output_dir'], args))
     logger.info(info_messages.end_operation("'gamelist to uces'"))
 
 
+@tracing.traced('operation')
 def build_recipes_from_gamelist(args):
     logger.info(info_messages.start_operation("'gamelist to recipes'"))
-    build_recipes.main(args['input_path'], args['core_path'], bios_dir=args['bios_dir'], output_dir=args['output_dir'])
-    export_gamelist_assets.main(args['input_path'], output_dir=args['output_dir'], export_cox_assets=args['export_cox_assets'], export_bitpixel_marquees=args['export_bitpixel_marquees'])
-    if args['do_summarise_gamelist']:
-        summarise_gamelist.main(args['input_path'], output_dir=args['output_dir'])
+    run_gamelist_stages(args['input_path'],
+                        build_recipes.get_stage(args['input_path'], args['core_path'], bios_dir=args['bios_dir'],
+                                                output_dir=args['output_dir'], link_strategy=args['link_strategy'],
+                                                jobs=args['jobs']),
+                        get_export_stage(args['input_path'], args['output_dir'], args),
+                        get_summary_stage(args['input_path'], args['output_dir'], args))
     logger.info(info_messages.end_operation("'gamelist to recipes'"))
 
 
+@tracing.traced('operation')
 def export_assets_from_gamelist(args):
     export_gamelist_assets.main(args['input_path'], output_dir=args['output_dir'], export_cox_assets=args['export_cox_assets'], export_bitpixel_marquees=args['export_bitpixel_marquees'])
     if args['do_summarise_gamelist']:
@@ -105,30 +143,36 @@ def export_assets_from_gamelist(args):
     logger.info(info_messages.end_operation("'export gamelist assets'"))
 
 
+@tracing.traced('operation')
 def add_bezels_to_existing_gamelist(args):
-    add_bezels_to_gamelist.main(args['input_path'], args['platform'], min_match_score=args['min_match_score'], compare_filename=args['compare_filename'], filter_unsupported_regions=args['filter_unsupported_regions'])
+    add_bezels_to_gamelist.main(args['input_path'], args['platform'], min_match_score=args['min_match_score'], compare_filename=args['compare_filename'], filter_unsupported_regions=args['filter_unsupported_regions'], jobs=args['jobs'])
     if args['do_summarise_gamelist']:
         summarise_gamelist.main(args['input_path'], output_dir=None)
     logger.info(info_messages.end_operation("'add bezels to gamelist'"))
 
 
+@tracing.traced('operation')
 def create_summary_of_gamelist(args):
     summarise_gamelist.main(args['input_path'], output_dir=args['output_dir'])
     logger.info(info_messages.end_operation("'summarise gamelist'"))
 
 
+@tracing.traced('operation')
 def build_uces_from_recipes(args):
     logger.info(info_messages.start_operation("'recipes to uces'"))
-    build_from_recipes.main(args['input_dir'], output_dir=args['output_dir'])
+    build_from_recipes.main(args['input_dir'], output_dir=args['output_dir'], jobs=args['jobs'], force=args['force'],
+                            hash_contents=args['hash_contents'])
     logger.info(info_messages.end_operation("'recipes to uces'"))
 
 
+@tracing.traced('operation')
 def build_single_uce_from_recipe(args):
     logger.info(info_messages.start_operation("'recipe to uce'"))
     build_uce_tool.main(args['input_dir'], output_path=args['output_path'])
     logger.info(info_messages.end_operation("'recipe to uce'"))
 
 
+@tracing.traced('operation')
 def edit_uce_save_partition(args):
     logger.info(info_messages.start_operation("'edit save partition'"))
     edit_uce.main(args['input_path'], backup_uce=args['backup_uce'], mount_method=args['mount_method'],
@@ -136,13 +180,31 @@ def edit_uce_save_partition(args):
     logger.info(info_messages.end_operation("'edit save partition'"))
 
 
+@tracing.traced('operation')
 def extract_uce_save_partition(args):
     logger.info(info_messages.start_operation("'extract save partition'"))
-    extract_save_part.main(args['input_path'], output_path=args['output_path'])
+    extract_save_part.main(args['input_path'], output_path=args['output_path'], dump_contents=args['dump_contents'])
     logger.info(info_messages.end_operation("'extract save partition'"))
 
 
+@tracing.traced('operation')
 def replace_uce_save_partition(args):
     logger.info(info_messages.start_operation("'replace save partition'"))
     replace_save_part.main(args['input_path'], args['part_path'], backup_uce=args['backup_uce'])
     logger.info(info_messages.end_operation("'replace save partition'"))
+
+
+@tracing.traced('operation')
+def extract_uce_save_partitions(args):
+    logger.info(info_messages.start_operation("'extract save partitions'"))
+    bulk_save_parts.extract(args['input_dir'], output_dir=args['output_dir'], parts_manifest=args['parts_manifest'],
+                            jobs=args['jobs'])
+    logger.info(info_messages.end_operation("'extract save partitions'"))
+
+
+@tracing.traced('operation')
+def replace_uce_save_partitions(args):
+    logger.info(info_messages.start_operation("'replace save partitions'"))
+    bulk_save_parts.replace(args['input_dir'], parts_dir=args['parts_dir'], parts_manifest=args['parts_manifest'],
+                            backup_uce=args['backup_uce'], jobs=args['jobs'])
+    logger.info(info_messages.end_operation("'replace save partitions'"))
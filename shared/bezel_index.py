@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+
+import heapq
+import itertools
+import threading
+import multiprocessing
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict
+
+from fuzzywuzzy import fuzz, utils
+
+# Names sharing the most trigrams with a game are narrowed down to the closest MAX_CANDIDATES, relative to their
+# length, which are scored in full. Names of a similar length which score well against a game share most of its
+# trigrams, so the best of them is nearly always among these
+TRIGRAM_POOL_SIZE = 256
+MAX_CANDIDATES = 64
+
+# WRatio only uses partial matching on names between 1.5 and 8 times longer or shorter than the game name. These
+# score at most 90, are given 90 when one name contains the other and at least 86 when they share a word
+MIN_PARTIAL_LENGTH_RATIO = 1.5
+MAX_PARTIAL_LENGTH_RATIO = 8
+
+# Names of a similar length score 95 or more when their words are a subset or superset of the game's. Subsets are
+# only looked for when the game name has at most this many distinct words
+MAX_SUBSET_WORDS = 10
+
+# The index each worker process matches against. Forked workers inherit the parent's, others build their own
+worker_index = None
+
+
+def process_name(name):
+    # The same processing extractOne applies to the query and each choice before WRatio
+    return utils.full_process(utils.full_process(name), force_ascii=True)
+
+
+def get_trigrams(processed_name):
+    # Each word is padded so that short words, and the start and end of longer ones, count for more
+    trigrams = set()
+    for word in processed_name.split():
+        padded = ' {0} '.format(word)
+        trigrams.update(padded[index:index + 3] for index in range(len(padded) - 2))
+    return trigrams
+
+
+def get_length_range(length, ratio):
+    return length / ratio, length * ratio
+
+
+def get_partial_length_ranges(length):
+    # The lengths of names WRatio compares with a name of this length using partial matching, shorter then longer
+    return ((length / MAX_PARTIAL_LENGTH_RATIO, length / MIN_PARTIAL_LENGTH_RATIO),
+            (length * MIN_PARTIAL_LENGTH_RATIO, length * MAX_PARTIAL_LENGTH_RATIO))
+
+
+def get_word_subsets(words):
+    for size in range(1, len(words) + 1):
+        for subset in itertools.combinations(words, size):
+            yield frozenset(subset)
+
+
+# Finds the same best match and score as process.extractOne(query, names) without scoring every name. An exact
+# match is looked up directly. Otherwise only the names most likely to score highest are scored: those sharing the
+# most trigrams with the query, those it contains, those with a subset or superset of its words and one sharing
+# each of its words
+class BezelIndex:
+
+    def __init__(self, names):
+        self.names = []
+        self.processed_names = []
+        self.trigram_counts = []
+        self.name_words = []
+        self.exact = {}
+        self.word_sets = defaultdict(list)
+        self.trigram_index = defaultdict(list)
+        word_index = defaultdict(list)
+        # Sorted so that ties between equally good matches are always settled the same way
+        for name in sorted(names):
+            processed_name = process_name(name)
+            if not processed_name:
+                continue
+            index = len(self.names)
+            words = frozenset(processed_name.split())
+            trigrams = get_trigrams(processed_name)
+            self.exact.setdefault(processed_name, index)
+            self.word_sets[words].append(index)
+            for trigram in trigrams:
+                self.trigram_index[trigram].append(index)
+            for word in words:
+                word_index[word].append(index)
+            self.names.append(name)
+            self.processed_names.append(processed_name)
+            self.trigram_counts.append(len(trigrams))
+            self.name_words.append(words)
+        # The names with each word are kept in order of length, so those of a given length can be found by bisection
+        self.word_index = {}
+        for word, indexes in word_index.items():
+            indexes.sort(key=lambda index: len(self.processed_names[index]))
+            self.word_index[word] = ([len(self.processed_names[index]) for index in indexes], indexes)
+
+    def __len__(self):
+        return len(self.names)
+
+    def get_names_with_word(self, word, min_length, max_length):
+        lengths, indexes = self.word_index[word]
+        return indexes[bisect_left(lengths, min_length):bisect_right(lengths, max_length)]
+
+    def get_trigram_candidates(self, processed_query):
+        trigrams = get_trigrams(processed_query)
+        counts = Counter()
+        # In a fixed order, so that which of the names with equal counts make the pool doesn't vary from run to run
+        for trigram in sorted(trigrams):
+            postings = self.trigram_index.get(trigram)
+            if postings:
+                counts.update(postings)
+        pool = counts.most_common(TRIGRAM_POOL_SIZE)
+        closest = heapq.nlargest(MAX_CANDIDATES, pool,
+                                 key=lambda item: item[1] / (len(trigrams) + self.trigram_counts[item[0]]))
+        return [index for index, count in closest]
+
+    def get_contained_candidates(self, processed_query):
+        query_length = len(processed_query)
+        min_length, max_length = get_partial_length_ranges(query_length)[0]
+        for length in range(max(int(min_length), 1), int(max_length) + 1):
+            for start in range(query_length - length + 1):
+                index = self.exact.get(processed_query[start:start + length])
+                if index is not None:
+                    yield index
+
+    def get_word_set_candidates(self, processed_query, words):
+        if len(words) <= MAX_SUBSET_WORDS:
+            for subset in get_word_subsets(sorted(words)):
+                yield from self.word_sets.get(subset, ())
+        known_words = [word for word in words if word in self.word_index]
+        if len(known_words) < len(words):
+            return
+        rarest_word = min(known_words, key=lambda word: len(self.word_index[word][1]))
+        min_length, max_length = get_length_range(len(processed_query), MIN_PARTIAL_LENGTH_RATIO)
+        for index in self.get_names_with_word(rarest_word, min_length, max_length):
+            if words <= self.name_words[index]:
+                yield index
+
+    def get_word_candidates(self, processed_query, words):
+        # Any one name sharing a word is enough, as the ones which score more than the rest also contain, or are
+        # contained by, the query and so are found by the other lookups
+        for word in words:
+            if word not in self.word_index:
+                continue
+            for min_length, max_length in get_partial_length_ranges(len(processed_query)):
+                yield from self.get_names_with_word(word, min_length, max_length)[:1]
+
+    def get_candidates(self, processed_query):
+        words = frozenset(processed_query.split())
+        candidates = set(self.get_trigram_candidates(processed_query))
+        candidates.update(self.get_contained_candidates(processed_query))
+        candidates.update(self.get_word_set_candidates(processed_query, words))
+        candidates.update(self.get_word_candidates(processed_query, words))
+        return candidates
+
+    def extract_one(self, query):
+        # Returns (None, 0) rather than None when nothing matches, so the result can always be unpacked
+        processed_query = process_name(query)
+        if not processed_query:
+            return None, 0
+        if processed_query in self.exact:
+            return self.names[self.exact[processed_query]], 100
+        best_index, best_score = None, 0
+        for index in sorted(self.get_candidates(processed_query)):
+            score = fuzz.WRatio(processed_query, self.processed_names[index], full_process=False)
+            if score > best_score:
+                best_index, best_score = index, score
+        return (self.names[best_index], best_score) if best_index is not None else (None, 0)
+
+
+def init_worker(names):
+    global worker_index
+    if names is not None:
+        worker_index = BezelIndex(names)
+
+
+def extract_in_worker(query):
+    return worker_index.extract_one(query)
+
+
+def extract_all(index, queries, jobs=1):
+    # Results are in the same order as the queries, however many processes they were split between
+    if jobs < 2 or len(queries) < 2:
+        return [index.extract_one(query) for query in queries]
+    global worker_index
+    context = multiprocessing.get_context()
+    if context.get_start_method() == 'fork' and threading.active_count() > 1:
+        # Forking while other threads run (the GUI runs operations on a QThread beside its log watcher) can leave a
+        # worker stuck on a lock, such as logging's, which one of them held at the time
+        context = multiprocessing.get_context('spawn')
+    if context.get_start_method() == 'fork':
+        # Forked workers share the parent's copy of the index rather than each building their own
+        worker_index, names = index, None
+    else:
+        worker_index, names = None, index.names
+    try:
+        with context.Pool(min(jobs, len(queries)), initializer=init_worker, initargs=(names,)) as pool:
+            return pool.map(extract_in_worker, queries)
+    finally:
+        worker_index = None
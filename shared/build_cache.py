@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import os
+import hashlib
+import json
+import logging
+
+from shared import common_utils, info_messages
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE_NAME = '.uce_build_manifest.json'
+
+# Bump this whenever a change to the build process means existing UCEs should be rebuilt
+MANIFEST_VERSION = 1
+
+
+def get_manifest_path(output_dir):
+    return os.path.join(output_dir, MANIFEST_FILE_NAME)
+
+
+def get_blank_manifest():
+    return {'version': MANIFEST_VERSION, 'recipes': {}}
+
+
+def read_manifest(output_dir):
+    manifest = common_utils.read_json(get_manifest_path(output_dir))
+    if not manifest or manifest.get('version') != MANIFEST_VERSION:
+        return get_blank_manifest()
+    return manifest
+
+
+def write_manifest(output_dir, manifest):
+    return common_utils.write_json(get_manifest_path(output_dir), manifest)
+
+
+def get_recipe_file_entry(file_path, rel_path, hash_contents):
+    # A link is fingerprinted by where it points and by the file it points to, so a shared core or rom changed in
+    # place is noticed
+    entry = [rel_path, 'link', os.readlink(file_path)] if os.path.islink(file_path) else [rel_path]
+    file_stat = os.stat(file_path, follow_symlinks=True)
+    entry += [file_stat.st_size, file_stat.st_mtime_ns]
+    if hash_contents:
+        md5_hash = common_utils.get_file_md5(file_path)
+        entry.append(md5_hash.hexdigest() if md5_hash else None)
+    return entry
+
+
+def get_recipe_fingerprint(recipe_dir, hash_contents=False):
+    entries = []
+    for root, dirs, files in os.walk(recipe_dir):
+        dirs.sort()
+        for file_name in sorted(files):
+            file_path = os.path.join(root, file_name)
+            rel_path = os.path.relpath(file_path, recipe_dir).replace(os.sep, '/')
+            try:
+                entries.append(get_recipe_file_entry(file_path, rel_path, hash_contents))
+            except OSError:
+                entries.append([rel_path, 'unreadable'])
+    return hashlib.sha1(json.dumps([hash_contents, entries]).encode()).hexdigest()
+
+
+def get_output_record(output_path, md5_hex_digest=None):
+    output_stat = os.stat(output_path)
+    return {
+        'size': output_stat.st_size,
+        'mtime_ns': output_stat.st_mtime_ns,
+        'md5': md5_hex_digest
+    }
+
+
+def is_output_unchanged(record, output_path, hash_contents):
+    if not os.path.isfile(output_path):
+        return False
+    current = get_output_record(output_path)
+    if current['size'] != record.get('size'):
+        return False
+    if hash_contents:
+        md5_hash = common_utils.get_file_md5(output_path)
+        return bool(md5_hash) and md5_hash.hexdigest() == record.get('md5')
+    return current['mtime_ns'] == record.get('mtime_ns')
+
+
+def is_up_to_date(manifest, output_path, fingerprint, hash_contents=False):
+    record = manifest['recipes'].get(os.path.basename(output_path))
+    if not record or record.get('fingerprint') != fingerprint:
+        return False
+    if not is_output_unchanged(record, output_path, hash_contents):
+        return False
+    logger.info(info_messages.uce_up_to_date(output_path))
+    return True
+
+
+def record_build(manifest, output_path, fingerprint, hash_contents=False):
+    # The md5 is only ever compared by runs which hash contents, and their fingerprints only match records made by
+    # runs which did too, so other runs don't spend time reading the whole UCE back
+    md5_hex_digest = None
+    if hash_contents:
+        md5_hash = common_utils.get_file_md5(output_path)
+        if not md5_hash:
+            return
+        md5_hex_digest = md5_hash.hexdigest()
+    record = get_output_record(output_path, md5_hex_digest)
+    record['fingerprint'] = fingerprint
+    manifest['recipes'][os.path.basename(output_path)] = record
+
+
+def forget_build(manifest, output_path):
+    manifest['recipes'].pop(os.path.basename(output_path), None)
@@ -9,15 +9,26 @@ import stat
 import argparse
 import re
 import csv
+import json
+import hashlib
+import threading
+import contextlib
 from xml.etree import ElementTree as ET
 from xml.etree.ElementTree import ParseError
+from xml.sax.saxutils import escape, quoteattr
 import subprocess
 # from subprocess import Popen, PIPE
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 from PIL import Image, UnidentifiedImageError
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-from shared import error_messages, info_messages
+from shared import error_messages, info_messages, tracing
 
 # TODO - what can go wrong/should catch with os.getcwd() ?
 
@@ -27,8 +38,33 @@ ANSI_ESCAPE = re.compile(r'(\x9B|\x1B\[)[0-?]*[ -\/]*[@-~]')
 
 SPECIAL_CHARS = '\'"<>:/\|?*,'
 
+GAMELIST_INDENT = ' '
+
 BRACKETED_TEXT_REGEX = '[\(\[].*?[\)\]]'
 
+CHUNK_SIZE = 1048576
+
+FICLONE = 0x40049409
+
+# Server errors and rate limiting which are worth retrying a download for
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Maps each gamelist tag to the GameRecord field it fills
+GAME_ENTRY_FIELDS = {
+    'name': 'name',
+    'path': 'rom_path',
+    'thumbnail': 'boxart_path',
+    'marquee': 'marquee_path',
+    'image': 'logo_path',
+    'video': 'video_path',
+    'desc': 'description',
+    'genre': 'genre',
+    'publisher': 'publisher',
+    'players': 'players',
+    'bezel_match': 'bezel_match',
+    'bezel_path': 'bezel_path'
+}
+
 active_temp_dirs = {}
 
 
@@ -40,14 +76,17 @@ def create_temp_dir(calling_module):
         logger.error(error_messages.failed_to_create_temp_dir(e))
         return False
     logger.info(info_messages.created_temp_dir(calling_module))
-    active_temp_dirs[calling_module] = temp_dir
+    active_temp_dirs.setdefault(calling_module, []).append(temp_dir)
     return temp_dir
 
 
 # TODO - Issue a warning if this doesn't happen
-def cleanup_temp_dir(calling_module):
-    if calling_module in active_temp_dirs:
-        remove_dir(active_temp_dirs[calling_module])
+def cleanup_temp_dir(calling_module, temp_dir=None):
+    module_temp_dirs = active_temp_dirs.get(calling_module, [])
+    for dir_ in [temp_dir] if temp_dir else list(module_temp_dirs):
+        if dir_ in module_temp_dirs:
+            module_temp_dirs.remove(dir_)
+            remove_dir(dir_)
 
 
 def escape_ansi(line):
@@ -64,15 +103,20 @@ def remove_bracketed_text(text):
     return ' '.join(re.sub(BRACKETED_TEXT_REGEX, '', text).split())
 
 
-def execute_with_output(cmd, shell=False):
+def get_startupinfo():
     if get_platform() == 'win32':
         startupinfo = subprocess.STARTUPINFO()
         startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-    else:
-        startupinfo = None
+        return startupinfo
+    return None
+
+
+def execute_with_output(cmd, shell=False):
+    startupinfo = get_startupinfo()
     try:
-        with subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=1,
-                              universal_newlines=True, shell=shell, startupinfo=startupinfo) as p:
+        with tracing.span(tracing.get_cmd_name(cmd), 'subprocess', cmd=cmd), \
+                subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=1,
+                                 universal_newlines=True, shell=shell, startupinfo=startupinfo) as p:
             for line in p.stdout:
                 log_text = escape_ansi(line.strip())
                 if log_text:
@@ -88,6 +132,25 @@ def execute_with_output(cmd, shell=False):
     return True
 
 
+def execute_with_input(cmd, input_text):
+    try:
+        with tracing.span(tracing.get_cmd_name(cmd), 'subprocess', cmd=cmd):
+            proc = subprocess.run(cmd, input=input_text, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                  universal_newlines=True, startupinfo=get_startupinfo())
+    except OSError as e:
+        logger.error(error_messages.command_failed_with_exception(cmd, e))
+        return False
+    for line in proc.stderr.split('\n'):
+        log_text = escape_ansi(line.strip())
+        if log_text:
+            logger.info(log_text)
+    if proc.returncode:
+        logger.error(error_messages.command_exited_non_zero(proc.returncode, cmd))
+        return False
+    logger.info(info_messages.ran_command(cmd))
+    return proc.stdout
+
+
 def write_file(file_path, file_content, write_type):
     try:
         with open(file_path, write_type) as target_file:
@@ -99,6 +162,36 @@ def write_file(file_path, file_content, write_type):
     return True
 
 
+def write_file_atomic(file_path, file_content, write_type):
+    temp_path = '{0}.{1}.tmp'.format(file_path, os.getpid())
+    try:
+        with open(temp_path, write_type) as target_file:
+            target_file.write(file_content)
+        os.replace(temp_path, file_path)
+    except OSError as e:
+        logger.error(error_messages.access_failure('write', file_path, e))
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+        return False
+    logger.info(info_messages.access_success('wrote', file_path))
+    return True
+
+
+def read_json(file_path):
+    if not os.path.isfile(file_path):
+        return None
+    content = get_file_content(file_path, 'r')
+    try:
+        return json.loads(content) if content else None
+    except ValueError as e:
+        logger.warning(error_messages.invalid_json(file_path, e))
+        return None
+
+
+def write_json(file_path, data):
+    return write_file_atomic(file_path, json.dumps(data, indent=1, sort_keys=True), 'w')
+
+
 def write_csv(file_path, rows):
     try:
         with open(file_path, 'w', newline='') as csv_file:
@@ -122,6 +215,26 @@ def get_file_content(file_path, read_type):
     return content
 
 
+def copy_file_obj(source_file, dest_file, md5_hash=None):
+    for chunk in iter(lambda: source_file.read(CHUNK_SIZE), b''):
+        if md5_hash:
+            md5_hash.update(chunk)
+        dest_file.write(chunk)
+
+
+def get_file_md5(file_path):
+    md5_hash = hashlib.md5()
+    try:
+        with open(file_path, 'rb') as read_file:
+            for chunk in iter(lambda: read_file.read(CHUNK_SIZE), b''):
+                md5_hash.update(chunk)
+    except OSError as e:
+        logger.error(error_messages.access_failure('read', file_path, e))
+        return False
+    logger.info(info_messages.access_success('read', file_path))
+    return md5_hash
+
+
 def make_dir(dir_path):
     try:
         os.mkdir(dir_path)
@@ -146,7 +259,8 @@ def remove_dir(dir_path):
 
 def copyfile(source, dest):
     try:
-        shutil.copy(source, dest)
+        with tracing.span('copyfile', 'copy', source=source):
+            shutil.copy(source, dest)
     except OSError as e:
         logger.error(error_messages.copy_failure('file', source, dest, e))
         return False
@@ -154,6 +268,57 @@ def copyfile(source, dest):
     return True
 
 
+def move_file(source, dest):
+    try:
+        os.replace(source, dest)
+    except OSError:
+        # Most likely a move between filesystems
+        if not copyfile(source, dest):
+            return False
+        delete_file(source)
+    return True
+
+
+def reflink_file(source, dest):
+    if not fcntl:
+        return False
+    try:
+        with open(source, 'rb') as source_file, open(dest, 'wb') as dest_file:
+            fcntl.ioctl(dest_file.fileno(), FICLONE, source_file.fileno())
+    except OSError:
+        if os.path.isfile(dest):
+            os.remove(dest)
+        return False
+    logger.info(info_messages.reflink_success(source, dest))
+    return True
+
+
+def clone_file(source, dest):
+    if reflink_file(source, dest):
+        return True
+    return copyfile(source, dest)
+
+
+def hardlink_file(source, dest):
+    try:
+        os.link(source, dest)
+    except OSError:
+        return False
+    logger.info(info_messages.hardlink_success(source, dest))
+    return True
+
+
+def link_file(source, dest, link_strategy=None):
+    # An existing dest may itself be a link to source, so it is removed rather than written through
+    if os.path.lexists(dest):
+        delete_file(dest)
+    if link_strategy == 'hardlink' and hardlink_file(source, dest):
+        return True
+    if link_strategy in ('hardlink', 'reflink') and reflink_file(source, dest):
+        return True
+    return copyfile(source, dest)
+
+
 def copytree(source, dest, symlinks=False):
     try:
         shutil.copytree(source, dest, symlinks=symlinks)
@@ -184,9 +349,10 @@ def delete_file(file_path):
     return True
 
 
-def download_data(url):
+def download_data(url, headers=None):
     try:
-        data = requests.get(url)
+        with tracing.span('download', 'download', url=url):
+            data = requests.get(url, headers=headers)
         if 400 <= data.status_code < 600:
             logger.error('Server returned status code {0} for {1}'.format(url, data.status_code))
             data = None
@@ -202,6 +368,77 @@ def download_file(url, save_path, write_type='wb'):
     write_file(save_path, data.content, write_type)
 
 
+def get_download_session(pool_size, retries=3):
+    # One session shares its connections between downloads, rather than each opening its own TLS connection
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=RETRY_STATUS_CODES)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_lock_path(file_path):
+    return '{0}.lock'.format(file_path)
+
+
+def remove_lock_file(file_path):
+    # Only safe while holding the lock once file_path is in place. Anyone still waiting on the old lock file then
+    # finds file_path there, and anyone coming later locks a new one
+    try:
+        os.remove(get_lock_path(file_path))
+    except OSError:
+        pass
+
+
+@contextlib.contextmanager
+def file_lock(file_path):
+    # An advisory lock held on a '.lock' file beside file_path. Where fcntl isn't available this does nothing and
+    # callers rely on atomic renames alone
+    if not fcntl:
+        yield
+        return
+    with open(get_lock_path(file_path), 'a') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def get_temp_path(file_path):
+    return '{0}.{1}.{2}.tmp'.format(file_path, os.getpid(), threading.get_ident())
+
+
+def fetch_to_file(session, url, save_path):
+    temp_path = get_temp_path(save_path)
+    try:
+        with tracing.span('download', 'download', url=url), session.get(url, stream=True, timeout=60) as data:
+            data.raise_for_status()
+            with open(temp_path, 'wb') as save_file:
+                for chunk in data.iter_content(CHUNK_SIZE):
+                    save_file.write(chunk)
+        os.replace(temp_path, save_path)
+    except (requests.RequestException, OSError) as e:
+        logger.error('Failed to fetch {0}: {1}'.format(url, e))
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+        return False
+    logger.info('Downloaded remote file {0}'.format(url))
+    return True
+
+
+def download_file_atomic(session, url, save_path):
+    # The file only appears under its real name once complete, and the lock stops parallel runs sharing a download
+    # dir from fetching the same file at once. The lock file is removed once the file is there, rather than being
+    # left beside every download
+    with file_lock(save_path):
+        if not os.path.isfile(save_path) and not fetch_to_file(session, url, save_path):
+            return False
+        remove_lock_file(save_path)
+    return True
+
+
 def get_platform():
     if sys.platform.startswith('linux'):
         return 'linux'
@@ -272,6 +509,29 @@ def validate_parent_dir(dir_path, option_name=''):
     return True
 
 
+def validate_count(value, option_name=''):
+    if value and get_jobs(value) < 1:
+        logger.error(error_messages.invalid_count(option_name, value))
+        return False
+    return True
+
+
+def validate_jobs(jobs):
+    if jobs and get_jobs(jobs) < 1:
+        logger.error(error_messages.invalid_jobs(jobs))
+        return False
+    return True
+
+
+def get_jobs(jobs):
+    if not jobs:
+        return 1
+    try:
+        return int(str(jobs).strip())
+    except ValueError:
+        return 0
+
+
 def get_arg_params(opt_short_name):
     if opt_short_name.islower():
         action = 'store'
@@ -306,6 +566,63 @@ def read_gamelist_tree(input_path):
     return tree
 
 
+def iter_gamelist(input_path):
+    # Streams the gamelist a game at a time, clearing each entry once it has been parsed, so memory use stays flat
+    # however many games the gamelist holds
+    depth = 0
+    root = None
+    try:
+        for event, element in ET.iterparse(input_path, events=('start', 'end')):
+            if event == 'start':
+                depth += 1
+                if depth == 1:
+                    root = element
+                continue
+            depth -= 1
+            if depth == 1:
+                yield parse_game_entry(element)
+                root.clear()
+    except ParseError:
+        logger.error(error_messages.invalid_path('Specified gamelist', input_path, 'XML file'))
+
+
+def write_gamelist_element(gamelist_file, element, depth):
+    # Laid out as minidom's toprettyxml used to, with elements holding only text kept on one line
+    indent = GAMELIST_INDENT * depth
+    attributes = ''.join(' {0}={1}'.format(name, quoteattr(value)) for name, value in element.items())
+    if len(element):
+        gamelist_file.write('{0}<{1}{2}>\n'.format(indent, element.tag, attributes))
+        if element.text and element.text.strip():
+            gamelist_file.write('{0}{1}\n'.format(indent + GAMELIST_INDENT, escape(element.text.strip())))
+        for child in element:
+            write_gamelist_element(gamelist_file, child, depth + 1)
+        gamelist_file.write('{0}</{1}>\n'.format(indent, element.tag))
+    elif element.text:
+        gamelist_file.write('{0}<{1}{2}>{3}</{1}>\n'.format(indent, element.tag, attributes, escape(element.text)))
+    else:
+        gamelist_file.write('{0}<{1}{2}/>\n'.format(indent, element.tag, attributes))
+
+
+def write_gamelist(file_path, game_entries):
+    # Each entry is written straight to a temp file as it comes, so no copy of the whole gamelist is built in memory,
+    # and only swapped in for the old gamelist once complete
+    temp_path = get_temp_path(file_path)
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as gamelist_file:
+            gamelist_file.write('<?xml version="1.0"?>\n<gameList>\n')
+            for game_entry in game_entries:
+                write_gamelist_element(gamelist_file, game_entry, 1)
+            gamelist_file.write('</gameList>\n')
+        os.replace(temp_path, file_path)
+    except OSError as e:
+        logger.error(error_messages.access_failure('write', file_path, e))
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+        return False
+    logger.info(info_messages.access_success('wrote', file_path))
+    return True
+
+
 def get_game_entry_val(game_entry, tag_name):
     tag = game_entry.find(tag_name)
     if tag is not None and tag.text is not None:
@@ -313,21 +630,28 @@ def get_game_entry_val(game_entry, tag_name):
     return ''
 
 
+# One of these is made for every game in a gamelist, so slots keep them small. Missing values are empty strings
+class GameRecord:
+
+    __slots__ = tuple(GAME_ENTRY_FIELDS.values())
+
+    def __init__(self):
+        for field in self.__slots__:
+            setattr(self, field, '')
+
+
 def parse_game_entry(game_entry):
-    return {
-        'name': get_game_entry_val(game_entry, 'name'),
-        'rom_path': get_game_entry_val(game_entry, 'path'),
-        'boxart_path': get_game_entry_val(game_entry, 'thumbnail'),
-        'marquee_path': get_game_entry_val(game_entry, 'marquee'),
-        'logo_path': get_game_entry_val(game_entry, 'image'),
-        'video_path': get_game_entry_val(game_entry, 'video'),
-        'description': get_game_entry_val(game_entry, 'desc'),
-        'genre': get_game_entry_val(game_entry, 'genre'),
-        'publisher': get_game_entry_val(game_entry, 'publisher'),
-        'players': get_game_entry_val(game_entry, 'players'),
-        'bezel_match': get_game_entry_val(game_entry, 'bezel_match'),
-        'bezel_path': get_game_entry_val(game_entry, 'bezel_path')
-    }
+    # A single walk over the entry's children rather than a find() per field. As with find(), the first of any
+    # repeated tag wins
+    game = GameRecord()
+    found = set()
+    for tag in game_entry:
+        field = GAME_ENTRY_FIELDS.get(tag.tag)
+        if field and field not in found:
+            found.add(field)
+            if tag.text is not None:
+                setattr(game, field, tag.text)
+    return game
 
 
 def score_to_int(value):
@@ -103,6 +103,9 @@ PLATFORMS = {'3do': {'bezel_repo': 'bezelproject-3DO', 'default_bezel': 'retroar
 SCRAPING_MODULES = ['screenscraper', 'arcadedb', 'igdb', 'mobygames', 'openretro', 'thegamesdb',
                     'worldofspectrum']
 
+# How files shared between recipes (cores, bios files, default art) are put into each recipe
+LINK_STRATEGIES = ('copy', 'hardlink', 'reflink')
+
 BEZEL_SCRAPE_UNSUPPORTED_REGIONS = (
     'Japan',
     '(J)'
@@ -113,3 +116,15 @@ BASE_BEZEL_TREE_URL = 'https://api.github.com/repos/thebezelproject/{0}/git/tree
 BASE_BEZEL_RAW_URL = 'https://raw.githubusercontent.com/thebezelproject/{0}/master/{1}'
 
 BEZEL_ROOT_DIR = os.path.join(str(Path.home()), '.bezels')
+
+# The most bezels downloaded at the same time
+BEZEL_DOWNLOAD_THREADS = 8
+
+# How long, in seconds, a bezel repo's cached file listing is used before checking GitHub for changes
+BEZEL_TREE_TTL = 24 * 60 * 60
+
+CACHE_ROOT_DIR = os.path.join(str(Path.home()), '.ucetool')
+
+SCRAPED_GAMELIST_ROOT_DIR = os.path.join(CACHE_ROOT_DIR, 'gamelists')
+
+SAVE_TEMPLATE_DIR = os.path.join(CACHE_ROOT_DIR, 'save_templates')
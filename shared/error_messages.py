@@ -11,6 +11,8 @@ def required_option_not_set(option_name):
 SCRAPE_INVALID_PLATFORM = 'You must provide a valid platform (emulated system) to enable scraping'
 SCRAPE_INVALID_MODULE = 'You must provide a valid scraping module (metadata source) when scraping'
 
+SCRAPE_SHARD_FAILED = 'Scraping failed for at least one shard, the gamelist will be missing some games'
+
 
 # UCE Building
 
@@ -25,6 +27,51 @@ def zip_extract_failed(exception_message):
     return 'Unable to extract and copy save.img file from zip: {0}'.format(exception_message)
 
 
+def save_part_read_failed(file_path, exception_message):
+    return 'Failed to read save partition from {0}: {1}'.format(file_path, exception_message)
+
+
+def save_part_write_failed(dir_path, img_path, exception_message):
+    return 'Failed to create save partition {0} from {1}: {2}'.format(img_path, dir_path, exception_message)
+
+
+def save_part_replace_failed(uce_path, exception_message):
+    return 'Failed to replace save partition in {0}: {1}'.format(uce_path, exception_message)
+
+
+def save_part_restore_failed(uce_path, journal_path, exception_message):
+    return 'Failed to restore save partition in {0} from {1}, keep this file and try again: {2}'.format(
+        uce_path, journal_path, exception_message)
+
+
+def save_part_exception(uce_path, exception_message):
+    return 'Processing the save partition of {0} raised an error: {1}'.format(uce_path, exception_message)
+
+
+def save_part_operation_failed(operation_name, uce_path):
+    return 'Failed to {0} the save partition of {1}'.format(operation_name, uce_path)
+
+
+def no_save_part_for_uce(uce_path, part_path):
+    return 'No save partition found for {0} at {1}, it will be skipped'.format(uce_path, part_path)
+
+
+def uce_not_in_parts_manifest(uce_path):
+    return 'No save partition is listed for {0} in the parts manifest, it will be skipped'.format(uce_path)
+
+
+def invalid_parts_manifest(manifest_path):
+    return 'Parts manifest {0} must be a JSON object mapping UCE file names to save partition paths'.format(
+        manifest_path)
+
+
+NO_SAVE_PARTS_SOURCE = 'Either a parts dir or a parts manifest must be provided'
+
+
+def invalid_save_part_size(img_path, size, expected_size):
+    return 'Save partition {0} is {1} bytes but must be exactly {2} bytes'.format(img_path, size, expected_size)
+
+
 # OS Errors
 
 INVALID_OS = 'This tool requires either Linux or Windows'
@@ -51,6 +98,16 @@ def dir_is_empty(dir_, subdir):
     return 'Directory {0} in {1} is empty'.format(subdir, dir_)
 
 
+# Build from recipes
+
+def recipe_build_failed(dir_):
+    return 'Failed to build UCE from recipe {0}'.format(dir_)
+
+
+def recipe_build_exception(dir_, exception_message):
+    return 'Building UCE from recipe {0} raised an error: {1}'.format(dir_, exception_message)
+
+
 # Common Utils
 
 def failed_to_create_temp_dir(exception_message):
@@ -69,6 +126,10 @@ def access_failure(access_type, path, exception_message):
     return 'Failed to {0} data to/from {1}: {2}'.format(access_type, path, exception_message)
 
 
+def invalid_json(path, exception_message):
+    return 'File {0} is not valid JSON and will be ignored: {1}'.format(path, exception_message)
+
+
 def make_dir_failure(path, exception_message):
     return 'Failed to create directory {0}: {1}'.format(path, exception_message)
 
@@ -85,6 +146,34 @@ def symlink_failure_other(symlink, target, exception_message):
     return 'Failed to create symlink {0} to target {1}: {2}'.format(symlink, target, exception_message)
 
 
+def recipe_name_collision(dir_name, unique_name):
+    return 'More than one game would make a recipe called {0}, using {1} instead'.format(dir_name, unique_name)
+
+
+def recipe_setup_exception(rom_path, exception_message):
+    return 'Making a recipe for {0} raised an error: {1}'.format(rom_path, exception_message)
+
+
+def invalid_link_strategy(value, link_strategies):
+    return 'Link strategy {0} must be one of: {1}'.format(value, ', '.join(link_strategies))
+
+
+def invalid_bezel_tree(repo, exception_message):
+    return 'Could not read the list of bezels in {0}: {1}'.format(repo, exception_message)
+
+
+def no_bezel_tree(repo):
+    return 'No list of bezels is available for {0}, every game will be given the default bezel'.format(repo)
+
+
+def invalid_count(option_name, value):
+    return '{0} value {1} must be a whole number of at least 1'.format(option_name, value)
+
+
+def invalid_jobs(value):
+    return 'Jobs value {0} must be a whole number of at least 1'.format(value)
+
+
 def score_not_number(value, exception_message):
     return 'Match score {0} cannot be converted to int: {1}'.format(value, exception_message)
 
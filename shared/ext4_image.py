@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+
+# A minimal, single block group ext4 image writer for UCE save partitions. The images mirror what
+# 'mke2fs -t ext4' produces for a small filesystem (1 KiB blocks, 256 byte inodes, extents and a journal) minus the
+# optional metadata (checksums, resize inode, htree indexes) which the save partition has no use for.
+#
+# Also a read-only reader which works over any buffer (e.g. an mmap of a UCE) and copes with whatever mke2fs or the
+# kernel may have produced: extents or block maps, 32 or 64 bit group descriptors and hashed directories.
+
+import os
+import stat
+import time
+import uuid
+import struct
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Bump this whenever a change here alters the images produced, so cached images are regenerated
+WRITER_VERSION = 1
+
+BLOCK_SIZE = 1024
+BLOCKS_PER_GROUP = BLOCK_SIZE * 8
+INODE_SIZE = 256
+INODE_EXTRA_ISIZE = 32
+INODE_RATIO = 4096
+RESERVED_BLOCKS_PERCENT = 5
+JOURNAL_BLOCKS = 1024
+LOST_FOUND_BLOCKS = 12
+
+FIRST_DATA_BLOCK = 1
+SUPERBLOCK_BLOCK = 1
+GROUP_DESC_BLOCK = 2
+BLOCK_BITMAP_BLOCK = 3
+INODE_BITMAP_BLOCK = 4
+INODE_TABLE_BLOCK = 5
+
+ROOT_INO = 2
+JOURNAL_INO = 8
+FIRST_INO = 11
+
+EXT4_SUPER_MAGIC = 0xEF53
+EXT4_EXTENT_MAGIC = 0xF30A
+JBD2_MAGIC = 0xC03B3998
+JBD2_SUPERBLOCK_V2 = 4
+
+FEATURE_COMPAT_HAS_JOURNAL = 0x4
+FEATURE_COMPAT_EXT_ATTR = 0x8
+FEATURE_INCOMPAT_FILETYPE = 0x2
+FEATURE_INCOMPAT_EXTENTS = 0x40
+FEATURE_RO_COMPAT_SPARSE_SUPER = 0x1
+FEATURE_RO_COMPAT_LARGE_FILE = 0x2
+FEATURE_RO_COMPAT_DIR_NLINK = 0x20
+FEATURE_RO_COMPAT_EXTRA_ISIZE = 0x40
+
+DEFAULT_MOUNT_OPTS = 0x4 | 0x8  # user_xattr, acl
+FLAGS_SIGNED_HASH = 0x1
+HASH_HALF_MD4 = 1
+JNL_BACKUP_BLOCKS = 1
+EXTENTS_FL = 0x80000
+
+FILE_TYPES = {
+    stat.S_IFREG: 1,
+    stat.S_IFDIR: 2,
+    stat.S_IFLNK: 7
+}
+
+FAST_SYMLINK_MAX_LENGTH = 59
+
+
+class Ext4ImageWriter:
+
+    def __init__(self, size, mode=0o777, uid=12, gid=12):
+        self.blocks_count = size // BLOCK_SIZE
+        if self.blocks_count - FIRST_DATA_BLOCK > BLOCKS_PER_GROUP:
+            raise ValueError('Image size {0} is too large for a single block group'.format(size))
+        self.size = size
+        self.mode = mode
+        self.uid = uid
+        self.gid = gid
+        self.inodes_count = max(size // INODE_RATIO // 8 * 8, 16)
+        self.inode_table_blocks = self.inodes_count * INODE_SIZE // BLOCK_SIZE
+        self.next_block = INODE_TABLE_BLOCK + self.inode_table_blocks
+        self.next_ino = FIRST_INO
+        self.used_dirs = 0
+        self.now = int(time.time())
+        self.uuid = uuid.uuid4().bytes
+        self.image = bytearray(self.blocks_count * BLOCK_SIZE)
+
+    def allocate_blocks(self, num_blocks):
+        start = self.next_block
+        if start + num_blocks > self.blocks_count:
+            raise ValueError('Contents do not fit in an image of {0} bytes'.format(self.size))
+        self.next_block += num_blocks
+        return start
+
+    def allocate_ino(self):
+        if self.next_ino > self.inodes_count:
+            raise ValueError('Contents need more than the {0} inodes available'.format(self.inodes_count))
+        ino = self.next_ino
+        self.next_ino += 1
+        return ino
+
+    def write_block_data(self, start_block, data):
+        offset = start_block * BLOCK_SIZE
+        self.image[offset:offset + len(data)] = data
+
+    def write_data(self, data):
+        num_blocks = -(-len(data) // BLOCK_SIZE)
+        start_block = self.allocate_blocks(num_blocks) if num_blocks else 0
+        self.write_block_data(start_block, data)
+        return start_block, num_blocks
+
+    @staticmethod
+    def pack_extents(start_block, num_blocks):
+        extents = [(0, num_blocks, start_block)] if num_blocks else []
+        i_block = struct.pack('<HHHHI', EXT4_EXTENT_MAGIC, len(extents), 4, 0, 0)
+        for logical_block, length, physical_block in extents:
+            i_block += struct.pack('<IHHI', logical_block, length, physical_block >> 32, physical_block & 0xFFFFFFFF)
+        return i_block.ljust(60, b'\0')
+
+    def write_inode(self, ino, mode, size, links_count, i_block, num_blocks, flags=EXTENTS_FL, uid=None, gid=None,
+                    mtime=None):
+        uid = self.uid if uid is None else uid
+        gid = self.gid if gid is None else gid
+        mtime = self.now if mtime is None else mtime
+        inode = bytearray(INODE_SIZE)
+        struct.pack_into('<HHIIIIIHHII', inode, 0, mode, uid & 0xFFFF, size & 0xFFFFFFFF, self.now, self.now, mtime, 0,
+                         gid & 0xFFFF, links_count, num_blocks * (BLOCK_SIZE // 512), flags)
+        inode[40:100] = i_block
+        struct.pack_into('<I', inode, 108, size >> 32)
+        struct.pack_into('<HH', inode, 120, uid >> 16, gid >> 16)
+        struct.pack_into('<HHIIIII', inode, 128, INODE_EXTRA_ISIZE, 0, 0, 0, 0, self.now, 0)
+        offset = INODE_TABLE_BLOCK * BLOCK_SIZE + (ino - 1) * INODE_SIZE
+        self.image[offset:offset + INODE_SIZE] = inode
+
+    def write_extent_inode(self, ino, mode, data, links_count=1, **kwargs):
+        start_block, num_blocks = self.write_data(data)
+        self.write_inode(ino, mode, len(data), links_count, self.pack_extents(start_block, num_blocks), num_blocks,
+                         **kwargs)
+
+    @staticmethod
+    def pack_dir_entries(entries, min_blocks=1):
+        blocks = []
+        block = bytearray()
+        last_entry_offset = 0
+        for ino, name, file_type in entries:
+            rec_len = (8 + len(name) + 3) // 4 * 4
+            if len(block) + rec_len > BLOCK_SIZE:
+                struct.pack_into('<H', block, last_entry_offset + 4, BLOCK_SIZE - last_entry_offset)
+                blocks.append(bytes(block.ljust(BLOCK_SIZE, b'\0')))
+                block = bytearray()
+            last_entry_offset = len(block)
+            block += struct.pack('<IHBB', ino, rec_len, len(name), file_type) + name.ljust(rec_len - 8, b'\0')
+        struct.pack_into('<H', block, last_entry_offset + 4, BLOCK_SIZE - last_entry_offset)
+        blocks.append(bytes(block.ljust(BLOCK_SIZE, b'\0')))
+        while len(blocks) < min_blocks:
+            blocks.append(struct.pack('<IH', 0, BLOCK_SIZE).ljust(BLOCK_SIZE, b'\0'))
+        return b''.join(blocks)
+
+    def write_dir(self, ino, parent_ino, entries, mode, min_blocks=1, **kwargs):
+        entries = [(ino, b'.', FILE_TYPES[stat.S_IFDIR]), (parent_ino, b'..', FILE_TYPES[stat.S_IFDIR])] + entries
+        links_count = 2 + len([entry for entry in entries[2:] if entry[2] == FILE_TYPES[stat.S_IFDIR]])
+        self.write_extent_inode(ino, mode, self.pack_dir_entries(entries, min_blocks), links_count=links_count,
+                                **kwargs)
+        self.used_dirs += 1
+
+    def write_symlink(self, ino, target):
+        mode = stat.S_IFLNK | 0o777
+        if len(target) <= FAST_SYMLINK_MAX_LENGTH:
+            self.write_inode(ino, mode, len(target), 1, target.ljust(60, b'\0'), 0, flags=0)
+        else:
+            self.write_extent_inode(ino, mode, target)
+
+    def add_dir_contents(self, dir_path, ino, parent_ino):
+        entries = []
+        for item_name in sorted(os.listdir(dir_path)):
+            if ino == ROOT_INO and item_name == 'lost+found':
+                continue
+            item_path = os.path.join(dir_path, item_name)
+            item_stat = os.lstat(item_path)
+            file_type = FILE_TYPES.get(stat.S_IFMT(item_stat.st_mode))
+            if not file_type:
+                logger.warning('Skipping {0}, only files, directories and symlinks can be added'.format(item_path))
+                continue
+            item_ino = self.allocate_ino()
+            if stat.S_ISDIR(item_stat.st_mode):
+                self.add_dir_contents(item_path, item_ino, ino)
+            elif stat.S_ISLNK(item_stat.st_mode):
+                self.write_symlink(item_ino, os.fsencode(os.readlink(item_path)))
+            else:
+                with open(item_path, 'rb') as item_file:
+                    self.write_extent_inode(item_ino, stat.S_IFREG | self.mode, item_file.read(),
+                                            mtime=int(item_stat.st_mtime))
+            entries.append((item_ino, os.fsencode(item_name), file_type))
+        if ino == ROOT_INO:
+            entries.insert(0, (FIRST_INO, b'lost+found', FILE_TYPES[stat.S_IFDIR]))
+            self.write_dir(ino, ino, entries, stat.S_IFDIR | 0o755, uid=0, gid=0)
+        else:
+            self.write_dir(ino, parent_ino, entries, stat.S_IFDIR | self.mode)
+
+    def write_journal(self):
+        journal_sb = bytearray(BLOCK_SIZE)
+        struct.pack_into('>IIIIIIII', journal_sb, 0, JBD2_MAGIC, JBD2_SUPERBLOCK_V2, 0, BLOCK_SIZE, JOURNAL_BLOCKS, 1,
+                         1, 0)
+        journal_sb[48:64] = self.uuid
+        struct.pack_into('>I', journal_sb, 64, 1)
+        start_block = self.allocate_blocks(JOURNAL_BLOCKS)
+        self.write_block_data(start_block, journal_sb)
+        i_block = self.pack_extents(start_block, JOURNAL_BLOCKS)
+        self.write_inode(JOURNAL_INO, stat.S_IFREG | 0o600, JOURNAL_BLOCKS * BLOCK_SIZE, 1, i_block, JOURNAL_BLOCKS,
+                         uid=0, gid=0)
+        return i_block
+
+    @staticmethod
+    def pack_bitmap(num_used, num_valid):
+        bitmap = bytearray(BLOCK_SIZE)
+        for bit in list(range(num_used)) + list(range(num_valid, BLOCK_SIZE * 8)):
+            bitmap[bit // 8] |= 1 << (bit % 8)
+        return bitmap
+
+    def write_group_metadata(self):
+        group_blocks = self.blocks_count - FIRST_DATA_BLOCK
+        used_blocks = self.next_block - FIRST_DATA_BLOCK
+        used_inodes = self.next_ino - 1
+        self.write_block_data(BLOCK_BITMAP_BLOCK, self.pack_bitmap(used_blocks, group_blocks))
+        self.write_block_data(INODE_BITMAP_BLOCK, self.pack_bitmap(used_inodes, self.inodes_count))
+        group_desc = struct.pack('<IIIHHH', BLOCK_BITMAP_BLOCK, INODE_BITMAP_BLOCK, INODE_TABLE_BLOCK,
+                                 group_blocks - used_blocks, self.inodes_count - used_inodes, self.used_dirs)
+        self.write_block_data(GROUP_DESC_BLOCK, group_desc.ljust(32, b'\0'))
+        return group_blocks - used_blocks, self.inodes_count - used_inodes
+
+    def write_superblock(self, free_blocks, free_inodes, journal_i_block):
+        sb = bytearray(BLOCK_SIZE)
+        struct.pack_into('<IIIIIIIIIIIIIHhHHHHIIIIHHIHH', sb, 0,
+                         self.inodes_count, self.blocks_count, self.blocks_count * RESERVED_BLOCKS_PERCENT // 100,
+                         free_blocks, free_inodes, FIRST_DATA_BLOCK, 0, 0, BLOCKS_PER_GROUP, BLOCKS_PER_GROUP,
+                         self.inodes_count, 0, self.now, 0, -1, EXT4_SUPER_MAGIC, 1, 1, 0, self.now, 0, 0, 1, 0, 0,
+                         FIRST_INO, INODE_SIZE, 0)
+        struct.pack_into('<III', sb, 92, FEATURE_COMPAT_HAS_JOURNAL | FEATURE_COMPAT_EXT_ATTR,
+                         FEATURE_INCOMPAT_FILETYPE | FEATURE_INCOMPAT_EXTENTS,
+                         FEATURE_RO_COMPAT_SPARSE_SUPER | FEATURE_RO_COMPAT_LARGE_FILE | FEATURE_RO_COMPAT_DIR_NLINK |
+                         FEATURE_RO_COMPAT_EXTRA_ISIZE)
+        sb[104:120] = self.uuid
+        struct.pack_into('<I', sb, 224, JOURNAL_INO)
+        sb[236:252] = uuid.uuid4().bytes
+        struct.pack_into('<BBHII', sb, 252, HASH_HALF_MD4, JNL_BACKUP_BLOCKS, 0, DEFAULT_MOUNT_OPTS, 0)
+        struct.pack_into('<I', sb, 264, self.now)
+        sb[268:328] = journal_i_block
+        struct.pack_into('<II', sb, 328, 0, JOURNAL_BLOCKS * BLOCK_SIZE)
+        struct.pack_into('<HHI', sb, 348, INODE_EXTRA_ISIZE, INODE_EXTRA_ISIZE, FLAGS_SIGNED_HASH)
+        self.write_block_data(SUPERBLOCK_BLOCK, sb)
+
+    def build(self, root_dir_path):
+        journal_i_block = self.write_journal()
+        self.write_dir(FIRST_INO, ROOT_INO, [], stat.S_IFDIR | self.mode, min_blocks=LOST_FOUND_BLOCKS)
+        self.next_ino = FIRST_INO + 1
+        self.add_dir_contents(root_dir_path, ROOT_INO, ROOT_INO)
+        free_blocks, free_inodes = self.write_group_metadata()
+        self.write_superblock(free_blocks, free_inodes, journal_i_block)
+        return self.image
+
+
+def write_image(root_dir_path, img_path, size, mode=0o777, uid=12, gid=12):
+    image = Ext4ImageWriter(size, mode=mode, uid=uid, gid=gid).build(root_dir_path)
+    with open(img_path, 'wb') as img_file:
+        img_file.write(image)
+
+
+SUPERBLOCK_OFFSET = 1024
+FEATURE_INCOMPAT_64BIT = 0x80
+INLINE_DATA_FL = 0x10000000
+UNINIT_EXTENT_LENGTH = 32768
+DIRECT_BLOCKS = 12
+
+
+class Ext4ImageReader:
+
+    def __init__(self, image, offset=0):
+        self.image = memoryview(image)[offset:]
+        magic, = struct.unpack_from('<H', self.image, SUPERBLOCK_OFFSET + 56)
+        if magic != EXT4_SUPER_MAGIC:
+            raise ValueError('Not an ext2/3/4 filesystem image')
+        (self.inodes_count, _, _, _, _, self.first_data_block, log_block_size, _, self.blocks_per_group, _,
+         self.inodes_per_group) = struct.unpack_from('<IIIIIIIIIII', self.image, SUPERBLOCK_OFFSET)
+        self.block_size = 1024 << log_block_size
+        rev_level, = struct.unpack_from('<I', self.image, SUPERBLOCK_OFFSET + 76)
+        self.inode_size = struct.unpack_from('<H', self.image, SUPERBLOCK_OFFSET + 88)[0] if rev_level else 128
+        self.feature_incompat, = struct.unpack_from('<I', self.image, SUPERBLOCK_OFFSET + 96)
+        self.desc_size = 32
+        if self.feature_incompat & FEATURE_INCOMPAT_64BIT:
+            self.desc_size = struct.unpack_from('<H', self.image, SUPERBLOCK_OFFSET + 254)[0] or 32
+        self.has_file_type = bool(self.feature_incompat & FEATURE_INCOMPAT_FILETYPE)
+
+    def close(self):
+        self.image.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_block(self, block_num):
+        offset = block_num * self.block_size
+        return self.image[offset:offset + self.block_size]
+
+    def get_inode_table(self, group):
+        offset = (self.first_data_block + 1) * self.block_size + group * self.desc_size
+        inode_table, = struct.unpack_from('<I', self.image, offset + 8)
+        if self.desc_size >= 64:
+            inode_table |= struct.unpack_from('<I', self.image, offset + 0x28)[0] << 32
+        return inode_table
+
+    def read_inode(self, ino):
+        if not 0 < ino <= self.inodes_count:
+            raise ValueError('Inode {0} is out of range'.format(ino))
+        group, index = divmod(ino - 1, self.inodes_per_group)
+        offset = self.get_inode_table(group) * self.block_size + index * self.inode_size
+        mode, uid, size, atime, ctime, mtime, _, gid, links_count, blocks, flags = struct.unpack_from(
+            '<HHIIIIIHHII', self.image, offset)
+        file_acl, size_high = struct.unpack_from('<II', self.image, offset + 104)
+        uid_high, gid_high = struct.unpack_from('<HH', self.image, offset + 120)
+        return {
+            'ino': ino,
+            'mode': mode,
+            'uid': uid | uid_high << 16,
+            'gid': gid | gid_high << 16,
+            'size': size | size_high << 32,
+            'atime': atime,
+            'ctime': ctime,
+            'mtime': mtime,
+            'links_count': links_count,
+            'blocks': blocks,
+            'flags': flags,
+            'file_acl': file_acl,
+            'i_block': bytes(self.image[offset + 40:offset + 100])
+        }
+
+    def get_extent_runs(self, node):
+        magic, entries, _, depth = struct.unpack_from('<HHHH', node, 0)
+        if magic != EXT4_EXTENT_MAGIC:
+            raise ValueError('Corrupt extent tree')
+        runs = []
+        for index in range(entries):
+            entry_offset = 12 + index * 12
+            if depth:
+                _, leaf_lo, leaf_hi = struct.unpack_from('<IIH', node, entry_offset)
+                runs += self.get_extent_runs(self.get_block(leaf_hi << 32 | leaf_lo))
+            else:
+                logical_block, length, start_hi, start_lo = struct.unpack_from('<IHHI', node, entry_offset)
+                initialized = length <= UNINIT_EXTENT_LENGTH
+                length = length if initialized else length - UNINIT_EXTENT_LENGTH
+                runs.append((logical_block, start_hi << 32 | start_lo if initialized else 0, length))
+        return runs
+
+    def get_indirect_runs(self, block_num, logical_block, level):
+        if level == 0:
+            return [(logical_block, block_num, 1)]
+        runs = []
+        pointers_per_block = self.block_size // 4
+        span = pointers_per_block ** (level - 1)
+        for index, pointer in enumerate(struct.unpack_from('<{0}I'.format(pointers_per_block), self.get_block(block_num))):
+            if pointer:
+                runs += self.get_indirect_runs(pointer, logical_block + index * span, level - 1)
+        return runs
+
+    def get_block_map_runs(self, i_block):
+        pointers = struct.unpack_from('<15I', i_block)
+        runs = [(index, pointer, 1) for index, pointer in enumerate(pointers[:DIRECT_BLOCKS]) if pointer]
+        logical_block = DIRECT_BLOCKS
+        pointers_per_block = self.block_size // 4
+        for level, pointer in enumerate(pointers[DIRECT_BLOCKS:], start=1):
+            if pointer:
+                runs += self.get_indirect_runs(pointer, logical_block, level)
+            logical_block += pointers_per_block ** level
+        return runs
+
+    def get_runs(self, inode):
+        if inode['flags'] & EXTENTS_FL:
+            return sorted(self.get_extent_runs(inode['i_block']))
+        return self.get_block_map_runs(inode['i_block'])
+
+    def is_inline(self, inode):
+        if inode['flags'] & INLINE_DATA_FL:
+            if inode['size'] > len(inode['i_block']):
+                raise ValueError('Inode {0} stores data inline in extended attributes'.format(inode['ino']))
+            return True
+        if stat.S_ISLNK(inode['mode']):
+            ea_blocks = self.block_size // 512 if inode['file_acl'] else 0
+            return inode['blocks'] == ea_blocks
+        return False
+
+    def iter_inode_data(self, inode, chunk_size=1048576):
+        size = inode['size']
+        if self.is_inline(inode):
+            yield inode['i_block'][:size]
+            return
+        position = 0
+        for logical_block, physical_block, length in self.get_runs(inode):
+            run_start = logical_block * self.block_size
+            if run_start >= size:
+                break
+            if run_start > position:
+                yield bytes(run_start - position)
+                position = run_start
+            run_end = min(run_start + length * self.block_size, size)
+            data_start = physical_block * self.block_size
+            while position < run_end:
+                chunk_length = min(chunk_size, run_end - position)
+                if physical_block:
+                    offset = data_start + position - run_start
+                    yield bytes(self.image[offset:offset + chunk_length])
+                else:
+                    yield bytes(chunk_length)
+                position += chunk_length
+        if position < size:
+            yield bytes(size - position)
+
+    def read_inode_data(self, inode):
+        return b''.join(self.iter_inode_data(inode))
+
+    def list_inode_dir(self, inode):
+        if not stat.S_ISDIR(inode['mode']):
+            raise NotADirectoryError('Inode {0} is not a directory'.format(inode['ino']))
+        data = self.read_inode_data(inode)
+        entries = []
+        offset = 0
+        while offset + 8 <= len(data):
+            ino, rec_len, name_len, file_type = struct.unpack_from('<IHBB', data, offset)
+            if rec_len < 8:
+                break
+            if not self.has_file_type:
+                name_len |= file_type << 8
+                file_type = 0
+            name = os.fsdecode(data[offset + 8:offset + 8 + name_len])
+            if ino and name not in ('.', '..'):
+                entries.append((name, ino, file_type))
+            offset += rec_len
+        return entries
+
+    def lookup(self, path):
+        ino = ROOT_INO
+        for part in [part for part in path.split('/') if part]:
+            matches = [entry_ino for name, entry_ino, _ in self.list_inode_dir(self.read_inode(ino)) if name == part]
+            if not matches:
+                raise FileNotFoundError('{0} not found in image'.format(path))
+            ino = matches[0]
+        return ino
+
+    def stat(self, path):
+        return self.read_inode(self.lookup(path))
+
+    def list_dir(self, path='/'):
+        return sorted(name for name, _, _ in self.list_inode_dir(self.stat(path)))
+
+    def iter_file(self, path, chunk_size=1048576):
+        inode = self.stat(path)
+        if stat.S_ISDIR(inode['mode']):
+            raise IsADirectoryError('{0} is a directory'.format(path))
+        return self.iter_inode_data(inode, chunk_size)
+
+    def read_link(self, path):
+        return os.fsdecode(self.read_inode_data(self.stat(path)))
+
+    def walk(self, path='/'):
+        dirs = []
+        files = []
+        for name, ino, _ in sorted(self.list_inode_dir(self.stat(path))):
+            inode = self.read_inode(ino)
+            (dirs if stat.S_ISDIR(inode['mode']) else files).append(name)
+        yield path, dirs, files
+        for dir_name in dirs:
+            yield from self.walk('{0}/{1}'.format(path.rstrip('/'), dir_name))
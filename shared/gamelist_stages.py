@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+import logging
+from collections import deque
+
+from shared import common_utils, info_messages, tracing
+
+logger = logging.getLogger(__name__)
+
+# A stage is any object with visit(game), called with the GameRecord of each game in gamelist order, and finish(),
+# called once every game has been visited. Stages run in the order given, so an earlier stage (e.g. bezel matching)
+# can fill in fields which later stages read. A stage may also have prefetch(game), called up to LOOKAHEAD games
+# before visit, to start slow work (e.g. downloads) early.
+
+LOOKAHEAD = 32
+
+
+def get_stage_names(stages):
+    return ', '.join(type(stage).__name__ for stage in stages)
+
+
+def visit_game(game, stages):
+    for stage in stages:
+        stage.visit(game)
+
+
+@tracing.traced()
+def run(input_path, stages):
+    # Every stage is fed from one streaming read of the gamelist, so each game is parsed only once however many
+    # stages need it
+    logger.info(info_messages.running_gamelist_stages(input_path, get_stage_names(stages)))
+    num_games = 0
+    prefetching_stages = [stage for stage in stages if hasattr(stage, 'prefetch')]
+    window = deque()
+    try:
+        for game in common_utils.iter_gamelist(input_path):
+            num_games += 1
+            for stage in prefetching_stages:
+                stage.prefetch(game)
+            window.append(game)
+            if len(window) > LOOKAHEAD:
+                visit_game(window.popleft(), stages)
+        while window:
+            visit_game(window.popleft(), stages)
+    finally:
+        for stage in stages:
+            stage.finish()
+    return num_games
@@ -16,6 +16,9 @@ CORE_PATH = "The path to a libretro core (a '.so' file) for the system being emu
 
 BIOS_DIR = "A directory containing additional files (usually a bios) to be included with the rom(s)."
 
+LINK_STRATEGY = "How cores, bios files and default art are put into each recipe: 'copy' (the default), 'hardlink' or " \
+                "'reflink'. Links share one copy on disk and fall back to copying where the filesystem can't link them."
+
 PLATFORM = "The name of the platform being emulated to enable scraping."
 
 SCRAPE_MODULE = "The online source for scraping metadata."
@@ -26,6 +29,10 @@ PASSWORD = 'Password for scraping module.'
 
 REFRESH_ROM_DATA = 'Choose whether to refresh the metadata cache'
 
+SCRAPE_SHARDS = 'Split the roms into this many groups and scrape them with one Skyscraper process each, at the same time. Defaults to 1.'
+
+SCRAPE_THREADS = "The number of threads each Skyscraper process scrapes with. Defaults to Skyscraper's own setting."
+
 EXPORT_BITPIXEL_MARQUEES = 'Choose whether to export marquees, resized to fit the Bitpixel, to a filesystem folder'
 
 EXPORT_COX_ASSETS = 'Choose whether to export assets for use with CoinOpsX'
@@ -34,10 +41,22 @@ SCRAPE_VIDEOS = 'Choose whether to scrape videos. Useful only if you choose to e
 
 PART_PATH = "The path to a save partition to replace the UCE's existing save partition."
 
+PARTS_DIR = 'A directory of save partitions named after the UCEs they belong to, e.g. game.img for game.uce.'
+
+PARTS_MANIFEST = 'A JSON file mapping UCE file names to save partition paths. Overrides matching by name.'
+
 MOUNT_METHOD = 'Set this option to use the mount method for opening an existing save parition. Linux only.'
 
 FILE_MANAGER = 'Optionally specify a file manager to open the save parition. Linux only.'
 
+JOBS = 'The number of UCEs to build or process at the same time. Defaults to 1.'
+
+FORCE = 'Set this option to rebuild every UCE, even those whose recipe has not changed since the last build.'
+
+HASH_CONTENTS = 'Set this option to compare file contents, not just sizes and dates, when checking for changed recipes.'
+
+DUMP_CONTENTS = 'Set this option to copy the files inside the save partition to a directory instead of saving the partition image.'
+
 BACKUP_UCE = 'Set this option to create a backup of the UCE file before editing.'
 
 DO_BEZEL_SCRAPE = 'Choose whether to scrape bezels in addition to other game data provided by Skyscraper'
@@ -50,11 +69,17 @@ COMPARE_FILENAME = 'Use a filename instead of game title to scrape bezels'
 
 FILTER_UNSUPPORTED_REGIONS = 'Use the default system bezel for Japanese games which are not supported by the bezel project'
 
+BEZEL_JOBS = 'The number of processes to match games to bezels with at the same time. Defaults to 1.'
+
+TRACE = 'Write the time taken by each stage, game and external command to a JSON file which can be loaded into ' \
+        'Perfetto (ui.perfetto.dev) or chrome://tracing.'
+
+
 # Operations
 
-SCRAPE_TO_UCES = 'Provide a directory of roms, scrape cover images and metadata and generate UCEs in one step.'
+SCRAPE_TO_UCES = "Provide a directory of roms, scrape cover images and metadata and generate UCEs in one step. The scraped gamelist and media are kept in ~/.ucetool/gamelists so later runs only scrape new or changed roms. This can use a lot of space and can safely be deleted."
 
-SCRAPE_TO_RECIPES = "Provide a directory of roms, scrape cover images and metadata and build directories in 'recipe' format."
+SCRAPE_TO_RECIPES = "Provide a directory of roms, scrape cover images and metadata and build directories in 'recipe' format. The scraped gamelist and media are kept in ~/.ucetool/gamelists so later runs only scrape new or changed roms. This can use a lot of space and can safely be deleted."
 
 SCRAPE_TO_GAMELIST = 'Provide a directory of roms, scrape cover images and metadata and generate an EmulationStation format gamelist.xml, for later generation of recipes/UCEs'
 
@@ -72,6 +97,10 @@ EXTRACT_SAVE_PARTITION = 'Extract the save partition from an existing UCE file.'
 
 REPLACE_SAVE_PARTITION = 'Replace the save parttion of an existing UCE file with a specified save.img file.'
 
+EXTRACT_SAVE_PARTITIONS = 'Extract the save partitions from every UCE file in a directory.'
+
+REPLACE_SAVE_PARTITIONS = 'Replace the save partitions of every UCE file in a directory with matching save.img files.'
+
 EXPORT_GAMELIST_ASSETS = 'Export CoinOpsX assets from a specified gamelist.xml'
 
 ADD_BEZELS_TO_GAMELIST = 'Add bezels to a previously created gamelist.xml'
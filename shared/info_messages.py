@@ -30,6 +30,35 @@ def recipe_dir_check(dir_, result_text):
     return 'Directory {0} was checked and {1}'.format(dir_, result_text)
 
 
+def recipe_build_succeeded(dir_, output_path):
+    return 'Built UCE {0} from recipe {1}'.format(output_path, dir_)
+
+
+def recipe_build_summary(num_built, num_failed, num_skipped):
+    return 'Finished building recipes: {0} built, {1} failed, {2} skipped as unchanged'.format(num_built, num_failed,
+                                                                                              num_skipped)
+
+
+def uce_up_to_date(output_path):
+    return 'UCE {0} is up to date with its recipe, skipping'.format(output_path)
+
+
+def running_gamelist_stages(input_path, stage_names):
+    return 'Processing {0} in a single pass with: {1}'.format(input_path, stage_names)
+
+
+def making_recipes_in_parallel(jobs):
+    return 'Making recipes using {0} worker threads'.format(jobs)
+
+
+def building_from_gamelist(jobs):
+    return 'Making recipes for and building UCEs, with {0} UCEs being built at a time'.format(jobs)
+
+
+def building_recipes_in_parallel(num_recipes, jobs):
+    return 'Building {0} recipes using {1} worker processes'.format(num_recipes, jobs)
+
+
 # Build from recipe
 
 SAVE_DIR_DATA_FOUND = 'Custom save data found in save dir'
@@ -68,6 +97,22 @@ def created_temp_dir(calling_module):
     return 'Created temp dir for module {0}'.format(calling_module)
 
 
+def scraping_in_shards(num_shards):
+    return 'Scraping in {0} shards, each with its own Skyscraper process'.format(num_shards)
+
+
+GAMELIST_UP_TO_DATE = 'No roms have been added, changed or removed since the last scrape, keeping the existing gamelist'
+
+
+def scraping_changed_roms(num_changed, num_removed):
+    return 'Scraping {0} new or changed roms and removing {1} deleted roms from the existing gamelist'.format(
+        num_changed, num_removed)
+
+
+def merged_shard_gamelists(num_shards, num_games):
+    return 'Merged gamelists from {0} shards, {1} entries in total'.format(num_shards, num_games)
+
+
 def ran_command(cmd):
     return 'Successfully ran command: {0}'.format(' '.join(cmd))
 
@@ -93,6 +138,14 @@ def copy_success(item_type, source, dest):
     return 'Successfully copied {0} {1} to {2}'.format(item_type, source, dest)
 
 
+def reflink_success(source, dest):
+    return 'Successfully cloned file {0} to {1}'.format(source, dest)
+
+
+def hardlink_success(source, dest):
+    return 'Successfully hardlinked file {0} to {1}'.format(source, dest)
+
+
 def symlink_success(symlink, target):
     return 'Successfully created symlink {0} to target {1}'.format(symlink, target)
 
@@ -106,18 +159,46 @@ def image_resize_success(source_path, dest_path):
 
 # UCE Utils
 
-def split_uce(uce_path):
-    return 'Splitting UCE file {0} into main section and save partition'.format(uce_path)
+def extracting_save_part(uce_path, img_path):
+    return 'Extracting save partition from UCE file {0} to {1}'.format(uce_path, img_path)
+
+
+def replacing_save_part(uce_path, img_path):
+    return 'Replacing save partition in UCE file {0} with {1}'.format(uce_path, img_path)
+
+
+def processing_save_parts(num_uces, jobs):
+    return 'Processing the save partitions of {0} UCEs using {1} worker threads'.format(num_uces, jobs)
+
+
+def save_parts_summary(operation_name, num_succeeded, num_failed, num_skipped):
+    return 'Finished {0} of save partitions: {1} succeeded, {2} failed, {3} skipped'.format(
+        operation_name, num_succeeded, num_failed, num_skipped)
 
 
-def rebuild_uce(uce_path):
-    return 'Rebuilding UCE file {0}'.format(uce_path)
+def restoring_save_part(uce_path, journal_path):
+    return 'Found an interrupted save partition replacement, restoring {0} from {1}'.format(uce_path, journal_path)
+
+
+def dumping_save_part(file_path, dest_dir):
+    return 'Copying save partition contents from {0} to {1}'.format(file_path, dest_dir)
+
+
+def save_part_written(dir_path, img_path):
+    return 'Created save partition {0} from contents of {1}'.format(img_path, dir_path)
 
 
 def modifying_save_part_perms(img_path):
     return 'Modifying save partition permissions in {0}'.format(img_path)
 
 
+CREATING_BLANK_SAVE_TEMPLATE = 'Creating cached blank save partition template'
+
+
+def using_blank_save_template(template_path):
+    return 'Using cached blank save partition {0}'.format(template_path)
+
+
 # Scrape bezels
 
 FORCE_COMPARE_FILENAME = "Forcing 'compare filename' to match names in platform's bezelproject repo"
@@ -127,8 +208,28 @@ def reverting_to_filename_compare(game_basename):
     return 'Reverting to filename match for {0} due to lack of scraped title'.format(game_basename)
 
 
-def bezel_local_copy_found(game_name):
-    return 'Bezel file for {0} already stored locally'.format(game_name)
+def using_cached_bezel_tree(repo):
+    return 'Using cached list of bezels in {0}'.format(repo)
+
+
+def bezel_tree_not_modified(repo):
+    return 'List of bezels in {0} has not changed since it was cached'.format(repo)
+
+
+def using_stale_bezel_tree(repo):
+    return 'Could not check for changes to the list of bezels in {0}, using the cached list'.format(repo)
+
+
+def bezel_local_copy_found(local_path):
+    return 'Bezel file {0} already stored locally'.format(local_path)
+
+
+def using_bezel_match_cache(repo, num_matches):
+    return 'Reusing {0} bezel matches from earlier runs against {1}'.format(num_matches, repo)
+
+
+def matching_bezels_in_parallel(num_names, jobs):
+    return 'Matching {0} game names to bezels across {1} processes'.format(num_names, jobs)
 
 
 # Shared
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+import os
+import logging
+
+from shared import common_utils
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE_NAME = '.rom_manifest.json'
+
+# Bump this whenever a change to scraping means existing gamelists should be scraped again from scratch
+MANIFEST_VERSION = 1
+
+
+def get_manifest_path(output_dir):
+    return os.path.join(output_dir, MANIFEST_FILE_NAME)
+
+
+def get_scrape_settings(platform, scrape_module, scrape_videos):
+    return {'platform': platform, 'scrape_module': scrape_module, 'scrape_videos': bool(scrape_videos)}
+
+
+def get_blank_manifest(platform, scrape_module, scrape_videos):
+    return dict(get_scrape_settings(platform, scrape_module, scrape_videos), version=MANIFEST_VERSION, roms={})
+
+
+def read_manifest(output_dir, platform, scrape_module, scrape_videos):
+    # A gamelist scraped for a different platform, from a different module or with or without videos has nothing
+    # worth keeping
+    manifest = common_utils.read_json(get_manifest_path(output_dir))
+    settings = get_scrape_settings(platform, scrape_module, scrape_videos)
+    if not manifest or manifest.get('version') != MANIFEST_VERSION or \
+            any(manifest.get(key) != value for key, value in settings.items()):
+        return get_blank_manifest(platform, scrape_module, scrape_videos)
+    return manifest
+
+
+def write_manifest(output_dir, manifest):
+    return common_utils.write_json(get_manifest_path(output_dir), manifest)
+
+
+def get_rom_record(rom_path, md5_hex_digest):
+    rom_stat = os.stat(rom_path)
+    return {
+        'size': rom_stat.st_size,
+        'mtime_ns': rom_stat.st_mtime_ns,
+        'md5': md5_hex_digest
+    }
+
+
+def get_rom_md5(rom_path):
+    md5_hash = common_utils.get_file_md5(rom_path)
+    return md5_hash.hexdigest() if md5_hash else None
+
+
+def check_rom(record, rom_path):
+    # Size and mtime are enough to spot an unchanged rom; a rom which has only been touched is hashed and, if its
+    # contents match, isn't scraped again
+    rom_stat = os.stat(rom_path)
+    if record and rom_stat.st_size == record.get('size') and rom_stat.st_mtime_ns == record.get('mtime_ns'):
+        return False, record
+    md5_hex_digest = get_rom_md5(rom_path)
+    changed = not record or not md5_hex_digest or md5_hex_digest != record.get('md5')
+    return changed, get_rom_record(rom_path, md5_hex_digest)
+
+
+def get_rom_changes(manifest, rom_paths):
+    # Roms are keyed by file name, as Skyscraper is only ever run on the top level of the input dir
+    changed_paths = []
+    records = {}
+    for rom_path in rom_paths:
+        rom_name = os.path.basename(rom_path)
+        changed, records[rom_name] = check_rom(manifest['roms'].get(rom_name), rom_path)
+        if changed:
+            changed_paths.append(rom_path)
+    removed_names = sorted(set(manifest['roms']) - set(records))
+    return changed_paths, removed_names, records
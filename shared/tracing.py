@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import threading
+import functools
+import contextlib
+
+# Timings are recorded as Chrome trace events ('complete' events with a start and a duration, in microseconds) so a
+# run can be loaded into Perfetto or chrome://tracing. Nothing is recorded unless tracing has been enabled.
+
+_enabled = False
+
+_events = []
+
+_events_lock = threading.Lock()
+
+# perf_counter is precise but only meaningful within one process, so it is anchored to the wall clock to keep
+# timings from worker processes on the same timeline
+_clock_offset_ns = time.time_ns() - time.perf_counter_ns()
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset(enabled=False):
+    global _enabled
+    _enabled = enabled
+    pop_events()
+
+
+def get_timestamp():
+    return (time.perf_counter_ns() + _clock_offset_ns) // 1000
+
+
+def add_events(events):
+    with _events_lock:
+        _events.extend(events)
+
+
+def pop_events():
+    with _events_lock:
+        events = _events[:]
+        del _events[:]
+    return events
+
+
+@contextlib.contextmanager
+def span(name, category='stage', **args):
+    if not _enabled:
+        yield
+        return
+    start = get_timestamp()
+    try:
+        yield
+    finally:
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': start,
+            'dur': get_timestamp() - start,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+        }
+        if args:
+            event['args'] = {key: str(value) for key, value in args.items()}
+        add_events([event])
+
+
+def traced(category='stage', name=None):
+    def decorator(func):
+        span_name = name if name else '{0}.{1}'.format(func.__module__, func.__name__)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def get_cmd_name(cmd):
+    if isinstance(cmd, (list, tuple)):
+        return os.path.basename(str(cmd[0]))
+    return str(cmd).split(' ')[0]
+
+
+def get_trace():
+    with _events_lock:
+        events = _events[:]
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
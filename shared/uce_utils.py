@@ -1,96 +1,349 @@
 #!/usr/bin/env python3
 
 import os
-import time
+import re
+import mmap
+import contextlib
+import stat
+import glob
+import struct
+import hashlib
 import logging
+import threading
 
-from shared import common_utils, info_messages
+from shared import common_utils, configs, ext4_image, info_messages, error_messages, tracing
 
 logger = logging.getLogger(__name__)
 
+DEBUGFS_PROMPT = 'debugfs: '
 
-def split_uce(input_path):
-    logger.info(info_messages.split_uce(input_path))
-    data = common_utils.get_file_content(input_path, 'rb')
-    squashfs_etc_data = data[:-4194304]
-    save_data = data[-4194304:]
-    return squashfs_etc_data, save_data
+DEBUGFS_LS_ENTRY = re.compile(r'^/(?P<inode>\d+)/(?P<mode>\d+)/\d*/\d*/(?P<name>.*)/\d*/$')
 
+SAVE_PART_SIZE = 4194304
 
-def rebuild_uce(input_path, squashfs_etc_data, img_path):
-    logger.info(info_messages.rebuild_uce(input_path))
-    save_data = common_utils.get_file_content(img_path, 'rb')
-    common_utils.write_file(input_path, squashfs_etc_data + save_data, 'wb')
+# The md5 of the save partition sits immediately before it at the end of a UCE
+SAVE_MD5_SIZE = 16
 
+SAVE_JOURNAL_SUFFIX = '.savejournal'
 
-def create_blank_file(file_path, size=4194304):
-    bin_ = common_utils.get_platform_bin('truncate.exe', 'truncate')
-    cmd = [
-        bin_,
-        '-s',
-        str(size),
-        file_path
-    ]
-    common_utils.execute_with_output(cmd)
+SAVE_JOURNAL_HEADER = struct.Struct('<Q')
+
+# Bump this whenever the contents of the blank save partition change, so cached templates are regenerated
+BLANK_SAVE_LAYOUT_VERSION = 1
+
+# Held while looking for or creating the template, so builder threads racing on a cold cache create it only once
+blank_save_template_lock = threading.Lock()
+
+
+def get_save_part_offset(uce_file):
+    uce_file.seek(0, os.SEEK_END)
+    offset = uce_file.tell() - SAVE_PART_SIZE
+    if offset < SAVE_MD5_SIZE:
+        raise ValueError('File is too small to contain a save partition')
+    return offset
+
+
+def extract_save_part(input_path, img_path):
+    logger.info(info_messages.extracting_save_part(input_path, img_path))
+    if not recover_save_part(input_path):
+        return False
+    try:
+        with open(input_path, 'rb') as uce_file, open(img_path, 'wb') as img_file:
+            uce_file.seek(get_save_part_offset(uce_file))
+            common_utils.copy_file_obj(uce_file, img_file)
+    except (OSError, ValueError) as e:
+        logger.error(error_messages.save_part_read_failed(input_path, e))
+        return False
+    logger.info(info_messages.access_success('wrote', img_path))
+    return True
+
+
+def get_save_journal_path(input_path):
+    return input_path + SAVE_JOURNAL_SUFFIX
+
+
+def sync_file(file_obj):
+    file_obj.flush()
+    os.fsync(file_obj.fileno())
+
+
+def sync_dir(dir_path):
+    # Makes a rename within the dir durable. Windows can't open dirs this way and doesn't need it
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    dir_fd = os.open(dir_path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
 
 
+def write_save_journal(uce_file, journal_path):
+    # The journal holds the offset and old bytes of the save md5 and save partition. It only appears under its real
+    # name once complete, so a journal which exists can always be replayed
+    tail_offset = get_save_part_offset(uce_file) - SAVE_MD5_SIZE
+    temp_path = '{0}.tmp'.format(journal_path)
+    uce_file.seek(tail_offset)
+    with open(temp_path, 'wb') as journal_file:
+        journal_file.write(SAVE_JOURNAL_HEADER.pack(tail_offset))
+        common_utils.copy_file_obj(uce_file, journal_file)
+        sync_file(journal_file)
+    os.replace(temp_path, journal_path)
+    sync_dir(os.path.dirname(os.path.abspath(journal_path)))
+
+
+def restore_save_journal(uce_file, journal_path):
+    with open(journal_path, 'rb') as journal_file:
+        tail_offset, = SAVE_JOURNAL_HEADER.unpack(journal_file.read(SAVE_JOURNAL_HEADER.size))
+        uce_file.seek(tail_offset)
+        common_utils.copy_file_obj(journal_file, uce_file)
+    uce_file.truncate()
+    sync_file(uce_file)
+    os.remove(journal_path)
+
+
+def recover_save_part(input_path):
+    journal_path = get_save_journal_path(input_path)
+    if not os.path.isfile(journal_path):
+        return True
+    logger.warning(info_messages.restoring_save_part(input_path, journal_path))
+    try:
+        with open(input_path, 'r+b') as uce_file:
+            restore_save_journal(uce_file, journal_path)
+    except (OSError, struct.error) as e:
+        logger.error(error_messages.save_part_restore_failed(input_path, journal_path, e))
+        return False
+    return True
+
+
+def overwrite_save_part(uce_file, img_path, save_md5_digest):
+    uce_file.seek(get_save_part_offset(uce_file) - SAVE_MD5_SIZE)
+    uce_file.write(save_md5_digest)
+    with open(img_path, 'rb') as img_file:
+        common_utils.copy_file_obj(img_file, uce_file)
+    sync_file(uce_file)
+
+
+def replace_save_part(input_path, img_path):
+    logger.info(info_messages.replacing_save_part(input_path, img_path))
+    journal_path = get_save_journal_path(input_path)
+    try:
+        img_size = os.path.getsize(img_path)
+        if img_size != SAVE_PART_SIZE:
+            logger.error(error_messages.invalid_save_part_size(img_path, img_size, SAVE_PART_SIZE))
+            return False
+        save_md5 = common_utils.get_file_md5(img_path)
+        if not save_md5 or not recover_save_part(input_path):
+            return False
+        with open(input_path, 'r+b') as uce_file:
+            write_save_journal(uce_file, journal_path)
+            overwrite_save_part(uce_file, img_path, save_md5.digest())
+        os.remove(journal_path)
+    except (OSError, ValueError) as e:
+        logger.error(error_messages.save_part_replace_failed(input_path, e))
+        recover_save_part(input_path)
+        return False
+    logger.info(info_messages.access_success('wrote', input_path))
+    return True
+
+
+@tracing.traced()
 def make_save_part_from_dir(root_dir_path, img_path):
-    create_blank_file(img_path)
-    bin_ = common_utils.get_platform_bin('mke2fs.exe', 'mke2fs')
-    cmd = [
-        bin_,
-        '-d',
-        root_dir_path,
-        '-t',
-        'ext4',
-        img_path
-    ]
-    common_utils.execute_with_output(cmd)
+    try:
+        ext4_image.write_image(root_dir_path, img_path, SAVE_PART_SIZE)
+    except (OSError, ValueError) as e:
+        logger.error(error_messages.save_part_write_failed(root_dir_path, img_path, e))
+        return False
+    logger.info(info_messages.save_part_written(root_dir_path, img_path))
+    return True
+
+
+@contextlib.contextmanager
+def open_save_part(file_path, from_uce=True):
+    with open(file_path, 'rb') as img_file, mmap.mmap(img_file.fileno(), 0, access=mmap.ACCESS_READ) as img_map:
+        offset = len(img_map) - SAVE_PART_SIZE if from_uce else 0
+        if offset < 0:
+            raise ValueError('File is too small to contain a save partition')
+        reader = ext4_image.Ext4ImageReader(img_map, offset)
+        try:
+            yield reader
+        finally:
+            reader.close()
 
 
-def ls_img_dir(debugfs_temp_dir, img_path, img_dir):
-    output_path = os.path.join(debugfs_temp_dir, 'debug_ls_out-{0}'.format(time.time_ns()))
+def get_local_path(dest_dir, img_path):
+    return os.path.join(dest_dir, *[part for part in img_path.split('/') if part])
+
+
+def dump_save_part_item(reader, img_path, local_path):
+    inode = reader.stat(img_path)
+    if stat.S_ISLNK(inode['mode']):
+        os.symlink(reader.read_link(img_path), local_path)
+        return
+    with open(local_path, 'wb') as local_file:
+        for chunk in reader.iter_file(img_path):
+            local_file.write(chunk)
+    os.utime(local_path, (inode['atime'], inode['mtime']))
+
+
+def dump_save_part(file_path, dest_dir, from_uce=True):
+    logger.info(info_messages.dumping_save_part(file_path, dest_dir))
+    try:
+        with open_save_part(file_path, from_uce=from_uce) as reader:
+            for img_dir, dirs, files in reader.walk():
+                os.makedirs(get_local_path(dest_dir, img_dir), exist_ok=True)
+                for file_name in files:
+                    img_path = join_img_path(img_dir, file_name)
+                    dump_save_part_item(reader, img_path, get_local_path(dest_dir, img_path))
+    except (OSError, ValueError) as e:
+        logger.error(error_messages.save_part_read_failed(file_path, e))
+        return False
+    return True
+
+
+def run_debugfs_cmds(img_path, cmds, write=False):
     bin_ = common_utils.get_platform_bin('debugfs.exe', 'debugfs')
-    cmd = "{0} -R 'ls -p {1}' {2} > {3}".format(bin_, img_dir, img_path, output_path)
-    proc = os.popen(cmd)
-    out = proc.read()
-    return [line for line in common_utils.get_file_content(output_path, 'r').split('\n') if line]
+    cmd = [bin_, '-f', '-']
+    if write:
+        cmd.append('-w')
+    cmd.append(img_path)
+    return common_utils.execute_with_input(cmd, ''.join('{0}\n'.format(line) for line in cmds))
+
 
+def split_debugfs_output(output):
+    # Each command run from a command file is echoed after the prompt, which marks the start of its output
+    blocks = []
+    for line in output.split('\n'):
+        if line.startswith(DEBUGFS_PROMPT):
+            blocks.append([])
+        elif blocks and line:
+            blocks[-1].append(line)
+    return blocks
 
-def ls_recursive(debugfs_temp_dir, img_path, img_dir):
+
+def ls_img_dirs(img_path, img_dirs):
+    output = run_debugfs_cmds(img_path, ['ls -p "{0}"'.format(img_dir) for img_dir in img_dirs])
+    if output is False:
+        return [[] for _ in img_dirs]
+    return split_debugfs_output(output)
+
+
+def join_img_path(img_dir, item_name):
+    return '{0}/{1}'.format(img_dir.rstrip('/'), item_name)
+
+
+def ls_recursive(img_path, img_dir='/'):
     dirs = []
     files = []
-    for item in ls_img_dir(debugfs_temp_dir, img_path, img_dir):
-        item_name = item.split('/')[5]
-        if item[-2:] == '//':
-            if item_name not in ('.', '..'):
-                dirs.append('{0}{1}/'.format(img_dir, item_name))
-        else:
-            if item_name:
-                files.append('{0}{1}'.format(img_dir, item_name))
-    for dir_ in dirs:
-        dirs_, files_ = ls_recursive(debugfs_temp_dir, img_path, dir_)
-        dirs += dirs_
-        files += files_
+    current_dirs = [img_dir]
+    while current_dirs:
+        sub_dirs = []
+        for dir_, items in zip(current_dirs, ls_img_dirs(img_path, current_dirs)):
+            for item in items:
+                match = DEBUGFS_LS_ENTRY.match(item)
+                if not match or match.group('name') in ('.', '..', ''):
+                    continue
+                item_path = join_img_path(dir_, match.group('name'))
+                if stat.S_ISDIR(int(match.group('mode'), 8)):
+                    sub_dirs.append(item_path)
+                else:
+                    files.append(item_path)
+        dirs += sub_dirs
+        current_dirs = sub_dirs
     return dirs, files
 
 
-def modify_inode(item, img_path, perm_octal):
-    bin_ = common_utils.get_platform_bin('debugfs.exe', 'debugfs')
-    cmds = [
-        "{0} -R 'sif {1} mode {2}' -w {3}".format(bin_, item, perm_octal, img_path),
-        "{0} -R 'sif {1} gid 12' -w {2}".format(bin_, item, img_path),
-        "{0} -R 'sif {1} uid 12' -w {2}".format(bin_, item, img_path),
-        ]
-    for cmd in cmds:
-        proc = os.popen(cmd)
-        out = proc.read()
+def get_modify_inode_cmds(item, perm_octal):
+    return [
+        'sif "{0}" mode {1}'.format(item, perm_octal),
+        'sif "{0}" gid 12'.format(item),
+        'sif "{0}" uid 12'.format(item)
+    ]
 
 
-def modify_inodes(debugfs_temp_dir, img_path):
+def modify_inodes(img_path):
     logger.info(info_messages.modifying_save_part_perms(img_path))
-    dirs, files = ls_recursive(debugfs_temp_dir, img_path, '/')
+    dirs, files = ls_recursive(img_path)
+    cmds = []
     for item in files:
-        modify_inode(item, img_path, '0100777')
+        cmds += get_modify_inode_cmds(item, '0100777')
     for item in dirs:
-        modify_inode(item[:-1], img_path, '040777')
+        cmds += get_modify_inode_cmds(item, '040777')
+    return run_debugfs_cmds(img_path, cmds, write=True) is not False
+
+
+def make_blank_save_dir(dir_path):
+    common_utils.make_dir(os.path.join(dir_path, 'upper'))
+    common_utils.make_dir(os.path.join(dir_path, 'work'))
+    common_utils.write_file(os.path.join(dir_path, 'upper', 'hiscore.dat'), '', 'w')
+
+
+def get_blank_save_template_key():
+    key_source = '{0}\n{1}\n{2}'.format(BLANK_SAVE_LAYOUT_VERSION, SAVE_PART_SIZE, ext4_image.WRITER_VERSION)
+    return hashlib.sha1(key_source.encode()).hexdigest()[:16]
+
+
+def find_blank_save_template(template_key):
+    # The md5 is part of the file name so an image and its hash are always published together by a single rename
+    pattern = os.path.join(configs.SAVE_TEMPLATE_DIR, 'blank_save-{0}-*.img'.format(template_key))
+    for template_path in sorted(glob.glob(pattern)):
+        md5_hex_digest = os.path.splitext(template_path)[0].split('-')[-1]
+        if len(md5_hex_digest) == 32 and os.path.getsize(template_path) == SAVE_PART_SIZE:
+            return template_path, md5_hex_digest
+    return None
+
+
+def create_blank_save_template(template_key):
+    logger.info(info_messages.CREATING_BLANK_SAVE_TEMPLATE)
+    if not os.path.isdir(configs.SAVE_TEMPLATE_DIR):
+        try:
+            os.makedirs(configs.SAVE_TEMPLATE_DIR, exist_ok=True)
+        except OSError as e:
+            logger.error(error_messages.make_dir_failure(configs.SAVE_TEMPLATE_DIR, e))
+            return None
+    temp_dir = common_utils.create_temp_dir(__name__)
+    if not temp_dir:
+        return None
+    blank_save_dir = os.path.join(temp_dir, 'blank_save')
+    common_utils.make_dir(blank_save_dir)
+    make_blank_save_dir(blank_save_dir)
+    img_path = os.path.join(temp_dir, 'blank_save.img')
+    template = None
+    if make_save_part_from_dir(blank_save_dir, img_path):
+        template = publish_blank_save_template(img_path, template_key)
+    common_utils.cleanup_temp_dir(__name__, temp_dir)
+    return template
+
+
+def publish_blank_save_template(img_path, template_key):
+    md5_hash = common_utils.get_file_md5(img_path)
+    if not md5_hash:
+        return None
+    template_path = os.path.join(configs.SAVE_TEMPLATE_DIR,
+                                 'blank_save-{0}-{1}.img'.format(template_key, md5_hash.hexdigest()))
+    temp_template_path = common_utils.get_temp_path(template_path)
+    if not common_utils.copyfile(img_path, temp_template_path):
+        return None
+    try:
+        # Blank images differ from build to build, so if another process has published one in the meantime this copy
+        # is dropped rather than left beside it
+        published_template = find_blank_save_template(template_key)
+        if published_template:
+            os.remove(temp_template_path)
+            return published_template
+        os.replace(temp_template_path, template_path)
+    except OSError as e:
+        logger.error(error_messages.copy_failure('file', img_path, template_path, e))
+        return None
+    return template_path, md5_hash.hexdigest()
+
+
+@tracing.traced()
+def copy_blank_save_part(img_path):
+    template_key = get_blank_save_template_key()
+    with blank_save_template_lock:
+        template = find_blank_save_template(template_key) or create_blank_save_template(template_key)
+    if not template or not common_utils.clone_file(template[0], img_path):
+        return None
+    logger.info(info_messages.using_blank_save_template(template[0]))
+    return bytes.fromhex(template[1])
@@ -4,7 +4,7 @@ import os
 import logging
 
 import operations
-from shared import common_utils
+from shared import common_utils, tracing, gamelist_stages
 
 logger = logging.getLogger(__name__)
 
@@ -23,28 +23,28 @@ def append_to_summary_table(summary_table, game_data, rom_basename, bezel_basena
     summary_table.append(
         [
             rom_basename,
-            game_data.get('name', None),
+            game_data.name,
             bezel_basename,
-            game_data.get('bezel_match', None),
-            True if game_data.get('boxart_path', False) else False,
-            True if game_data.get('marquee_path', False) else False,
-            True if game_data.get('logo_path', False) else False,
-            True if game_data.get('video_path', False) else False,
+            game_data.bezel_match,
+            True if game_data.boxart_path else False,
+            True if game_data.marquee_path else False,
+            True if game_data.logo_path else False,
+            True if game_data.video_path else False,
         ]
     )
 
 
 def append_to_summary_lists(summary_lists, game_data, rom_basename, bezel_basename):
-    bezel_match = game_data.get('bezel_match', '')
-    if not game_data.get('name', None):
+    bezel_match = game_data.bezel_match
+    if not game_data.name:
         summary_lists['no_scraped_title'].append(rom_basename)
-    if not game_data.get('boxart_path', False):
+    if not game_data.boxart_path:
         summary_lists['no_cover'].append(rom_basename)
-    if not game_data.get('logo_path', False):
+    if not game_data.logo_path:
         summary_lists['no_logo'].append(rom_basename)
-    if not game_data.get('video_path', False):
+    if not game_data.video_path:
         summary_lists['no_video'].append(rom_basename)
-    if not game_data.get('marquee_path', False):
+    if not game_data.marquee_path:
         summary_lists['no_marquee'].append(rom_basename)
     if bezel_match == 'default':
         summary_lists['default_bezel'].append(rom_basename),
@@ -76,30 +76,48 @@ def format_summary_lists(summary_lists):
     return summary_text
 
 
-def main(input_path, output_dir=None):
+# Gamelist stage which collects a row and list entries for each game and writes the summary files at the end
+class GamelistSummary:
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.summary_table = [['Filename', 'Gamelist name', 'Bezel name', 'Bezel match', 'Has cover', 'Has marquee',
+                               'Has logo', 'Has video', ], ]
+        self.summary_lists = {
+            'no_scraped_title': [],
+            'no_cover': [],
+            'no_logo': [],
+            'no_marquee': [],
+            'no_video': [],
+            'default_bezel': [],
+            'non_100_bezel_match': []
+        }
+
+    def visit(self, game_data):
+        rom_basename = os.path.basename(game_data.rom_path)
+        bezel_basename = os.path.basename(game_data.bezel_path)
+        append_to_summary_table(self.summary_table, game_data, rom_basename, bezel_basename)
+        append_to_summary_lists(self.summary_lists, game_data, rom_basename, bezel_basename)
+
+    def finish(self):
+        common_utils.write_file(os.path.join(self.output_dir, 'summary_lists.txt'),
+                                format_summary_lists(self.summary_lists), 'w')
+        common_utils.write_csv(os.path.join(self.output_dir, 'summary_table.csv'), self.summary_table)
+
+
+def get_stage(input_path, output_dir=None):
     output_dir = output_dir if output_dir else os.path.abspath(os.path.dirname(input_path))
     if not validate_args(input_path, output_dir):
+        return None
+    return GamelistSummary(output_dir)
+
+
+@tracing.traced()
+def main(input_path, output_dir=None):
+    gamelist_summary = get_stage(input_path, output_dir=output_dir)
+    if not gamelist_summary:
         return False
-    gamelist = common_utils.read_gamelist_tree(input_path).getroot()
-    summary_table = [['Filename', 'Gamelist name', 'Bezel name', 'Bezel match', 'Has cover', 'Has marquee', 'Has logo',
-                      'Has video', ], ]
-    summary_lists = {
-        'no_scraped_title': [],
-        'no_cover': [],
-        'no_logo': [],
-        'no_marquee': [],
-        'no_video': [],
-        'default_bezel': [],
-        'non_100_bezel_match': []
-    }
-    for game_entry in gamelist:
-        game_data = common_utils.parse_game_entry(game_entry)
-        rom_basename = os.path.basename(game_data.get('rom_path', ''))
-        bezel_basename = os.path.basename(game_data.get('bezel_path', ''))
-        append_to_summary_table(summary_table, game_data, rom_basename, bezel_basename)
-        append_to_summary_lists(summary_lists, game_data, rom_basename, bezel_basename)
-    common_utils.write_file(os.path.join(output_dir, 'summary_lists.txt'), format_summary_lists(summary_lists), 'w')
-    common_utils.write_csv(os.path.join(output_dir, 'summary_table.csv'), summary_table)
+    gamelist_stages.run(input_path, [gamelist_summary])
 
 
 if __name__ == "__main__":
@@ -2,22 +2,32 @@
 
 import argparse
 import logging
+import multiprocessing
 
-from shared import common_utils
+from shared import common_utils, help_messages, tracing
 from operations import operations
 
 logger = logging.getLogger(__name__)
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     logging.basicConfig(level=logging.INFO, format="%(levelname)s : %(asctime)s : %(message)s", datefmt="%H:%M:%S")
     parser = argparse.ArgumentParser(prog='ALU UCE Auto Builder')
+    parser.add_argument('--trace', dest='trace', default=None, metavar='TRACE_PATH', help=help_messages.TRACE)
     sub_parsers = parser.add_subparsers(dest='subcommand', title='Subcommands')
     sub_parsers.metavar = 'subcommand-name'
     for operation, spec in operations.items():
         subcommand_parser = sub_parsers.add_parser(operation.replace('_', '-'), help=spec['help'])
         common_utils.add_arguments_to_parser(subcommand_parser, operations[operation]['options'])
     args = vars(parser.parse_args())
-    if args['subcommand']:
-        subcommand = args['subcommand'].replace('-', '_')
-        operations[args['subcommand'].replace('-', '_')]['runner'](args)
+    if args['trace']:
+        tracing.enable()
+    try:
+        if args['subcommand']:
+            subcommand = args['subcommand'].replace('-', '_')
+            operations[args['subcommand'].replace('-', '_')]['runner'](args)
+    finally:
+        # Written even when the operation raises, as that is when the trace is most wanted
+        if args['trace']:
+            common_utils.write_json(args['trace'], tracing.get_trace())
@@ -3,6 +3,7 @@
 import os
 import sys
 import functools
+import multiprocessing
 from pathlib import Path
 import logging
 
@@ -360,6 +361,7 @@ class Controller:
 
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     reset_logging()
     pyqtRemoveInputHook()
     app = QApplication(sys.argv)